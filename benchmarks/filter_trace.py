@@ -0,0 +1,89 @@
+"""Benchmark for filtering traces.
+
+Scales up the sample trace by repeating its rows and compares filtering
+every clause in a separate pass over row dicts, in the order written, with
+the compiled filter plan of filter_and_find, which orders clauses by cost,
+answers clauses from indexes and tests the other clauses in one pass.
+Prints the time of every clause of the plan.
+
+Usage: python benchmarks/filter_trace.py [repeat_count]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core import trace_files  # noqa: E402
+from core.filter_and_find import compile_filter, filter_trace  # noqa: E402
+from core.trace_data import TraceData  # noqa: E402
+
+SAMPLE_TRACE = os.path.join(
+    os.path.dirname(__file__), "..", "traces", "vmp3_32b_11k.tvt"
+)
+FILTERS = [
+    "disasm=push|pop",
+    "regex=ebp/reg_eax=0x0",
+    "regex=ebp/disasm=mov/reg_ecx=0x0",
+    "reg_any=0x0/opcodes=ff",
+    "comment=handler/disasm=jmp",
+    "rows=1000-200000/disasm=mov/rows=5-5000",
+    "mem_read_addr=0x19ff00",
+    "mem_value=0x0/reg_ebx=0x0",
+    "iregex=push|pop|mov",
+]
+
+
+def load_scaled_trace(repeat_count):
+    """Returns the sample trace repeated repeat_count times"""
+    sample = trace_files.open_trace(SAMPLE_TRACE)
+    trace_data = TraceData()
+    trace_data.regs = sample.regs
+    trace_data.trace = trace_files.new_trace(len(sample.regs))
+    for _ in range(repeat_count):
+        trace_data.trace.extend(sample.trace)
+    return trace_data
+
+
+def filter_per_clause(trace, regs, filter_text):
+    """Filters in a separate pass for every clause, like before the plan"""
+    data = trace
+    for stage_clauses, row_range in compile_filter(filter_text, regs).stages:
+        for clause in stage_clauses:
+            test = clause.get_row_test()
+            data = [row for row in data if test(row)]
+        if row_range is not None:
+            data = data[row_range[0] : row_range[1] + 1]
+    return list(data)
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    trace_data = load_scaled_trace(repeat_count)
+    trace = trace_data.trace
+    regs = trace_data.regs
+    print(f"Sample trace repeated {repeat_count} times ({len(trace)} rows)")
+    for filter_text in FILTERS:
+        start = time.perf_counter()
+        old_rows = filter_per_clause(trace, regs, filter_text)
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        rows = filter_trace(trace, regs, filter_text)
+        new_time = time.perf_counter() - start
+        assert [row["id"] for row in rows] == [row["id"] for row in old_rows]
+        print(
+            f"{filter_text:<42} {len(rows):>8} rows  per clause {old_time:7.3f} s"
+            f"  plan {new_time:7.3f} s"
+        )
+        timings = []
+        filter_trace(trace, regs, filter_text, timings)
+        for clause, path, seconds, rows_in, rows_out in timings:
+            print(
+                f"    {clause:<38} {path:<7} {seconds:7.3f} s"
+                f" {rows_in:>9} -> {rows_out} rows"
+            )
+
+
+if __name__ == "__main__":
+    main()
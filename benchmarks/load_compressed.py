@@ -0,0 +1,93 @@
+"""Benchmark for loading compressed traces.
+
+Scales up the sample trace by repeating its rows, compresses it with gzip,
+xz and bz2 and compares decompressing to a file before loading it with
+loading the compressed file directly, where decompression runs in a
+separate thread while rows are decoded.
+
+Usage: python benchmarks/load_compressed.py [repeat_count]
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core import trace_files  # noqa: E402
+from load_tvt import create_scaled_trace  # noqa: E402
+
+# file extensions and openers of compression formats
+FORMATS = {
+    "gz": gzip.open,
+    "xz": lzma.open,
+    "bz2": bz2.open,
+}
+
+
+def compress(filename, extension):
+    """Writes a compressed copy of a file
+
+    Returns:
+        str: Compressed file name
+    """
+    compressed_filename = f"{filename}.{extension}"
+    with open(filename, "rb") as f, FORMATS[extension](
+        compressed_filename, "wb"
+    ) as out:
+        shutil.copyfileobj(f, out)
+    return compressed_filename
+
+
+def decompress_and_load(compressed_filename, extension):
+    """Decompresses a trace to a file and loads the decompressed file"""
+    filename = compressed_filename[: -len(extension) - 1] + ".decompressed.tvt"
+    with FORMATS[extension](compressed_filename, "rb") as f, open(
+        filename, "wb"
+    ) as out:
+        shutil.copyfileobj(f, out, trace_files.READ_BUFFER_SIZE)
+    trace_data = trace_files.open_tv_trace(filename, lazy=False)
+    os.remove(filename)
+    return trace_data
+
+
+def measure(name, func):
+    """Runs a loader and prints rows/second"""
+    start = time.perf_counter()
+    row_count = len(func().trace)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<24} {row_count:>9} rows {elapsed:8.2f} s {row_count / elapsed:>12.0f} rows/s"
+    )
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "scaled.tvt")
+        create_scaled_trace(filename, repeat_count)
+        size = os.path.getsize(filename) / (1024 * 1024)
+        print(f"Sample trace repeated {repeat_count} times ({size:.1f} MiB)")
+        measure("uncompressed", lambda: trace_files.open_tv_trace(filename, lazy=False))
+        for extension in FORMATS:
+            compressed_filename = compress(filename, extension)
+            size = os.path.getsize(compressed_filename) / (1024 * 1024)
+            print(f"{extension} ({size:.1f} MiB)")
+            measure(
+                "decompress, then load",
+                lambda: decompress_and_load(compressed_filename, extension),
+            )
+            measure(
+                "streaming load",
+                lambda: trace_files.open_tv_trace(compressed_filename),
+            )
+            os.remove(compressed_filename)
+
+
+if __name__ == "__main__":
+    main()
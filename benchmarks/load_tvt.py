@@ -0,0 +1,132 @@
+"""Benchmark for loading .tvt traces.
+
+Scales up the sample trace by repeating its rows and compares the rows/second
+of the previous per-field reader with the buffered decoder in trace_files.
+
+Usage: python benchmarks/load_tvt.py [repeat_count]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core import trace_files  # noqa: E402
+from core.trace_data import TraceData  # noqa: E402
+
+SAMPLE_TRACE = os.path.join(
+    os.path.dirname(__file__), "..", "traces", "vmp3_32b_11k.tvt"
+)
+
+
+def create_scaled_trace(filename, repeat_count):
+    """Saves the sample trace repeated repeat_count times
+
+    Args:
+        filename (str): Output file name
+        repeat_count (int): How many times the sample rows are repeated
+    """
+    sample = trace_files.open_trace(SAMPLE_TRACE)
+    trace_data = TraceData()
+    trace_data.arch = sample.arch
+    trace_data.ip_reg = sample.ip_reg
+    trace_data.regs = sample.regs
+    trace_data.pointer_size = sample.pointer_size
+    trace_data.trace = [row.copy() for row in sample.trace] * repeat_count
+    trace_files.save_as_tv_trace(trace_data, filename, version=1)
+
+
+def open_tv_trace_per_field(filename):
+    """Reads rows like the previous open_tv_trace, one f.read() per field
+
+    Args:
+        filename (str): Trace file name
+    Returns:
+        list: Trace rows
+    """
+    with open(filename, "rb") as f:
+        f.read(4)
+        json_length = int.from_bytes(f.read(4), "little")
+        file_info = json.loads(f.read(json_length))
+        regs = file_info["regs"]
+        pointer_size = file_info["pointer_size"]
+        reg_values = [None] * len(regs)
+        trace = []
+        while f.peek(1)[:1] == b"\x00":
+            f.read(1)
+            disasm = f.read(int.from_bytes(f.read(1), "little")).decode()
+            comment = f.read(int.from_bytes(f.read(1), "little")).decode()
+            register_changes = int.from_bytes(f.read(1), "little")
+            memory_accesses = int.from_bytes(f.read(1), "little")
+            flags_and_opcode_size = int.from_bytes(f.read(1), "little")
+            if flags_and_opcode_size >> 7:
+                f.read(4)
+            opcodes = f.read(flags_and_opcode_size & 15)
+            positions = [
+                int.from_bytes(f.read(1), "little") for _ in range(register_changes)
+            ]
+            new_data = [
+                int.from_bytes(f.read(pointer_size), "little")
+                for _ in range(register_changes)
+            ]
+            flags = [
+                int.from_bytes(f.read(1), "little") for _ in range(memory_accesses)
+            ]
+            addresses = [
+                int.from_bytes(f.read(pointer_size), "little")
+                for _ in range(memory_accesses)
+            ]
+            values = [
+                int.from_bytes(f.read(pointer_size), "little")
+                for _ in range(memory_accesses)
+            ]
+            reg_id = 0
+            for i, change in enumerate(positions):
+                reg_id += change
+                if reg_id + i < len(regs):
+                    reg_values[reg_id + i] = new_data[i]
+            mems = []
+            for i, flag in enumerate(flags):
+                access = "WRITE" if flag & 1 else "READ"
+                mems.append(
+                    {"access": access, "addr": addresses[i], "value": values[i]}
+                )
+            trace.append(
+                {
+                    "id": len(trace),
+                    "disasm": disasm,
+                    "comment": comment,
+                    "regs": reg_values.copy(),
+                    "opcodes": opcodes.hex(),
+                    "mem": mems,
+                }
+            )
+        return trace
+
+
+def measure(name, func, filename):
+    """Runs a loader and prints rows/second"""
+    start = time.perf_counter()
+    row_count = len(func(filename))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<24} {row_count:>9} rows {elapsed:8.2f} s {row_count / elapsed:>12.0f} rows/s"
+    )
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "scaled.tvt")
+        create_scaled_trace(filename, repeat_count)
+        size = os.path.getsize(filename) / (1024 * 1024)
+        print(f"Sample trace repeated {repeat_count} times ({size:.1f} MiB)")
+        measure("per-field reader", open_tv_trace_per_field, filename)
+        measure("open_tv_trace", lambda f: trace_files.open_tv_trace(f).trace, filename)
+
+
+if __name__ == "__main__":
+    main()
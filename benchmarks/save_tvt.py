@@ -0,0 +1,132 @@
+"""Benchmark for saving .tvt traces.
+
+Scales up the sample trace by repeating its rows and compares the rows/second
+of the previous writer, which wrote every field with its own f.write() call,
+with the buffered chunk encoders in trace_files.
+
+Usage: python benchmarks/save_tvt.py [repeat_count]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core import trace_files  # noqa: E402
+from core.trace_data import TraceData  # noqa: E402
+
+SAMPLE_TRACE = os.path.join(
+    os.path.dirname(__file__), "..", "traces", "vmp3_32b_11k.tvt"
+)
+
+
+def create_scaled_trace_data(repeat_count):
+    """Returns the sample trace repeated repeat_count times
+
+    Args:
+        repeat_count (int): How many times the sample rows are repeated
+    Returns:
+        TraceData: Trace data with a ColumnarTrace
+    """
+    sample = trace_files.open_trace(SAMPLE_TRACE)
+    trace_data = TraceData()
+    trace_data.arch = sample.arch
+    trace_data.ip_reg = sample.ip_reg
+    trace_data.regs = sample.regs
+    trace_data.pointer_size = sample.pointer_size
+    trace_data.trace = trace_files.new_trace(len(sample.regs))
+    for _ in range(repeat_count):
+        trace_data.trace.extend(sample.trace)
+    return trace_data
+
+
+def save_as_tv_trace_per_field(trace_data, filename):
+    """Writes rows like the previous save_as_tv_trace, one f.write() per field
+
+    Args:
+        trace_data (TraceData): Trace data
+        filename (str): Trace file name
+    """
+    with open(filename, "wb") as f:
+        trace = trace_data.trace
+        pointer_size = trace_data.pointer_size
+        file_info = {
+            "arch": trace_data.arch,
+            "version": "1.0",
+            "pointer_size": pointer_size,
+            "regs": list(trace_data.regs.keys()),
+            "ip_reg": trace_data.ip_reg,
+        }
+        json_blob = json.dumps(file_info)
+        f.write(b"TVTR")
+        f.write(len(json_blob).to_bytes(4, byteorder="little"))
+        f.write(json_blob.encode())
+        for i, t in enumerate(trace):
+            f.write(b"\x00")
+            disasm = t["disasm"][:255]
+            f.write((len(disasm)).to_bytes(1, byteorder="little"))
+            f.write(disasm.encode())
+            comment = t["comment"][:255]
+            f.write((len(comment)).to_bytes(1, byteorder="little"))
+            f.write(comment.encode())
+            reg_change_newdata = []
+            reg_change_positions = []
+            pos = 0
+            for reg_index, reg_value in enumerate(t["regs"]):
+                if i == 0 or reg_value != trace[i - 1]["regs"][reg_index]:
+                    reg_change_newdata.append(reg_value)
+                    reg_change_positions.append(pos)
+                    pos = -1
+                pos += 1
+            f.write((len(reg_change_positions) & 0xFF).to_bytes(1, "little"))
+            f.write((len(t["mem"]) & 0xFF).to_bytes(1, byteorder="little"))
+            opcodes = bytes.fromhex(t["opcodes"])
+            f.write((len(opcodes)).to_bytes(1, byteorder="little"))
+            f.write(opcodes)
+            for pos in reg_change_positions:
+                f.write((pos).to_bytes(1, byteorder="little"))
+            for newdata in reg_change_newdata:
+                f.write((newdata).to_bytes(pointer_size, byteorder="little"))
+            for mem_access in t["mem"]:
+                flag = 1 if mem_access["access"].lower() == "write" else 0
+                f.write((flag).to_bytes(1, byteorder="little"))
+            for mem_access in t["mem"]:
+                f.write((mem_access["addr"]).to_bytes(pointer_size, "little"))
+            for mem_access in t["mem"]:
+                f.write((mem_access["value"]).to_bytes(pointer_size, "little"))
+
+
+def measure(name, func, trace_data, filename):
+    """Runs a writer and prints rows/second and MiB/second"""
+    row_count = len(trace_data.trace)
+    start = time.perf_counter()
+    func(trace_data, filename)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(filename) / (1024 * 1024)
+    print(
+        f"{name:<24} {row_count:>9} rows {elapsed:8.2f} s "
+        f"{row_count / elapsed:>10.0f} rows/s {size / elapsed:>8.1f} MiB/s"
+    )
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    trace_data = create_scaled_trace_data(repeat_count)
+    print(f"Sample trace repeated {repeat_count} times")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "scaled.tvt")
+        measure("per-field writer", save_as_tv_trace_per_field, trace_data, filename)
+        for version in (1, 2):
+            measure(
+                f"save_as_tv_trace v{version}",
+                lambda t, f: trace_files.save_as_tv_trace(t, f, version),
+                trace_data,
+                filename,
+            )
+
+
+if __name__ == "__main__":
+    main()
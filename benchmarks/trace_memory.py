@@ -0,0 +1,120 @@
+"""Benchmark for memory used by a loaded trace.
+
+Scales up the sample trace by repeating its rows, loads it and compares
+memory used by ColumnarTrace with rows stored the previous way:
+memory accesses as lists of dicts per row, a separate disasm and opcode
+string for every row instead of ids to a string pool and a comment string
+for every row instead of a sparse comment store.
+
+Usage: python benchmarks/trace_memory.py [repeat_count]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core import prefs, trace_files  # noqa: E402
+from core.trace_data import TraceData  # noqa: E402
+
+SAMPLE_TRACE = os.path.join(
+    os.path.dirname(__file__), "..", "traces", "vmp3_32b_11k.tvt"
+)
+
+
+def create_scaled_trace(filename, repeat_count):
+    """Saves the sample trace repeated repeat_count times
+
+    Args:
+        filename (str): Output file name
+        repeat_count (int): How many times the sample rows are repeated
+    """
+    sample = trace_files.open_trace(SAMPLE_TRACE)
+    trace_data = TraceData()
+    trace_data.arch = sample.arch
+    trace_data.ip_reg = sample.ip_reg
+    trace_data.regs = sample.regs
+    trace_data.pointer_size = sample.pointer_size
+    trace_data.trace = trace_files.new_trace(len(sample.regs))
+    for _ in range(repeat_count):
+        trace_data.trace.extend(sample.trace)
+    trace_files.save_as_tv_trace(trace_data, filename)
+
+
+def measure(name, func):
+    """Runs func and prints the memory allocated by its result
+
+    Returns:
+        Result of func
+    """
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:<32} {size / (1024 * 1024):10.1f} MiB")
+    return result, size
+
+
+def main():
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    prefs.MMAP_MIN_FILE_SIZE = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "scaled.tvt")
+        create_scaled_trace(filename, repeat_count)
+        trace_data, _size = measure(
+            "trace", lambda: trace_files.open_tv_trace(filename)
+        )
+    trace = trace_data.trace
+    print(f"{len(trace)} rows, {len(trace.mem_addrs)} memory accesses")
+
+    _columns, column_size = measure(
+        "memory access columns",
+        lambda: (
+            trace.mem_offsets[:],
+            trace.mem_flags[:],
+            trace.mem_addrs[:],
+            trace.mem_values[:],
+        ),
+    )
+    _dicts, dict_size = measure(
+        "memory accesses as dicts",
+        lambda: [trace.get_mems(i) or None for i in range(len(trace))],
+    )
+    print(f"Saved {(dict_size - column_size) / (1024 * 1024):.1f} MiB")
+
+    strings = trace.strings.strings
+    _pool, pool_size = measure(
+        "string pool and ids",
+        lambda: (
+            [text.encode().decode() for text in strings],
+            dict(trace.strings.ids),
+            trace.disasm_ids[:],
+            trace.opcode_ids[:],
+        ),
+    )
+    _texts, text_size = measure(
+        "strings per row",
+        lambda: [
+            [strings[i].encode().decode() for i in column]
+            for column in (trace.disasm_ids, trace.opcode_ids)
+        ],
+    )
+    print(f"{len(strings)} unique strings")
+    print(f"Saved {(text_size - pool_size) / (1024 * 1024):.1f} MiB")
+
+    comments = trace.comments
+    _store, store_size = measure(
+        "comment store and index", lambda: comments.get_range(0, len(trace))
+    )
+    _column, column_size = measure(
+        "comment per row",
+        lambda: [comments.get(i).encode().decode() for i in range(len(trace))],
+    )
+    print(f"{len(comments)} commented rows")
+    print(f"Saved {(column_size - store_size) / (1024 * 1024):.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
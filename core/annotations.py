@@ -0,0 +1,209 @@
+import json
+import os
+
+from core.bookmark import Bookmark
+
+JOURNAL_EXT = ".annotations"
+JOURNAL_VERSION = 1
+# journal is compacted when it has this many records and most of them are
+# replaced by newer records
+COMPACT_MIN_RECORDS = 1000
+
+
+class AnnotationJournal:
+    """Append-only journal of comments and bookmarks next to a trace file
+
+    Saving appends only the comments and bookmarks changed since the last
+    save, so the trace file itself is not rewritten. The journal is a JSON
+    Lines file: a header with the size and modification time of the trace
+    file, followed by comment records ({"row": 5, "comment": "..."}) and
+    bookmark records ({"bookmarks": [...]}). Later records replace earlier ones.
+
+    Attributes:
+        filename (str): Journal file name
+        trace_filename (str): Trace file name
+        comments (dict): Journaled comments by row
+        bookmarks (list): Journaled bookmarks, None if not journaled
+        saved_bookmarks (list): Bookmarks at the last load or save
+        record_count (int): Number of records in journal file
+    """
+
+    def __init__(self, trace_filename):
+        """Inits AnnotationJournal.
+
+        Args:
+            trace_filename (str): Trace file name
+        """
+        self.filename = get_journal_filename(trace_filename)
+        self.trace_filename = trace_filename
+        self.comments = {}
+        self.bookmarks = None
+        self.saved_bookmarks = []
+        self.record_count = 0
+
+    def load(self, trace_data):
+        """Applies journaled comments and bookmarks to trace data
+
+        Journal is ignored if the trace file has changed after the journal
+        was created.
+
+        Args:
+            trace_data (TraceData): Trace data loaded from trace_filename
+        Returns:
+            bool: True if journal was applied
+        """
+        self.saved_bookmarks = get_bookmark_values(trace_data.bookmarks)
+        if not self.read():
+            return False
+
+        trace = trace_data.trace
+        for row, comment in self.comments.items():
+            if row in trace_data.changed_comments:
+                continue  # edited while the trace was loading
+            if 0 <= row < len(trace):
+                trace[row]["comment"] = comment
+            else:
+                print(f"Error. Could not set comment to row {row}")
+        if self.bookmarks is not None:
+            trace_data.set_bookmarks([Bookmark(*values) for values in self.bookmarks])
+            self.saved_bookmarks = [list(values) for values in self.bookmarks]
+        return True
+
+    def read(self):
+        """Reads journaled comments and bookmarks without applying them
+
+        Returns:
+            bool: True if journal was read, False if it is missing or the
+                trace file has changed after the journal was created
+        """
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        except IOError:
+            print(f"Error, could not read annotations from {self.filename}")
+            return False
+        if not lines:
+            return False
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        if header.get("trace") != self.get_trace_info():
+            print(f"Annotations in {self.filename} ignored, trace file has changed.")
+            return False
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Error, skipped a broken record in {self.filename}")
+                continue
+            self.record_count += 1
+            if "bookmarks" in record:
+                self.bookmarks = record["bookmarks"]
+            else:
+                self.comments[record["row"]] = record["comment"]
+        return True
+
+    def save(self, trace_data):
+        """Appends changed comments and bookmarks to journal
+
+        Args:
+            trace_data (TraceData): Trace data
+        Returns:
+            bool: True if saved
+        """
+        records = []
+        for row in sorted(trace_data.changed_comments):
+            comment = trace_data.trace[row]["comment"]
+            if self.comments.get(row) != comment:
+                self.comments[row] = comment
+                records.append({"row": row, "comment": comment})
+        bookmarks = get_bookmark_values(trace_data.bookmarks)
+        if bookmarks != self.saved_bookmarks:
+            self.bookmarks = bookmarks
+            records.append({"bookmarks": bookmarks})
+
+        if records:
+            if self.record_count == 0:
+                mode = "w"
+                header = {"version": JOURNAL_VERSION, "trace": self.get_trace_info()}
+                records.insert(0, header)
+            else:
+                mode = "a"
+            try:
+                with open(self.filename, mode, encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record) + "\n")
+            except IOError:
+                print(f"Error, could not write annotations to {self.filename}")
+                return False
+            self.record_count += len(records) - (mode == "w")
+
+        trace_data.changed_comments.clear()
+        self.saved_bookmarks = bookmarks
+        if self.record_count >= COMPACT_MIN_RECORDS and self.record_count > 2 * (
+            len(self.comments) + 1
+        ):
+            return self.compact()
+        return True
+
+    def compact(self):
+        """Rewrites journal with one record per row and one for bookmarks
+
+        Returns:
+            bool: True if compacted
+        """
+        records = [{"version": JOURNAL_VERSION, "trace": self.get_trace_info()}]
+        for row in sorted(self.comments):
+            records.append({"row": row, "comment": self.comments[row]})
+        if self.bookmarks is not None:
+            records.append({"bookmarks": self.bookmarks})
+        temp_filename = self.filename + ".tmp"
+        try:
+            with open(temp_filename, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(temp_filename, self.filename)
+        except IOError:
+            print(f"Error, could not compact annotations in {self.filename}")
+            return False
+        self.record_count = len(records) - 1
+        return True
+
+    def get_trace_info(self):
+        """Returns size and modification time of the trace file"""
+        try:
+            stat = os.stat(self.trace_filename)
+        except OSError:
+            return None
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def get_journal_filename(trace_filename):
+    """Returns annotation journal file name of a trace file"""
+    return trace_filename + JOURNAL_EXT
+
+
+def remove_journal(trace_filename):
+    """Removes annotation journal of a trace file
+
+    Called when annotations are saved to the trace file itself.
+
+    Args:
+        trace_filename (str): Trace file name
+    """
+    try:
+        os.remove(get_journal_filename(trace_filename))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        print(f"Error, could not remove {get_journal_filename(trace_filename)}")
+
+
+def get_bookmark_values(bookmarks):
+    """Returns bookmarks as lists of Bookmark init arguments"""
+    return [[b.addr, b.disasm, b.startrow, b.endrow, b.comment] for b in bookmarks]
@@ -61,6 +61,20 @@ class Api:
         """
         return self.main_window.get_string_from_user(title, label)
 
+    def get_thread_rows(self, thread: int):
+        """Returns rows executed by a thread, uses per-thread row index
+
+        Args:
+            thread (int): Thread id
+        Returns:
+            list: Trace rows
+        """
+        return self.main_window.trace_data.get_thread_rows(thread)
+
+    def get_threads(self):
+        """Returns sorted list of thread ids in trace"""
+        return self.main_window.trace_data.get_threads()
+
     def get_values_from_user(self, title: str, data: list, on_ok_clicked=None):
         """Get input from user. Data types: str, int, list, bool.
 
@@ -131,10 +145,7 @@ class Api:
             row (int): A row index in full trace
             comment (str): A comment text
         """
-        try:
-            self.main_window.trace_data.trace[row]["comment"] = str(comment)
-        except IndexError:
-            print(f"Error. Could not set comment to row {row}")
+        self.main_window.trace_data.set_comment(row, comment)
 
     def set_filtered_trace(self, trace):
         """Sets filtered_trace
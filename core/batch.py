@@ -0,0 +1,345 @@
+import os
+import traceback
+
+from yapsy.PluginManager import PluginManager
+
+from core import prefs, trace_export, trace_files
+from core.api import Api
+from core.filter_and_find import filter_trace
+from core.trace_data import TraceData
+
+# output formats: save function and file extension
+OUTPUT_FORMATS = {
+    "tvt": (trace_files.save_as_tv_trace, ".tvt"),
+    "json": (trace_files.save_as_json, ".json"),
+    "jsonl": (trace_files.save_as_jsonl, ".jsonl"),
+}
+
+# plugins of the viewer, used when no plugin dir is given
+PLUGIN_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"
+)
+# plugins loaded in this process, by plugin dir
+_plugin_managers = {}
+
+
+class BatchOptions:
+    """Options of batch processing, same for every file
+
+    Attributes:
+        filter_text (str): Filter for filter_trace(), empty for no filter
+        plugins (list): Names of plugins to run, in order
+        plugin_dir (str): Plugin directory
+        output_dir (str): Directory for processed traces, None to not save
+        output_format (str): Key of OUTPUT_FORMATS
+        answer_yes (bool): Answer yes to questions of plugins
+        values (dict): Answers to input dialogs of plugins by label
+        rows (tuple): First and last row to export without loading the
+            whole trace, None to load and process the whole trace
+    """
+
+    def __init__(
+        self,
+        filter_text="",
+        plugins=None,
+        plugin_dir=PLUGIN_DIR,
+        output_dir=None,
+        output_format="tvt",
+        answer_yes=False,
+        values=None,
+        rows=None,
+    ):
+        self.filter_text = filter_text
+        self.plugins = plugins or []
+        self.plugin_dir = plugin_dir
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.answer_yes = answer_yes
+        self.values = values or {}
+        self.rows = rows
+
+
+class HeadlessApi(Api):
+    """Api for plugins without the GUI
+
+    Methods which show something in the GUI print to stdout or do nothing.
+    Questions are answered with BatchOptions.answer_yes and input dialogs
+    with BatchOptions.values or the default values of the dialog.
+
+    Attributes:
+        trace_data (TraceData): Trace data
+        filtered_trace (list): Filtered trace, None if trace is not filtered
+        options (BatchOptions): Batch options
+    """
+
+    def __init__(self, trace_data, options):
+        """Inits HeadlessApi."""
+        super().__init__(None)
+        self.trace_data = trace_data
+        self.filtered_trace = None
+        self.options = options
+
+    def add_bookmark(self, bookmark, replace=False):
+        self.trace_data.add_bookmark(bookmark, replace)
+
+    def ask_user(self, title: str, question: str):
+        answer = "yes" if self.options.answer_yes else "no"
+        print(f"{title}: {question} ({answer})")
+        return self.options.answer_yes
+
+    def get_bookmarks(self):
+        return self.trace_data.get_bookmarks()
+
+    def get_filtered_trace(self):
+        if self.filtered_trace is None:
+            return []  # like the GUI without a filter
+        return self.filtered_trace
+
+    def get_full_trace(self):
+        return self.trace_data.trace
+
+    def get_main_window(self):
+        return None
+
+    def get_string_from_user(self, title: str, label: str):
+        return str(self.options.values.get(label, ""))
+
+    def get_thread_rows(self, thread: int):
+        return self.trace_data.get_thread_rows(thread)
+
+    def get_threads(self):
+        return self.trace_data.get_threads()
+
+    def get_values_from_user(self, title: str, data: list, on_ok_clicked=None):
+        values = []
+        for item in data:
+            default = item["data"]
+            value = self.options.values.get(item["label"])
+            if isinstance(default, list):
+                value = int(value) if value is not None else 0
+            elif value is None:
+                value = default
+            elif isinstance(default, bool):
+                value = value.lower() in ("1", "true", "yes")
+            elif isinstance(default, int):
+                value = int(value, 0)
+            values.append(value)
+        if on_ok_clicked and not on_ok_clicked(values):
+            return []
+        return values
+
+    def get_selected_bookmarks(self):
+        return []
+
+    def get_selected_trace(self):
+        return []
+
+    def get_selected_trace_row_ids(self):
+        return []
+
+    def get_trace_data(self):
+        return self.trace_data
+
+    def get_visible_trace(self):
+        if self.filtered_trace is not None:
+            return self.filtered_trace
+        return self.trace_data.trace
+
+    def get_regs(self):
+        return self.trace_data.get_regs()
+
+    def go_to_row_in_full_trace(self, row_id: int):
+        pass
+
+    def go_to_row_in_current_trace(self, row_index: int):
+        pass
+
+    def print(self, text: str):
+        print(text)
+
+    def set_comment(self, row: int, comment: str):
+        self.trace_data.set_comment(row, comment)
+
+    def set_filtered_trace(self, trace):
+        self.filtered_trace = trace
+
+    def show_filtered_trace(self):
+        pass
+
+    def show_messagebox(self, title: str, msg: str):
+        print(f"{title}: {msg}")
+
+    def update_trace_table(self):
+        pass
+
+    def update_bookmark_table(self):
+        pass
+
+
+def get_plugins(plugin_dir, names):
+    """Returns plugins by name, plugins are loaded once per process
+
+    Args:
+        plugin_dir (str): Plugin directory
+        names (list): Plugin names or module names
+    Returns:
+        list: Plugin infos of yapsy, in the order of names
+    Raises:
+        ValueError: If a plugin is not found
+    """
+    manager = _plugin_managers.get(plugin_dir)
+    if manager is None:
+        manager = PluginManager()
+        manager.setPluginPlaces([plugin_dir])
+        manager.collectPlugins()
+        _plugin_managers[plugin_dir] = manager
+    plugins = []
+    for name in names:
+        for plugin in manager.getAllPlugins():
+            module_name = os.path.basename(plugin.path)
+            if name in (plugin.name, module_name):
+                plugins.append(plugin)
+                break
+        else:
+            raise ValueError(f"Plugin not found: {name}")
+    return plugins
+
+
+def get_output_filename(filename, options):
+    """Returns name of processed trace file in output dir"""
+    name = os.path.basename(filename)
+    for extension in (".gz", ".xz", ".bz2"):
+        if name.endswith(extension):
+            name = name[: -len(extension)]
+    name = os.path.splitext(name)[0]
+    return os.path.join(
+        options.output_dir, name + OUTPUT_FORMATS[options.output_format][1]
+    )
+
+
+def new_trace_data(trace_data, rows):
+    """Returns a copy of trace data with only the given rows
+
+    Bookmarks are not copied, their row numbers do not match the new trace.
+
+    Args:
+        trace_data (TraceData): Trace data
+        rows: Trace rows
+    Returns:
+        TraceData: New trace data
+    """
+    new_data = TraceData()
+    new_data.arch = trace_data.arch
+    new_data.ip_reg = trace_data.ip_reg
+    new_data.regs = trace_data.regs
+    new_data.pointer_size = trace_data.pointer_size
+    if trace_data.regs:
+        new_data.trace = trace_files.new_trace(len(trace_data.regs))
+    else:
+        new_data.trace = []
+    for row in rows:
+        row = row.copy()
+        row["id"] = len(new_data.trace)
+        new_data.trace.append(row)
+    return new_data
+
+
+def process_file(filename, options):
+    """Loads, filters and saves a trace and runs plugins on it
+
+    If options.rows is set, only the row range is exported to a tvt file.
+    Runs in worker processes when many files are processed.
+
+    Args:
+        filename (str): Trace file name
+        options (BatchOptions): Batch options
+    Returns:
+        dict: Results: filename, rows, visible_rows, output and error
+    """
+    result = {"filename": filename, "rows": 0, "visible_rows": 0}
+    result["output"] = result["error"] = None
+    try:
+        if options.rows is not None:
+            output = get_output_filename(filename, options)
+            row_count = trace_export.export_rows(filename, output, *options.rows)
+            result["rows"] = result["visible_rows"] = row_count
+            result["output"] = output
+            return result
+        trace_data = trace_files.open_trace(filename)
+        if trace_data is None:
+            raise ValueError("could not load trace")
+        result["rows"] = len(trace_data.trace)
+        api = HeadlessApi(trace_data, options)
+        if options.filter_text:
+            api.set_filtered_trace(
+                filter_trace(trace_data.trace, trace_data.regs, options.filter_text)
+            )
+        for plugin in get_plugins(options.plugin_dir, options.plugins):
+            plugin.plugin_object.execute(api)
+        visible_trace = api.get_visible_trace()
+        result["visible_rows"] = len(visible_trace)
+
+        if options.output_dir is not None:
+            if api.filtered_trace is not None:
+                trace_data = new_trace_data(trace_data, visible_trace)
+            output = get_output_filename(filename, options)
+            save = OUTPUT_FORMATS[options.output_format][0]
+            if save(trace_data, output) is False:
+                raise IOError(f"could not save {output}")
+            result["output"] = output
+    except Exception as exc:
+        result["error"] = str(exc)
+        if prefs.DEBUG:
+            print(traceback.format_exc())
+    return result
+
+
+def process_files(filenames, options, workers=None):
+    """Processes trace files, in worker processes if there are many
+
+    Every file is loaded in one process, so prefs.WORKERS is set to 1 in
+    worker processes.
+
+    Args:
+        filenames (list): Trace file names
+        options (BatchOptions): Batch options
+        workers (int, optional): Number of worker processes.
+            Defaults to trace_files.get_worker_count().
+    Yields:
+        dict: Results of process_file(), in the order of filenames
+    """
+    if options.output_dir is not None:
+        os.makedirs(options.output_dir, exist_ok=True)
+    if workers is None:
+        workers = trace_files.get_worker_count()
+    workers = min(workers, len(filenames))
+    if workers <= 1:
+        for filename in filenames:
+            yield process_file(filename, options)
+        return
+    # prefs changed at runtime are not seen by spawned workers
+    worker_prefs = {name: getattr(prefs, name) for name in dir(prefs) if name.isupper()}
+    pool = trace_files.create_process_pool(workers)
+    try:
+        futures = [
+            pool.submit(process_file_in_worker, filename, options, worker_prefs)
+            for filename in filenames
+        ]
+        for future in futures:
+            yield future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def process_file_in_worker(filename, options, worker_prefs):
+    """Runs process_file() in a worker process without nested workers
+
+    Args:
+        filename (str): Trace file name
+        options (BatchOptions): Batch options
+        worker_prefs (dict): Values of prefs in the main process by name
+    """
+    for name, value in worker_prefs.items():
+        setattr(prefs, name, value)
+    prefs.WORKERS = 1
+    return process_file(filename, options)
@@ -0,0 +1,198 @@
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import threading
+
+# magic bytes and openers of compressed trace files
+COMPRESSED_FORMATS = {
+    b"\x1f\x8b": gzip.open,
+    b"\xfd7zXZ\x00": lzma.open,
+    b"BZh": bz2.open,
+}
+# size of decompressed chunks passed from the decompression thread
+CHUNK_SIZE = 16 * 1024 * 1024
+# max number of decompressed chunks waiting to be read
+QUEUE_CHUNKS = 4
+# seconds between checks if the reader was closed while the queue is full
+PUT_TIMEOUT = 0.1
+
+
+def get_opener(filename):
+    """Returns opener of a compressed file
+
+    Args:
+        filename (str): File name
+    Returns:
+        callable: gzip.open, lzma.open or bz2.open, None if file is not
+            compressed
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(max(len(magic) for magic in COMPRESSED_FORMATS))
+    for format_magic, opener in COMPRESSED_FORMATS.items():
+        if magic.startswith(format_magic):
+            return opener
+    return None
+
+
+def open_file(filename):
+    """Opens a trace file for reading, compressed files are decompressed
+
+    Args:
+        filename (str): File name
+    Returns:
+        File object, DecompressingReader if file is compressed
+    """
+    opener = get_opener(filename)
+    if opener is None:
+        return open(filename, "rb")
+    return DecompressingReader(filename, opener)
+
+
+def read_magic(filename, size=4):
+    """Returns the first bytes of a file, decompressed if needed"""
+    opener = get_opener(filename) or open
+    with opener(filename, "rb") as f:
+        return f.read(size)
+
+
+def get_read_position(f, unread=0):
+    """Returns how far a file has been read, for progress callbacks
+
+    Args:
+        f: File object from open_file()
+        unread (int): Bytes read from f but not used yet
+    Returns:
+        int: Position in file, compressed position for compressed files
+    """
+    if isinstance(f, DecompressingReader):
+        return f.get_compressed_position()
+    return f.tell() - unread
+
+
+def get_file_size(f):
+    """Returns size of file on disk, compressed size for compressed files"""
+    return os.fstat(f.fileno()).st_size
+
+
+class DecompressingReader:
+    """Read-only file object which decompresses in a background thread
+
+    Decompression runs in a separate thread and overlaps with decoding the
+    trace. zlib, lzma and bz2 release the GIL while they decompress.
+
+    Attributes:
+        raw (file): Compressed file
+        chunks (Queue): Decompressed chunks and compressed positions, None
+            at the end of file
+        error (Exception): Error raised in decompression thread
+        closed (bool): True if close() was called
+    """
+
+    def __init__(self, filename, opener):
+        """Inits DecompressingReader and starts decompressing
+
+        Args:
+            filename (str): Compressed file name
+            opener (callable): gzip.open, lzma.open or bz2.open
+        """
+        self.raw = open(filename, "rb")
+        self.decompressor = opener(self.raw, "rb")
+        self.chunks = queue.Queue(QUEUE_CHUNKS)
+        self.buffer = b""
+        self.buffer_pos = 0
+        self.pos = 0
+        self.compressed_pos = 0
+        self.eof = False
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.decompress, daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        """Decompresses chunks to queue, runs in decompression thread"""
+        try:
+            while not self.closed:
+                chunk = self.decompressor.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.put((chunk, self.raw.tell()))
+        except Exception as exc:
+            self.error = exc
+        self.put(None)
+
+    def put(self, item):
+        """Puts an item to queue, gives up if reader is closed"""
+        while not self.closed:
+            try:
+                self.chunks.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def next_chunk(self):
+        """Gets the next decompressed chunk to buffer
+
+        Returns:
+            bool: False at the end of file
+        """
+        if self.eof:
+            return False
+        item = self.chunks.get()
+        if item is None:
+            self.eof = True
+            if self.error is not None:
+                raise IOError(f"Could not decompress: {self.error}")
+            return False
+        self.buffer, self.compressed_pos = item
+        self.buffer_pos = 0
+        return True
+
+    def read(self, size=-1):
+        """Reads up to size bytes, all remaining bytes if size is negative"""
+        parts = []
+        while size != 0:
+            available = len(self.buffer) - self.buffer_pos
+            if available == 0:
+                if not self.next_chunk():
+                    break
+                continue
+            count = available if size < 0 else min(size, available)
+            if count == len(self.buffer) and self.buffer_pos == 0:
+                parts.append(self.buffer)
+            else:
+                parts.append(self.buffer[self.buffer_pos : self.buffer_pos + count])
+            self.buffer_pos += count
+            if size > 0:
+                size -= count
+        data = b"".join(parts)
+        self.pos += len(data)
+        return data
+
+    def tell(self):
+        """Returns position in decompressed data"""
+        return self.pos
+
+    def get_compressed_position(self):
+        """Returns position in compressed file of the data read so far"""
+        return self.compressed_pos
+
+    def fileno(self):
+        """Returns file descriptor of the compressed file"""
+        return self.raw.fileno()
+
+    def close(self):
+        """Stops decompression thread and closes files"""
+        if self.closed:
+            return
+        self.closed = True
+        self.thread.join()
+        self.decompressor.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
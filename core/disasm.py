@@ -0,0 +1,261 @@
+import json
+import os
+
+from capstone import Cs, CS_ARCH_X86
+
+from core import prefs
+
+DISASSEMBLERS = {}
+DISASM_CACHES = {}
+
+
+class DisasmCache:
+    """Cache of disassembled instructions
+
+    Instructions which disassemble to the same text at any address are stored
+    by opcodes only and shared across addresses. Others (relative jumps and
+    calls, rip-relative operands) are stored by opcodes and address.
+
+    Attributes:
+        capstone_mode (int): CS_MODE_32 or CS_MODE_64
+        shared (dict): Disasm texts by opcodes
+        by_address (dict): Disasm texts by (opcodes, address)
+        hits (int): Number of instructions found from cache, or disassembled
+            earlier in the same batch
+        misses (int): Number of instructions which had to be disassembled
+        changed (bool): True if instructions were added after loading
+    """
+
+    def __init__(self, capstone_mode):
+        """Inits DisasmCache.
+
+        Args:
+            capstone_mode (int): CS_MODE_32 or CS_MODE_64
+        """
+        self.capstone_mode = capstone_mode
+        self.shared = {}
+        self.by_address = {}
+        self.hits = 0
+        self.misses = 0
+        self.changed = False
+
+    def get(self, opcodes, ip):
+        """Returns disasm text of instruction
+
+        Args:
+            opcodes (bytes): Opcodes
+            ip (int): Address of instruction
+        Returns:
+            str: Disasm text, None if not found
+        """
+        disasm = self.shared.get(opcodes)
+        if disasm is None:
+            disasm = self.by_address.get((opcodes, ip))
+            if disasm is None:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return disasm
+
+    def add(self, opcodes, ip, disasm, position_independent):
+        """Adds an instruction to cache
+
+        Args:
+            opcodes (bytes): Opcodes
+            ip (int): Address of instruction
+            disasm (str): Disasm text
+            position_independent (bool): True if disasm text is same at any address
+        """
+        if position_independent:
+            self.shared[opcodes] = disasm
+        else:
+            self.by_address[(opcodes, ip)] = disasm
+        self.changed = True
+
+    def get_hit_rate(self):
+        """Returns share of instructions found from cache
+
+        Returns:
+            float: Hit rate between 0 and 1
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def to_dict(self):
+        """Returns cached instructions as a JSON compatible dict"""
+        return {
+            "shared": {opcodes.hex(): text for opcodes, text in self.shared.items()},
+            "by_address": {
+                f"{opcodes.hex()}:{ip:x}": text
+                for (opcodes, ip), text in self.by_address.items()
+            },
+        }
+
+    def update_from_dict(self, data):
+        """Adds instructions from a dict created by to_dict()"""
+        for opcodes, text in data.get("shared", {}).items():
+            self.shared[bytes.fromhex(opcodes)] = text
+        for key, text in data.get("by_address", {}).items():
+            opcodes, ip = key.split(":")
+            self.by_address[(bytes.fromhex(opcodes), int(ip, 16))] = text
+
+
+class DisasmRequest:
+    """Disassembles a batch of instructions using DisasmCache
+
+    Only instructions missing from the cache are disassembled, in a worker
+    process if a pool is given.
+    """
+
+    def __init__(self, cache, opcodes_list, ips, pool=None):
+        """Inits DisasmRequest and starts disassembling
+
+        Args:
+            cache (DisasmCache): Disasm cache
+            opcodes_list (list): Opcodes of instructions
+            ips (list): Addresses of instructions
+            pool (ProcessPoolExecutor, optional): Pool for disassembling
+        """
+        self.cache = cache
+        self.disasm_list = []
+        # rows of every missing instruction
+        self.missing = {}
+        for i, (opcodes, ip) in enumerate(zip(opcodes_list, ips)):
+            rows = self.missing.get((opcodes, ip))
+            if rows is not None:
+                # disassembled only once, count repeats as hits
+                rows.append(i)
+                cache.hits += 1
+                self.disasm_list.append(None)
+                continue
+            disasm = cache.get(opcodes, ip)
+            if disasm is None:
+                self.missing.setdefault((opcodes, ip), []).append(i)
+            self.disasm_list.append(disasm)
+
+        args = (
+            cache.capstone_mode,
+            [opcodes for opcodes, _ip in self.missing],
+            [ip for _opcodes, ip in self.missing],
+        )
+        if pool is None or not self.missing:
+            self.future = None
+            self.add_results(disasm_batch(*args))
+        else:
+            self.future = pool.submit(disasm_batch, *args)
+
+    def done(self):
+        """Returns True if disassembling is finished"""
+        return self.future is None or self.future.done()
+
+    def result(self):
+        """Waits until the batch is disassembled
+
+        Returns:
+            list: Disasm texts of instructions
+        """
+        if self.future is not None:
+            self.add_results(self.future.result())
+            self.future = None
+        return self.disasm_list
+
+    def add_results(self, results):
+        """Adds disassembled instructions to cache and to disasm_list"""
+        for ((opcodes, ip), rows), (disasm, position_independent) in zip(
+            self.missing.items(), results
+        ):
+            self.cache.add(opcodes, ip, disasm, position_independent)
+            for row in rows:
+                self.disasm_list[row] = disasm
+
+
+def disasm_batch(capstone_mode, opcodes_list, ips):
+    """Disassembles a batch of instructions
+
+    Runs in worker processes, every process creates its own Cs instance.
+    Every instruction is disassembled at a second address too, to find out
+    if the disasm text depends on the address.
+
+    Args:
+        capstone_mode (int): CS_MODE_32 or CS_MODE_64
+        opcodes_list (list): Opcodes of instructions
+        ips (list): Addresses of instructions
+    Returns:
+        list: (disasm, position_independent) tuples, disasm is an empty string
+            if opcodes could not be disassembled
+    """
+    md = DISASSEMBLERS.get(capstone_mode)
+    if md is None:
+        md = DISASSEMBLERS[capstone_mode] = Cs(CS_ARCH_X86, capstone_mode)
+    result = []
+    for opcodes, ip in zip(opcodes_list, ips):
+        disasm = disassemble(md, opcodes, ip)
+        position_independent = disasm == disassemble(md, opcodes, ip ^ 0x1000)
+        result.append((disasm, position_independent))
+    return result
+
+
+def disassemble(md, opcodes, ip):
+    """Returns disasm text of the last instruction in opcodes"""
+    disasm = ""
+    for _address, _size, mnemonic, op_str in md.disasm_lite(opcodes, ip):
+        disasm = mnemonic
+        if op_str:
+            disasm += " " + op_str
+    return disasm
+
+
+def get_disasm_cache(capstone_mode):
+    """Returns shared DisasmCache for a capstone mode
+
+    The cache is loaded from prefs.DISASM_CACHE_FILE on first use.
+
+    Args:
+        capstone_mode (int): CS_MODE_32 or CS_MODE_64
+    Returns:
+        DisasmCache
+    """
+    cache = DISASM_CACHES.get(capstone_mode)
+    if cache is None:
+        cache = DISASM_CACHES[capstone_mode] = DisasmCache(capstone_mode)
+        data = read_disasm_cache_file()
+        cache.update_from_dict(data.get(str(capstone_mode), {}))
+    return cache
+
+
+def save_disasm_cache(cache):
+    """Saves DisasmCache to prefs.DISASM_CACHE_FILE if it has changed
+
+    Args:
+        cache (DisasmCache): Disasm cache
+    """
+    filename = prefs.DISASM_CACHE_FILE
+    if not filename or not cache.changed:
+        return
+    data = read_disasm_cache_file()
+    data[str(cache.capstone_mode)] = cache.to_dict()
+    # write to a temporary file first, so an interrupted write keeps the old cache
+    temp_filename = filename + ".tmp"
+    try:
+        with open(temp_filename, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_filename, filename)
+    except IOError:
+        print(f"Error, could not write disasm cache to {filename}")
+    else:
+        cache.changed = False
+
+
+def read_disasm_cache_file():
+    """Returns contents of prefs.DISASM_CACHE_FILE, empty dict if not found"""
+    filename = prefs.DISASM_CACHE_FILE
+    if not filename or not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        print(f"Error, could not read disasm cache from {filename}")
+    return {}
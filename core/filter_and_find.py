@@ -1,5 +1,20 @@
 import re
+from bisect import bisect_left, bisect_right
 from enum import Enum, auto
+from itertools import compress
+from time import perf_counter
+
+from core.trace_data import format_search_text
+
+# filter keywords of memory accesses: compared field and access type
+MEM_FILTERS = {
+    "mem_value": ("value", None),
+    "mem_read_value": ("value", "READ"),
+    "mem_write_value": ("value", "WRITE"),
+    "mem_addr": ("addr", None),
+    "mem_read_addr": ("addr", "READ"),
+    "mem_write_addr": ("addr", "WRITE"),
+}
 
 
 class TraceField(Enum):
@@ -41,6 +56,14 @@ def find(
 
     if field == TraceField.DISASM:
         keywords = keyword.split("/")
+        if hasattr(trace, "get_text_postings"):
+
+            def condition(disasm):
+                return any(key in disasm for key in keywords)
+
+            postings = trace.get_text_postings("disasm", condition)
+            found = [find_in_rows(rows, start_row, direction) for rows in postings]
+            return nearest_row(found, direction)
         for row in range(start_row, last_row, direction):
             disasm = trace[row]["disasm"]
             for key in keywords:
@@ -49,6 +72,9 @@ def find(
 
     elif field == TraceField.REGS:
         value = int(keyword, 16)
+        if hasattr(trace, "get_reg_value_ranges"):
+            ranges = trace.get_reg_value_ranges(value)
+            return find_in_ranges(ranges, start_row, direction)
         for row in range(start_row, last_row, direction):
             if value in trace[row]["regs"]:
                 return row
@@ -65,6 +91,8 @@ def find(
     elif field == TraceField.MEM_ADDR:
         keyword = keyword.strip()
         addr = int(keyword, 16)
+        if hasattr(trace, "get_mem_addr_rows"):
+            return find_in_rows(trace.get_mem_addr_rows(addr), start_row, direction)
         for row in range(start_row, last_row, direction):
             for mem in trace[row]["mem"]:
                 if addr == mem["addr"]:
@@ -73,12 +101,17 @@ def find(
     elif field == TraceField.MEM_VALUE:
         keyword = keyword.strip()
         value = int(keyword, 16)
+        if hasattr(trace, "get_mem_value_rows"):
+            return find_in_rows(trace.get_mem_value_rows(value), start_row, direction)
         for row in range(start_row, last_row, direction):
             for mem in trace[row]["mem"]:
                 if value == mem["value"]:
                     return row
 
     elif field == TraceField.COMMENT:
+        comments = get_comment_store(trace)
+        if comments is not None:
+            return comments.find_next(keyword, start_row, direction)
         for row in range(start_row, last_row, direction):
             if keyword in trace[row].get("comment", ""):
                 return row
@@ -88,6 +121,14 @@ def find(
         if keyword.startswith("0x"):
             keyword_int = int(keyword, 16)
 
+        int_row = None
+        if keyword_int and hasattr(trace, "get_reg_value_ranges"):
+            # find the value from indexes, scan only rows before it for text
+            int_row = find_value(trace, keyword_int, start_row, direction)
+            keyword_int = None
+            if int_row is not None:
+                last_row = int_row
+
         for row in range(start_row, last_row, direction):
             if keyword in trace[row].get("comment", ""):
                 return row
@@ -101,6 +142,7 @@ def find(
                 return row
             if keyword_int and keyword_int in trace[row]["regs"]:
                 return row
+        return int_row
 
     else:
         raise ValueError("Unknown field")
@@ -108,117 +150,556 @@ def find(
     return None
 
 
-def filter_trace(trace: list, regs: dict, filter_text: str):
+def find_value(trace, value: int, start_row: int, direction: int = 1):
+    """Finds next/previous row with a value in registers or memory accesses
+
+    Args:
+        trace: Trace with register value and memory indexes
+        value (int): Register value, memory address or memory value
+        start_row (int): Trace row number to start search, included
+        direction (int, optional): Search direction, 1 for forward, -1 for backward
+            Defaults to 1.
+    Returns:
+        Trace row number, None if nothing found
+    """
+    found = [
+        find_in_ranges(trace.get_reg_value_ranges(value), start_row, direction),
+        find_in_rows(trace.get_mem_addr_rows(value), start_row, direction),
+        find_in_rows(trace.get_mem_value_rows(value), start_row, direction),
+    ]
+    return nearest_row(found, direction)
+
+
+def nearest_row(found, direction: int = 1):
+    """Returns the first found row in search direction
+
+    Args:
+        found (list): Found trace row numbers or None
+        direction (int, optional): Search direction, 1 for forward, -1 for backward
+            Defaults to 1.
+    Returns:
+        Trace row number, None if nothing found
+    """
+    found = [row for row in found if row is not None]
+    if not found:
+        return None
+    return min(found) if direction > 0 else max(found)
+
+
+def find_in_ranges(ranges, start_row: int, direction: int = 1):
+    """Finds next/previous row from sorted row ranges
+
+    Args:
+        ranges (list): Sorted, non-overlapping (first row, end row) tuples
+        start_row (int): Trace row number to start search, included
+        direction (int, optional): Search direction, 1 for forward, -1 for backward
+            Defaults to 1.
+    Returns:
+        Trace row number, None if nothing found
+    """
+    if direction < 0:
+        i = bisect_right(ranges, (start_row, float("inf"))) - 1
+        return min(ranges[i][1] - 1, start_row) if i >= 0 else None
+    i = bisect_left(ranges, (start_row + 1,)) - 1
+    if i >= 0 and ranges[i][1] > start_row:
+        return start_row
+    return ranges[i + 1][0] if i + 1 < len(ranges) else None
+
+
+def find_in_rows(rows, start_row: int, direction: int = 1):
+    """Finds next/previous row from sorted row indexes
+
+    Args:
+        rows (list): Sorted row indexes
+        start_row (int): Trace row number to start search, included
+        direction (int, optional): Search direction, 1 for forward, -1 for backward
+            Defaults to 1.
+    Returns:
+        Trace row number, None if nothing found
+    """
+    if direction < 0:
+        i = bisect_right(rows, start_row) - 1
+        return rows[i] if i >= 0 else None
+    i = bisect_left(rows, start_row)
+    return rows[i] if i < len(rows) else None
+
+
+def filter_trace(trace: list, regs: dict, filter_text: str, timings: list = None):
     """Filters trace
 
+    The filter is compiled to a FilterPlan, which runs all clauses in one
+    pass over the rows, see compile_filter().
+
     Args:
         trace (list): Traced instructions, registers and memory (TraceData.trace)
         filter_text (str): Filter text
         regs (dict): Register names and indexes (TraceData.regs)
+        timings (list, optional): Filled with a (clause, path, seconds,
+            rows in, rows out) tuple for every clause
     Raises:
       ValueError: If unknown keywords or wrong filter format
     Returns:
         List of filtered trace records
     """
-    data = trace
     if len(filter_text) == 0:
-        return data
-    filters = filter_text.split("/")
-    if not filters or not data:
+        return trace
+    if not trace:
         raise ValueError("Empty trace or filter")
-    value = ""
+    plan = compile_filter(filter_text, regs)
+    rows = plan.run(trace, profile=timings is not None)
+    if timings is not None:
+        timings.extend(plan.timings)
+    return rows
+
+
+def compile_filter(filter_text: str, regs: dict):
+    """Compiles filter text to a FilterPlan
 
+    Args:
+        filter_text (str): Filter text, clauses separated by "/"
+        regs (dict): Register names and indexes (TraceData.regs)
+    Raises:
+      ValueError: If unknown keywords or wrong filter format
+    Returns:
+        FilterPlan: Compiled filter
+    """
+    filters = filter_text.split("/")
+    if not filters:
+        raise ValueError("Empty trace or filter")
+    stages = []
+    clauses = []
     for f in filters:
         f_parts = f.split("=")
         if len(f_parts) != 2 or not f_parts[1]:
             raise ValueError("Wrong filter format")
-        value = f_parts[1]
-        if f_parts[0] == "rows":
+        keyword, value = f_parts
+        if keyword == "rows":
             rows = value.split("-")
-            start = int(rows[0])
-            end = int(rows[1])
-            data = data[start : end + 1]
-        elif f_parts[0] == "disasm":
-            disasm_list = f_parts[1].split("|")
-            data = list(
-                filter(lambda x: any(k for k in disasm_list if k in x["disasm"]), data)
-            )
-        elif f_parts[0] == "opcodes":
-            data = list(filter(lambda x: value in x["opcodes"], data))
-        elif f_parts[0] == "comment":
-            data = list(filter(lambda x: value in x.get("comment", ""), data))
-        elif "reg_" in f_parts[0]:
-            reg = f_parts[0].split("_")[1]
-            value = int(value, 16)
-            if reg == "any":
-                data = list(filter(lambda x: value in x["regs"], data))
-            elif data and reg in regs:
-                reg_index = regs[reg]
-                data = list(filter(lambda x: x["regs"][reg_index] == value, data))
-            else:
-                raise ValueError(f"Unknown register: {reg}")
-        elif f_parts[0] == "regex":
-            data = list(filter(lambda x: re.search(value, str(x)) is not None, data))
-        elif f_parts[0] == "iregex":
-            data = list(filter(lambda x: re.search(value, str(x)) is None, data))
-        elif f_parts[0] == "mem_value":
-            value = int(value, 16)
-            data = list(
-                filter(lambda x: any(k for k in x["mem"] if k["value"] == value), data)
-            )
-        elif f_parts[0] == "mem_read_value":
-            value = int(value, 16)
-            data = list(
-                filter(
-                    lambda x: any(
-                        k
-                        for k in x["mem"]
-                        if k["value"] == value and k["access"] == "READ"
-                    ),
-                    data,
-                )
-            )
-        elif f_parts[0] == "mem_write_value":
-            value = int(value, 16)
-            data = list(
-                filter(
-                    lambda x: any(
-                        k
-                        for k in x["mem"]
-                        if k["value"] == value and k["access"] == "WRITE"
-                    ),
-                    data,
-                )
-            )
-        elif f_parts[0] == "mem_addr":
-            value = int(value, 16)
-            data = list(
-                filter(lambda x: any(k for k in x["mem"] if k["addr"] == value), data)
-            )
-        elif f_parts[0] == "mem_read_addr":
-            value = int(value, 16)
-            data = list(
-                filter(
-                    lambda x: any(
-                        k
-                        for k in x["mem"]
-                        if k["addr"] == value and k["access"] == "READ"
-                    ),
-                    data,
-                )
-            )
-        elif f_parts[0] == "mem_write_addr":
-            value = int(value, 16)
-            data = list(
-                filter(
-                    lambda x: any(
-                        k
-                        for k in x["mem"]
-                        if k["addr"] == value and k["access"] == "WRITE"
-                    ),
-                    data,
-                )
-            )
+            stages.append((clauses, (int(rows[0]), int(rows[1]))))
+            clauses = []
         else:
-            raise ValueError(f"Unknown word: {f_parts[0]}")
-    return data
+            clauses.append(compile_clause(f, keyword, value, regs))
+    stages.append((clauses, None))
+    return FilterPlan(stages)
+
+
+def compile_clause(text: str, keyword: str, value: str, regs: dict):
+    """Compiles a filter clause other than rows=
+
+    Args:
+        text (str): Clause text
+        keyword (str): Text before "="
+        value (str): Text after "="
+        regs (dict): Register names and indexes (TraceData.regs)
+    Raises:
+      ValueError: If unknown keyword or register
+    Returns:
+        FilterClause: Compiled clause
+    """
+    if keyword in ("disasm", "opcodes"):
+        if keyword == "disasm":
+            disasm_list = value.split("|")
+
+            def condition(x):
+                return any(k for k in disasm_list if k in x)
+
+        else:
+
+            def condition(x):
+                return value in x
+
+        return TextClause(text, keyword, condition)
+    if keyword == "comment":
+        return CommentClause(text, value)
+    if keyword == "thread":
+        return ThreadClause(text, int(value, 16))
+    if "reg_" in keyword:
+        reg = keyword.split("_")[1]
+        if reg == "any":
+            return AnyRegClause(text, int(value, 16))
+        if reg not in regs:
+            raise ValueError(f"Unknown register: {reg}")
+        return RegClause(text, regs[reg], int(value, 16))
+    if keyword in ("regex", "iregex"):
+        return RegexClause(text, re.compile(value), keyword == "regex")
+    if keyword in MEM_FILTERS:
+        key, access = MEM_FILTERS[keyword]
+        return MemClause(text, key, int(value, 16), access)
+    raise ValueError(f"Unknown word: {keyword}")
+
+
+class FilterPlan:
+    """Filter compiled to stages which run in one pass over the rows
+
+    Filters are split to stages at rows= ranges, because a range selects
+    rows by their position in the rows filtered so far. Clauses of a stage
+    are ordered by cost. Clauses which can be answered by an index of the
+    trace (disasm and opcode strings, comment words, thread rows, register
+    values, memory addresses and values) are answered first. The other
+    clauses are tested together in one pass over the remaining rows, so a
+    row is dropped by the cheapest clause which does not match.
+
+    Attributes:
+        stages (list): (clauses, row range) tuples. Row range (first, last)
+            is applied after the clauses, None for the last stage.
+        timings (list): (clause, path, seconds, rows in, rows out) tuples of
+            the last run with profile=True
+    """
+
+    def __init__(self, stages):
+        self.stages = [
+            (sorted(clauses, key=lambda clause: clause.cost), row_range)
+            for clauses, row_range in stages
+        ]
+        self.timings = []
+
+    def run(self, trace, profile=False):
+        """Runs the filter
+
+        Args:
+            trace: ColumnarTrace, MappedTvTrace or list of rows
+            profile (bool, optional): Measure time of every clause to
+                timings. Clauses tested in one pass are slower to measure.
+        Returns:
+            list: Filtered trace rows
+        """
+        self.timings = []
+        rows = range(len(trace))
+        for clauses, row_range in self.stages:
+            rows = self.run_stage(trace, rows, clauses, profile)
+            if row_range is not None:
+                start = perf_counter()
+                rows_in = len(rows)
+                rows = rows[row_range[0] : row_range[1] + 1]
+                if profile:
+                    text = f"rows={row_range[0]}-{row_range[1]}"
+                    self.add_timing(text, "range", start, rows_in, len(rows))
+        return [trace[i] for i in rows]
+
+    def run_stage(self, trace, rows, clauses, profile):
+        """Runs clauses of a stage
+
+        Args:
+            trace: ColumnarTrace, MappedTvTrace or list of rows
+            rows: Indexes of rows filtered so far, range or list
+            clauses (list): Clauses ordered by cost
+            profile (bool): Measure time of every clause
+        Returns:
+            Indexes of matching rows
+        """
+        tests = []
+        for clause in clauses:
+            if not clause.has_index(trace):
+                tests.append(clause)
+                continue
+            start = perf_counter()
+            rows_in = len(rows)
+            rows = intersect_rows(rows, clause.get_rows(trace))
+            if profile:
+                self.add_timing(clause.text, "index", start, rows_in, len(rows))
+        if not tests:
+            return rows
+
+        funcs = [clause.get_row_test() for clause in tests]
+        if profile:
+            stats = [[0.0, 0, 0] for _ in tests]
+            funcs = [timed_test(test, stat) for test, stat in zip(funcs, stats)]
+        test = match_all(funcs)
+        if isinstance(rows, range) and len(rows) == len(trace):
+            pairs = enumerate(trace)
+        else:
+            pairs = ((i, trace[i]) for i in rows)
+        rows = [i for i, row in pairs if test(row)]
+        if profile:
+            for clause, (seconds, rows_in, rows_out) in zip(tests, stats):
+                self.timings.append((clause.text, "row", seconds, rows_in, rows_out))
+        return rows
+
+    def add_timing(self, text, path, start, rows_in, rows_out):
+        """Adds timing of a clause which started at start"""
+        seconds = perf_counter() - start
+        self.timings.append((text, path, seconds, rows_in, rows_out))
+
+
+def match_all(tests):
+    """Returns a function which is True if all tests are True"""
+    if len(tests) == 1:
+        return tests[0]
+    return lambda row: all(test(row) for test in tests)
+
+
+def timed_test(test, stats):
+    """Returns a test which adds time, calls and matches to stats"""
+
+    def timed(row):
+        start = perf_counter()
+        result = test(row)
+        stats[0] += perf_counter() - start
+        stats[1] += 1
+        if result:
+            stats[2] += 1
+        return result
+
+    return timed
+
+
+def intersect_rows(rows, index_rows):
+    """Returns rows which are also in index_rows
+
+    Args:
+        rows: Sorted row indexes, range or list
+        index_rows: Sorted row indexes from an index
+    Returns:
+        list: Row indexes in rows and index_rows, sorted
+    """
+    if isinstance(rows, range):
+        first = bisect_left(index_rows, rows.start)
+        last = bisect_left(index_rows, rows.stop)
+        return list(index_rows[first:last])
+    if len(index_rows) < len(rows):
+        index_set = set(index_rows)
+        return [i for i in rows if i in index_set]
+    row_set = set(rows)
+    return [i for i in index_rows if i in row_set]
+
+
+class FilterClause:
+    """Compiled filter clause
+
+    A clause can always be tested row by row. Subclasses can also answer
+    it from an index of the trace.
+
+    Attributes:
+        text (str): Clause text, like "reg_eax=0x10"
+        cost (int): Estimated cost of testing a row, cheap clauses run first
+    """
+
+    cost = 1
+
+    def __init__(self, text):
+        self.text = text
+
+    def has_index(self, trace):
+        """Returns True if the trace has an index which answers the clause"""
+        return False
+
+    def get_rows(self, trace):
+        """Returns sorted indexes of matching rows from index"""
+        raise NotImplementedError
+
+    def get_row_test(self):
+        """Returns a function which tests a row"""
+        raise NotImplementedError
+
+
+class TextClause(FilterClause):
+    """disasm= and opcodes= clauses, answered from the index of unique strings"""
+
+    cost = 2
+
+    def __init__(self, text, key, condition):
+        super().__init__(text)
+        self.key = key
+        self.condition = condition
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_text_rows")
+
+    def get_rows(self, trace):
+        return trace.get_text_rows(self.key, self.condition)
+
+    def get_row_test(self):
+        key = self.key
+        condition = self.condition
+        return lambda row: condition(row.get(key, ""))
+
+
+class CommentClause(FilterClause):
+    """comment= clause, answered from the word index of comments"""
+
+    cost = 2
+
+    def __init__(self, text, value):
+        super().__init__(text)
+        self.value = value
+
+    def has_index(self, trace):
+        return get_comment_store(trace) is not None
+
+    def get_rows(self, trace):
+        return get_comment_store(trace).find_rows(self.value)
+
+    def get_row_test(self):
+        value = self.value
+        return lambda row: value in row.get("comment", "")
+
+
+class ThreadClause(FilterClause):
+    """thread= clause, answered from the per-thread row index"""
+
+    cost = 1
+
+    def __init__(self, text, thread):
+        super().__init__(text)
+        self.thread = thread
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_thread_rows")
+
+    def get_rows(self, trace):
+        return trace.get_thread_rows(self.thread)
+
+    def get_row_test(self):
+        thread = self.thread
+        return lambda row: row.get("thread") == thread
+
+
+class RegClause(FilterClause):
+    """reg_<name>= clause, answered from the register value index"""
+
+    cost = 3
+
+    def __init__(self, text, reg_index, value):
+        super().__init__(text)
+        self.reg_index = reg_index
+        self.value = value
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_reg_value_rows")
+
+    def get_rows(self, trace):
+        return trace.get_reg_value_rows(self.value, self.reg_index)
+
+    def get_row_test(self):
+        reg_index = self.reg_index
+        value = self.value
+        return lambda row: row["regs"][reg_index] == value
+
+
+class AnyRegClause(FilterClause):
+    """reg_any= clause, answered from the register value index"""
+
+    cost = 4
+
+    def __init__(self, text, value):
+        super().__init__(text)
+        self.value = value
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_reg_value_rows")
+
+    def get_rows(self, trace):
+        return trace.get_reg_value_rows(self.value)
+
+    def get_row_test(self):
+        value = self.value
+        return lambda row: value in row["regs"]
+
+
+class MemClause(FilterClause):
+    """mem_*= clauses, answered from the memory address and value indexes"""
+
+    cost = 4
+
+    def __init__(self, text, key, value, access):
+        super().__init__(text)
+        self.key = key
+        self.value = value
+        self.access = access
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_mem_addr_rows")
+
+    def get_rows(self, trace):
+        if self.key == "addr":
+            return trace.get_mem_addr_rows(self.value, None, self.access)
+        return trace.get_mem_value_rows(self.value, self.access)
+
+    def get_row_test(self):
+        key = self.key
+        value = self.value
+        access = self.access
+        return lambda row: any(
+            k for k in row["mem"] if k[key] == value and access in (None, k["access"])
+        )
+
+
+class RegexClause(FilterClause):
+    """regex= and iregex= clauses, match the search text of the row
+
+    Traces with a search text of all rows run the regex over it in one pass,
+    see format_search_text() for the text of a row.
+    """
+
+    cost = 10
+
+    def __init__(self, text, pattern, match):
+        super().__init__(text)
+        self.pattern = pattern
+        self.match = match
+
+    def has_index(self, trace):
+        return hasattr(trace, "get_search_text")
+
+    def get_rows(self, trace):
+        rows = trace.get_search_text().find_rows(self.pattern)
+        if self.match:
+            return rows
+        mask = bytearray([1]) * len(trace)
+        for row in rows:
+            mask[row] = 0
+        return list(compress(range(len(trace)), mask))
+
+    def get_row_test(self):
+        search = self.pattern.search
+
+        def test(row):
+            text = format_search_text(
+                row.get("disasm", ""),
+                row.get("opcodes", ""),
+                row.get("comment", ""),
+                row.get("mem", ()),
+            )
+            return (search(text) is not None) == self.match
+
+        return test
+
+
+def filter_new_rows(trace, regs: dict, filter_text: str, first_row: int):
+    """Filters rows appended to a trace after it was filtered
+
+    Filters keep the order of rows, so filtering the whole trace again gives
+    the earlier result followed by the result of the new rows. Only the new
+    rows are filtered, unless the filter has a rows= range, which selects
+    rows by their position in the rows filtered so far.
+
+    Args:
+        trace: Trace with appended rows (TraceData.trace)
+        regs (dict): Register names and indexes (TraceData.regs)
+        filter_text (str): Filter text, see filter_trace()
+        first_row (int): Index of the first appended row
+    Returns:
+        list: Filtered rows from first_row on
+    """
+    keywords = [f.split("=")[0] for f in filter_text.split("/")]
+    if "rows" in keywords:
+        return [
+            row
+            for row in filter_trace(trace, regs, filter_text)
+            if row["id"] >= first_row
+        ]
+    return filter_trace(trace[first_row:], regs, filter_text)
+
+
+def get_comment_store(trace):
+    """Returns comment store of a trace
+
+    Args:
+        trace: ColumnarTrace, MappedTvTrace or list
+    Returns:
+        CommentStore: Comments by row, None if trace is a list of rows
+    """
+    get_comments = getattr(trace, "get_comments", None)
+    if get_comments is None:
+        return None
+    return get_comments()
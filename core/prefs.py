@@ -1,3 +1,5 @@
+import os
+
 PACKAGE_NAME = "Execution Trace Viewer"
 PACKAGE_AUTHOR = "Teemu Laurila"
 PACKAGE_URL = "https://github.com/teemu-l/execution-trace-viewer"
@@ -104,6 +106,52 @@ MEM_LABELS = ["access", "address", "value"]
 
 TRACE_ROW_HEIGHT = 20
 
+# store loaded traces in compact columns instead of a list of dicts
+COLUMNAR_TRACE = True
+
+# tvt traces bigger than this (in bytes) are memory-mapped and rows are decoded
+# only when needed. None disables memory-mapping.
+MMAP_MIN_FILE_SIZE = 512 * 1024 * 1024
+MMAP_BLOCK_ROWS = 4096
+# number of decoded blocks kept in memory
+MMAP_CACHED_BLOCKS = 64
+
+# number of worker processes for loading and saving traces, 0 = number of CPUs.
+# Workers are started with "spawn" and import the main module of the program
+# again, so scripts using them need an 'if __name__ == "__main__":' guard.
+# Scripts and tv_batch.py run in one process by default.
+WORKERS = 1
+# number of worker processes in the GUI (tv.py), replaces WORKERS
+GUI_WORKERS = 0
+# x64dbg traces are disassembled in batches of this many rows
+DISASM_BATCH_ROWS = 50000
+# disassembled instructions are saved to this file and reused when loading
+# x64dbg traces, empty string disables saving
+DISASM_CACHE_FILE = ""
+
+# format version of saved tvt files. Version 1 is the original uncompressed
+# format. Version 2 stores rows in compressed blocks which can be decoded in
+# parallel and on demand, but older versions of the viewer can't open it and
+# it can't be followed.
+TVT_SAVE_VERSION = 1
+# compression of tvt v2 blocks: "zlib", "lzma" or "none"
+TVT_COMPRESSION = "zlib"
+TVT_BLOCK_ROWS = 16384
+
+# x64dbg traces are converted to tvt format and saved to this dir, so they load
+# faster next time. Empty string disables the cache.
+TRACE_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "execution-trace-viewer"
+)
+# least recently used traces are removed when the cache grows bigger than this
+TRACE_CACHE_MAX_SIZE = 4 * 1024 * 1024 * 1024
+
+# milliseconds between checks for new rows when a trace file is followed
+FOLLOW_INTERVAL = 500
+# at most this many bytes of a followed trace file are read per check, so the
+# GUI stays responsive when a lot of rows are written at once
+FOLLOW_MAX_READ_SIZE = 4 * 1024 * 1024
+
 PAGINATION_ENABLED = True
 PAGINATION_ROWS_PER_PAGE = 10000
 
@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+from core import prefs
+
+CACHE_FILE_EXT = ".tvt"
+# bytes hashed from the beginning and the end of a source file
+HASH_SAMPLE_SIZE = 1024 * 1024
+# version of converted traces, files converted by older versions are not used
+CACHE_VERSION = 2
+
+
+def get_cache_filename(filename):
+    """Returns name of the converted trace file in cache dir
+
+    The name is a hash of CACHE_VERSION, the source path, size, modification
+    time and the first and last HASH_SAMPLE_SIZE bytes of the source file.
+
+    Args:
+        filename: name of source trace file
+    Returns:
+        str: filename in cache dir, None if cache is disabled or source
+            file can not be read
+    """
+    cache_dir = prefs.TRACE_CACHE_DIR
+    if not cache_dir:
+        return None
+    try:
+        stat = os.stat(filename)
+        key = hashlib.sha1()
+        key.update(f"{CACHE_VERSION}|".encode())
+        key.update(os.path.abspath(filename).encode())
+        key.update(f"|{stat.st_size}|{stat.st_mtime_ns}|".encode())
+        with open(filename, "rb") as f:
+            key.update(f.read(HASH_SAMPLE_SIZE))
+            if stat.st_size > HASH_SAMPLE_SIZE:
+                f.seek(max(HASH_SAMPLE_SIZE, stat.st_size - HASH_SAMPLE_SIZE))
+                key.update(f.read())
+    except IOError:
+        return None
+    return os.path.join(cache_dir, key.hexdigest() + CACHE_FILE_EXT)
+
+
+def use_cache_file(cache_filename):
+    """Marks a file in cache dir as recently used
+
+    Args:
+        cache_filename: name of file in cache dir
+    Returns:
+        bool: True if file exists in cache
+    """
+    try:
+        os.utime(cache_filename)
+    except OSError:
+        return False
+    return True
+
+
+def prepare_cache_dir():
+    """Creates cache dir if it does not exist
+
+    Returns:
+        bool: True if cache dir is usable
+    """
+    try:
+        os.makedirs(prefs.TRACE_CACHE_DIR, exist_ok=True)
+    except OSError:
+        print(f"Error, could not create cache dir {prefs.TRACE_CACHE_DIR}")
+        return False
+    return True
+
+
+def evict_cache_files(max_size=None):
+    """Removes least recently used files until cache dir fits in max_size
+
+    Args:
+        max_size (int, optional): Max total size of cache files in bytes.
+            Defaults to prefs.TRACE_CACHE_MAX_SIZE.
+    """
+    if max_size is None:
+        max_size = prefs.TRACE_CACHE_MAX_SIZE
+    cache_dir = prefs.TRACE_CACHE_DIR
+    files = []
+    try:
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(CACHE_FILE_EXT) and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    except OSError:
+        return
+    total_size = sum(size for _mtime, size, _path in files)
+    for _mtime, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
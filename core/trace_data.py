@@ -1,4 +1,26 @@
-from operator import attrgetter
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import MutableMapping, Sequence
+from itertools import accumulate, chain, compress
+from operator import attrgetter, ne
+
+from core import prefs
+
+# number of register change texts memoized, enough for a few pages of rows
+REGCHANGES_CACHE_SIZE = 10000
+MEM_ACCESS_TYPES = ("READ", "WRITE")
+MEM_ACCESS_FLAGS = {"READ": 0, "WRITE": 1}
+# fields of rows stored as ids of a StringPool
+TEXT_FIELDS = ("disasm", "opcodes")
+# thread id of rows without a thread in thread column
+NO_THREAD = 0xFFFFFFFF
+# words of comments in comment index
+COMMENT_TOKEN = re.compile(r"\w+")
+# rows appended to a memory or register value index are merged to its sorted
+# postings when they are more than 1/INDEX_MERGE_RATIO of all rows
+INDEX_MERGE_RATIO = 8
 
 
 class TraceData:
@@ -13,7 +35,16 @@ class TraceData:
         pointer_size (int): Pointer size (4 in x86, 8 in x64)
         regs (dict): Register names and indexes
         trace (list): A list of traced instructions, registers and memory accesses.
+            Either a list of dicts or a ColumnarTrace.
         bookmarks (list): A list of bookmarks.
+        changed_comments (set): Rows whose comments are changed after the last save
+        journal (AnnotationJournal): Journal of comments and bookmarks, None if
+            trace was not loaded from a file
+        regchanges_cache (OrderedDict): Recently used register change texts by
+            row and prefs.TRACE_SHOW_OLD_REG_VALUE
+        regchanges_regs (dict): Regs of the cached register change texts
+        follower (TraceFollower): Decodes rows appended to the trace file, None
+            if trace was not loaded with follow=True
     """
 
     def __init__(self):
@@ -25,11 +56,18 @@ class TraceData:
         self.regs = {}
         self.trace = []
         self.bookmarks = []
+        self.changed_comments = set()
+        self.journal = None
+        self.regchanges_cache = OrderedDict()
+        self.regchanges_regs = self.regs
+        self.follower = None
 
     def clear(self):
         """Clears trace and all data"""
         self.trace = []
         self.bookmarks = []
+        self.changed_comments = set()
+        self.regchanges_cache.clear()
 
     def get_trace(self):
         """Returns a full trace
@@ -98,6 +136,52 @@ class TraceData:
                     modified_regs.append(reg_name)
         return modified_regs
 
+    def get_regchanges(self, row):
+        """Returns register change text of a row
+
+        Text lists registers changed by the instruction, in other words the
+        registers whose values differ in the next row. It is computed from
+        register values when needed and memoized for recently shown rows.
+
+        Args:
+            row (int): Trace row index
+        Returns:
+            str: Register change text, empty if row is the last loaded row
+        """
+        cache = self.regchanges_cache
+        if self.regs is not self.regchanges_regs:
+            # registers have been replaced, cached texts have old names
+            cache.clear()
+            self.regchanges_regs = self.regs
+        show_old_value = prefs.TRACE_SHOW_OLD_REG_VALUE
+        key = (row, show_old_value)
+        text = cache.get(key)
+        if text is not None:
+            cache.move_to_end(key)
+            return text
+        trace = self.trace
+        if not 0 <= row < len(trace) - 1:
+            return ""
+        reg_values = trace[row]["regs"]
+        next_reg_values = trace[row + 1]["regs"]
+        ip_index = self.regs.get(self.get_instruction_pointer_name())
+        reg_names = {}
+        for reg_name, reg_index in self.regs.items():
+            reg_names.setdefault(reg_index, reg_name)
+        text = ""
+        for reg_index, reg_name in sorted(reg_names.items()):
+            old_value = reg_values[reg_index]
+            new_value = next_reg_values[reg_index]
+            if reg_index != ip_index and new_value != old_value:
+                if new_value is not None and old_value is not None:
+                    text += format_regchange(
+                        reg_name, old_value, new_value, show_old_value
+                    )
+        cache[key] = text
+        if len(cache) > REGCHANGES_CACHE_SIZE:
+            cache.popitem(last=False)
+        return text
+
     def get_trace_rows(self, rows):
         """Returns a trace of given rows
 
@@ -148,9 +232,51 @@ class TraceData:
             print(f"Error. Could not get IP from row {row}")
         return ip
 
+    def get_comments(self):
+        """Returns sparse comment store of the trace
+
+        Returns:
+            CommentStore: Comments by row, None if trace has no comment store
+                (trace is a list of dicts)
+        """
+        get_comments = getattr(self.trace, "get_comments", None)
+        if get_comments is None:
+            return None
+        return get_comments()
+
+    def get_thread_rows(self, thread):
+        """Returns rows executed by a thread
+
+        Uses the per-thread row index of the trace, list traces are scanned.
+
+        Args:
+            thread (int): Thread id
+        Returns:
+            list: Trace rows
+        """
+        get_thread_rows = getattr(self.trace, "get_thread_rows", None)
+        if get_thread_rows is None:
+            return [row for row in self.trace if row.get("thread") == thread]
+        return [self.trace[row] for row in get_thread_rows(thread)]
+
+    def get_threads(self):
+        """Returns thread ids of trace
+
+        Returns:
+            list: Sorted thread ids
+        """
+        get_thread_index = getattr(self.trace, "get_thread_index", None)
+        if get_thread_index is None:
+            threads = {row.get("thread") for row in self.trace}
+            threads.discard(None)
+            return sorted(threads)
+        return sorted(get_thread_index())
+
     def set_comment(self, row, comment):
         """Adds a comment to trace
 
+        Comment store and its index are updated with the row.
+
         Args:
             row (int): Row index in trace
             comment (str): Comment text
@@ -159,6 +285,8 @@ class TraceData:
             self.trace[row]["comment"] = str(comment)
         except IndexError:
             print(f"Error. Could not set comment to row {row}")
+        else:
+            self.changed_comments.add(row)
 
     def add_bookmark(self, new_bookmark, replace=False):
         """Adds a new bookmark
@@ -230,3 +358,1646 @@ class TraceData:
     def clear_bookmarks(self):
         """Clears bookmarks"""
         self.bookmarks = []
+
+
+def format_regchange(reg_name, old_value, new_value, show_old_value):
+    """Returns register change text of one register
+
+    Args:
+        reg_name (str): Register name
+        old_value (int): Value before the change
+        new_value (int): Value after the change
+        show_old_value (bool): Show also the old value
+    Returns:
+        str: Register change text
+    """
+    if show_old_value:
+        text = f"{reg_name}: {hex(old_value)} -> {hex(new_value)} "
+    else:
+        text = f"{reg_name}: {hex(new_value)} "
+    if 0x7F > new_value > 0x1F:
+        text += f"'{chr(new_value)}' "
+    return text
+
+
+class TraceRow(MutableMapping):
+    """Dict-like view of one row in ColumnarTrace.
+
+    Values are read from and written to the columns of the trace, so the view
+    can be used like the row dicts of a list based trace. Registers and memory
+    accesses are returned as RowRegs and RowMems, which write changes made in
+    place back to the trace.
+
+    Attributes:
+        trace (ColumnarTrace): Trace the row belongs to
+        index (int): Row index in trace
+    """
+
+    __slots__ = ("trace", "index")
+
+    def __init__(self, trace, index):
+        self.trace = trace
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == "regs":
+            regs = RowRegs(self.trace.get_regs(self.index))
+            regs.row = self
+            return regs
+        if key == "mem":
+            mems = RowMems(map(RowMem, self.trace.get_field(self.index, key)))
+            mems.row = self
+            for access in mems:
+                access.mems = mems
+            return mems
+        return self.trace.get_field(self.index, key)
+
+    def __setitem__(self, key, value):
+        self.trace.set_field(self.index, key, value)
+
+    def __delitem__(self, key):
+        self.trace.del_field(self.index, key)
+
+    def __iter__(self):
+        return iter(self.trace.get_keys(self.index))
+
+    def __len__(self):
+        return len(self.trace.get_keys(self.index))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        """Returns the row as a dict, registers and memory accesses are copied"""
+        row = {}
+        for key in self.trace.get_keys(self.index):
+            value = self.trace.get_field(self.index, key)
+            if key == "regs":
+                value = list(value)
+            elif key == "mem":
+                value = [dict(access) for access in value]
+            row[key] = value
+        return row
+
+
+def write_through(method):
+    """Returns a method which writes the changed value back to the trace
+
+    The change is undone if the trace does not accept it, for example if
+    registers are added or the field is read-only.
+
+    Args:
+        method: Changing method of list or dict
+    """
+
+    def write_change(self, *args, **kwargs):
+        old_value = self.get_state()
+        result = method(self, *args, **kwargs)
+        try:
+            self.write()
+        except Exception:
+            self.set_state(old_value)
+            raise
+        return result
+
+    write_change.__name__ = method.__name__
+    write_change.__doc__ = method.__doc__
+    return write_change
+
+
+class RowRegs(list):
+    """Register values of a TraceRow
+
+    Changes made in place are written to the trace. Registers can not be
+    added or removed.
+
+    Attributes:
+        row (TraceRow): Row of the registers
+    """
+
+    __slots__ = ("row",)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def get_state(self):
+        """Returns a copy of the values, for undoing a change"""
+        return list(self)
+
+    def set_state(self, values):
+        """Restores values returned by get_state()"""
+        list.__setitem__(self, slice(None), values)
+
+    def write(self):
+        """Writes register values to the trace"""
+        self.row.trace.set_field(self.row.index, "regs", list(self))
+
+
+class RowMems(list):
+    """Memory accesses of a TraceRow
+
+    Accesses are RowMem dicts. Changes made in place to the list or to its
+    accesses are written to the trace.
+
+    Attributes:
+        row (TraceRow): Row of the memory accesses
+    """
+
+    __slots__ = ("row",)
+
+    def __reduce__(self):
+        return (list, ([dict(access) for access in self],))
+
+    def get_state(self):
+        """Returns a copy of the values, for undoing a change"""
+        return list(self)
+
+    def set_state(self, mems):
+        """Restores values returned by get_state()"""
+        list.__setitem__(self, slice(None), mems)
+
+    def write(self):
+        """Writes memory accesses to the trace"""
+        self.row.trace.set_field(
+            self.row.index, "mem", [dict(access) for access in self]
+        )
+        for i, access in enumerate(self):
+            if not isinstance(access, RowMem) or access.mems is not self:
+                access = RowMem(access)
+                access.mems = self
+                list.__setitem__(self, i, access)
+
+
+class RowMem(dict):
+    """Memory access of a TraceRow, changes are written to the trace
+
+    Attributes:
+        mems (RowMems): Memory accesses of the row
+    """
+
+    __slots__ = ("mems",)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def get_state(self):
+        """Returns a copy of the values, for undoing a change"""
+        return dict(self)
+
+    def set_state(self, access):
+        """Restores values returned by get_state()"""
+        dict.clear(self)
+        dict.update(self, access)
+
+    def write(self):
+        """Writes memory accesses of the row to the trace"""
+        self.mems.write()
+
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(RowRegs, _name, write_through(getattr(list, _name)))
+    setattr(RowMems, _name, write_through(getattr(list, _name)))
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__ior__",
+    "pop",
+    "popitem",
+    "setdefault",
+    "update",
+    "clear",
+):
+    setattr(RowMem, _name, write_through(getattr(dict, _name)))
+del _name
+
+
+class TracePrefix(Sequence):
+    """Read-only view of the first rows of a trace
+
+    Used while a trace is still loading: rows after row_count may be
+    incomplete, so only the rows before it are visible.
+
+    Attributes:
+        trace (list): Trace which is being loaded (list or ColumnarTrace)
+        row_count (int): Number of visible rows
+    """
+
+    def __init__(self, trace, row_count):
+        self.trace = trace
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.trace[i] for i in range(*index.indices(self.row_count))]
+        if index < 0:
+            index += self.row_count
+        if not 0 <= index < self.row_count:
+            raise IndexError("trace index out of range")
+        return self.trace[index]
+
+    def __iter__(self):
+        for i in range(self.row_count):
+            yield self.trace[i]
+
+
+def index_threads(threads):
+    """Returns row indexes by thread id
+
+    Args:
+        threads (array): Thread ids of rows, NO_THREAD if not known
+    Returns:
+        dict: Row indexes (array) by thread id
+    """
+    thread_rows = {}
+    for index, thread in enumerate(threads):
+        if thread != NO_THREAD:
+            rows = thread_rows.get(thread)
+            if rows is None:
+                rows = thread_rows[thread] = array("I")
+            rows.append(index)
+    return thread_rows
+
+
+def get_missing_regs(regs):
+    """Returns indexes of registers without a value (None)"""
+    return tuple(i for i, value in enumerate(regs) if value is None)
+
+
+class CommentStore:
+    """Sparse comments by row with a word index
+
+    Only rows with a comment are stored. Every word of a comment is indexed,
+    so a substring search checks only words containing the longest word of
+    the search text and the rows having them, instead of every trace row.
+
+    Attributes:
+        comments (dict): Comment texts by row index
+        postings (dict): Sets of row indexes by word
+    """
+
+    def __init__(self):
+        """Inits CommentStore."""
+        self.comments = {}
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.comments)
+
+    def __contains__(self, row):
+        return row in self.comments
+
+    def get(self, row, default=""):
+        """Returns comment of a row
+
+        Args:
+            row (int): Row index
+            default (str, optional): Returned if row has no comment
+        """
+        return self.comments.get(row, default)
+
+    def set(self, row, text):
+        """Sets comment of a row and updates the index
+
+        Args:
+            row (int): Row index
+            text (str): Comment, empty text removes the comment
+        """
+        old_text = self.comments.get(row)
+        if old_text == text:
+            return
+        if old_text:
+            for word in set(COMMENT_TOKEN.findall(old_text)):
+                rows = self.postings[word]
+                rows.discard(row)
+                if not rows:
+                    del self.postings[word]
+        if text:
+            self.comments[row] = text
+            for word in set(COMMENT_TOKEN.findall(text)):
+                self.postings.setdefault(word, set()).add(row)
+        else:
+            self.comments.pop(row, None)
+
+    def items(self):
+        """Returns (row, comment) pairs"""
+        return self.comments.items()
+
+    def update(self, comments, offset=0):
+        """Copies comments from another store
+
+        Args:
+            comments (CommentStore): Comments to copy
+            offset (int, optional): Added to row indexes
+        """
+        for row, text in comments.items():
+            self.set(row + offset, text)
+
+    def get_range(self, start, end):
+        """Returns comments of rows from start to end as a new store
+
+        Args:
+            start (int): Index of the first row, becomes row 0
+            end (int): Index after the last row
+        Returns:
+            CommentStore: Comments
+        """
+        comments = CommentStore()
+        for row, text in self.comments.items():
+            if start <= row < end:
+                comments.set(row - start, text)
+        return comments
+
+    def find_rows(self, text):
+        """Returns rows whose comment contains text
+
+        Args:
+            text (str): Text to search for
+        Returns:
+            list: Sorted row indexes
+        """
+        words = COMMENT_TOKEN.findall(text)
+        if words:
+            longest = max(words, key=len)
+            candidates = set()
+            for word, rows in self.postings.items():
+                if longest in word:
+                    candidates |= rows
+        else:
+            candidates = self.comments
+        comments = self.comments
+        return sorted(row for row in candidates if text in comments[row])
+
+    def find_next(self, text, start_row, direction=1):
+        """Returns the next or previous row whose comment contains text
+
+        Args:
+            text (str): Text to search for
+            start_row (int): Row to start from, included in search
+            direction (int, optional): 1 for forward, -1 for backward
+        Returns:
+            int: Row index, None if not found
+        """
+        rows = self.find_rows(text)
+        if direction > 0:
+            i = bisect_left(rows, start_row)
+            return rows[i] if i < len(rows) else None
+        i = bisect_right(rows, start_row)
+        return rows[i - 1] if i > 0 else None
+
+
+class Postings:
+    """Sorted row ids by key
+
+    Sorted unique keys point to sorted row ids in compressed sparse row
+    layout, so rows of a key or a key range are found with bisect. Rows
+    added after build() are kept in a dict until the next build().
+
+    Attributes:
+        keys (list): Sorted unique keys
+        offsets (array): Start offsets of keys in postings, plus end offset
+        postings (array): Row ids sorted by key and row
+        recent (dict): Row ids (list) by key, for rows added after build()
+    """
+
+    def __init__(self, typecode="I"):
+        """Inits empty Postings.
+
+        Args:
+            typecode (str, optional): Array type code of row ids.
+                Defaults to "I".
+        """
+        self.keys = []
+        self.offsets = array("Q", [0])
+        self.postings = array(typecode)
+        self.recent = {}
+
+    def add(self, key, row):
+        """Adds a row id to a key, a row added twice in a row is kept once"""
+        rows = self.recent.get(key)
+        if rows is None:
+            self.recent[key] = [row]
+        elif rows[-1] != row:
+            rows.append(row)
+
+    def build(self):
+        """Moves rows added after the last build to sorted postings"""
+        if not self.recent:
+            return
+        keys = self.keys
+        offsets = self.offsets
+        postings = self.postings
+        merged = {
+            key: postings[offsets[i] : offsets[i + 1]] for i, key in enumerate(keys)
+        }
+        for key, rows in self.recent.items():
+            old_rows = merged.get(key)
+            if old_rows is not None:
+                rows = set(old_rows).union(rows)
+            merged[key] = array(postings.typecode, sorted(rows))
+        self.keys = sorted(merged)
+        self.offsets = array("Q", [0])
+        self.postings = array(postings.typecode)
+        for key in self.keys:
+            self.postings.extend(merged[key])
+            self.offsets.append(len(self.postings))
+        self.recent = {}
+
+    def get(self, first_key, last_key=None):
+        """Returns row ids of a key or a key range
+
+        Args:
+            first_key: Key, or first key of range
+            last_key (optional): Last key of range, included
+        Returns:
+            list: Sorted sequences of row ids, one or more for every key
+        """
+        if last_key is None:
+            last_key = first_key
+        parts = []
+        first = bisect_left(self.keys, first_key)
+        last = bisect_right(self.keys, last_key)
+        if first < last:
+            parts.append(self.postings[self.offsets[first] : self.offsets[last]])
+            if last - first > 1:
+                # rows of a key range are sorted by key first
+                parts[-1] = sorted(set(parts[-1]))
+        if first_key == last_key:
+            if first_key in self.recent:
+                parts.append(sorted(self.recent[first_key]))
+        else:
+            for key, rows in self.recent.items():
+                if first_key <= key <= last_key:
+                    parts.append(sorted(rows))
+        return parts
+
+
+def union_rows(parts):
+    """Returns sorted unique row ids of sorted sequences"""
+    if len(parts) == 1:
+        return list(parts[0])
+    return sorted(set().union(*parts))
+
+
+class MemAddressIndex:
+    """Rows which access memory addresses, separately for reads and writes
+
+    Attributes:
+        key (str): Indexed field of memory accesses
+        row_count (int): Number of indexed rows
+        postings (dict): Rows by address (Postings), by access type
+        recent_rows (int): Number of rows added after build()
+    """
+
+    key = "addr"
+
+    def __init__(self):
+        """Inits an empty MemAddressIndex."""
+        self.row_count = 0
+        self.postings = {access: Postings() for access in MEM_ACCESS_TYPES}
+        self.recent_rows = 0
+
+    def add_rows(self, trace, start, end, first_row=0, skip=()):
+        """Adds memory accesses of rows from the columns of a ColumnarTrace
+
+        Rows in mem_overrides are skipped, add them with add_mems().
+
+        Args:
+            trace (ColumnarTrace): Trace or a block of rows
+            start (int): Index of the first row in trace
+            end (int): Index after the last row in trace
+            first_row (int, optional): Index of trace row 0 in the indexed
+                trace. Defaults to 0.
+            skip (optional): Indexes of other rows to skip, in the indexed
+                trace
+        """
+        offsets = trace.mem_offsets
+        flags = trace.mem_flags
+        column = trace.mem_addrs if self.key == "addr" else trace.mem_values
+        overrides = trace.mem_overrides
+        postings = [self.postings[access] for access in MEM_ACCESS_TYPES]
+        for row in range(start, end):
+            first = offsets[row]
+            last = offsets[row + 1]
+            row_id = first_row + row
+            if first == last or row in overrides or row_id in skip:
+                continue
+            for i in range(first, last):
+                postings[flags[i]].add(column[i], row_id)
+
+    def add_mems(self, row, mems):
+        """Adds memory accesses of a row given as dicts
+
+        Args:
+            row (int): Row index
+            mems (list): Memory accesses, dicts with access, addr and value keys
+        """
+        for mem in mems:
+            postings = self.postings.get(mem.get("access"))
+            key = mem.get(self.key)
+            if postings is not None and isinstance(key, int):
+                postings.add(key, row)
+
+    def build(self):
+        """Moves rows added after the last build to sorted postings"""
+        for postings in self.postings.values():
+            postings.build()
+        self.recent_rows = 0
+
+    def get_rows(self, first_addr, last_addr=None, access=None):
+        """Returns rows which access an address or an address range
+
+        Args:
+            first_addr (int): Address, or first address of range
+            last_addr (int, optional): Last address of range, included
+            access (str, optional): "READ" or "WRITE", None matches both
+        Returns:
+            list: Sorted row indexes
+        """
+        access_types = MEM_ACCESS_TYPES if access is None else (access,)
+        parts = []
+        for access_type in access_types:
+            parts += self.postings[access_type].get(first_addr, last_addr)
+        return union_rows(parts)
+
+
+class MemValueIndex(MemAddressIndex):
+    """Rows which read or write memory values, see MemAddressIndex"""
+
+    key = "value"
+
+
+class RegValueIndex:
+    """Rows where registers have values
+
+    Only the rows where a register changes are indexed: a value points to
+    (row, register) pairs where a register gets the value, and for every
+    register the rows where it changes are kept, so the register keeps the
+    value until its next change. A value is found with bisect and its rows
+    are expanded from the ranges.
+
+    Attributes:
+        reg_count (int): Number of registers per row
+        row_count (int): Number of indexed rows
+        reg_values (list): Register values of the last indexed row
+        changes (list): Rows where a register changes (array), by register
+        values (Postings): row * reg_count + register by value
+        recent_rows (int): Number of rows added after build()
+    """
+
+    def __init__(self, reg_count):
+        """Inits an empty RegValueIndex.
+
+        Args:
+            reg_count (int): Number of registers per row
+        """
+        self.reg_count = reg_count
+        self.row_count = 0
+        self.reg_values = [None] * reg_count
+        self.changes = [array("I") for _ in range(reg_count)]
+        self.values = Postings("Q")
+        self.recent_rows = 0
+
+    def add_rows(self, trace, start, end, first_row=0):
+        """Adds register values of rows, after the rows indexed so far
+
+        Args:
+            trace (ColumnarTrace): Trace or a block of rows
+            start (int): Index of the first row in trace
+            end (int): Index after the last row in trace
+            first_row (int, optional): Index of trace row 0 in the indexed
+                trace. Defaults to 0.
+        """
+        reg_count = self.reg_count
+        recent = self.values.recent
+        row_ids = range(first_row + start, first_row + end)
+        for reg in range(reg_count):
+            column = trace.regs[start * reg_count + reg : end * reg_count : reg_count]
+            changed = list(map(ne, column, chain((self.reg_values[reg],), column)))
+            if not any(changed):
+                continue
+            rows = list(compress(row_ids, changed))
+            self.changes[reg].extend(rows)
+            for row, value in zip(rows, compress(column, changed)):
+                posting = row * reg_count + reg
+                value_rows = recent.get(value)
+                if value_rows is None:
+                    recent[value] = [posting]
+                else:
+                    value_rows.append(posting)
+            self.reg_values[reg] = column[-1]
+        self.row_count = first_row + end
+        self.recent_rows += end - start
+
+    def build(self):
+        """Moves values added after the last build to sorted postings"""
+        self.values.build()
+        self.recent_rows = 0
+
+    def get_ranges(self, value, reg_index=None):
+        """Returns row ranges where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted, non-overlapping (first row, end row) tuples
+        """
+        ranges = []
+        for part in self.values.get(value):
+            for posting in part:
+                row, reg = divmod(posting, self.reg_count)
+                if reg_index is not None and reg != reg_index:
+                    continue
+                changes = self.changes[reg]
+                i = bisect_right(changes, row)
+                end = changes[i] if i < len(changes) else self.row_count
+                ranges.append((row, end))
+        ranges.sort()
+        merged = []
+        for first, end in ranges:
+            if merged and first <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((first, end))
+        return merged
+
+    def get_rows(self, value, reg_index=None):
+        """Returns rows where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted row indexes
+        """
+        rows = []
+        for first, end in self.get_ranges(value, reg_index):
+            rows.extend(range(first, end))
+        return rows
+
+
+class StringPool:
+    """Stores every unique string once
+
+    Rows refer to strings by small integer ids, so a text repeated on
+    millions of rows takes only an id per row. Filters can evaluate a
+    condition once per unique string instead of once per row.
+
+    Attributes:
+        strings (list): Unique strings, index is the id
+        ids (dict): Ids by string
+    """
+
+    def __init__(self):
+        """Inits StringPool."""
+        self.strings = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def get_id(self, text):
+        """Returns id of a string, adds the string if not found
+
+        Args:
+            text (str): String
+        Returns:
+            int: Index in strings
+        """
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self.ids[text] = string_id
+        return string_id
+
+    def intern(self, text):
+        """Returns the pooled copy of a string
+
+        Used for rows stored as dicts, equal strings become the same object.
+
+        Args:
+            text (str): String
+        Returns:
+            str: String from pool
+        """
+        return self.strings[self.get_id(text)]
+
+    def match(self, condition):
+        """Evaluates a condition once for every unique string
+
+        Args:
+            condition (callable): Returns True for matching strings
+        Returns:
+            bytearray: 1 for ids of matching strings, 0 for others
+        """
+        return bytearray(1 if condition(text) else 0 for text in self.strings)
+
+
+class TextIndex:
+    """Rows by disasm and opcode strings
+
+    Every unique string has sorted postings of the rows which have it, so a
+    condition is evaluated once for every unique string and only rows of
+    the matching strings are read.
+
+    Attributes:
+        strings (StringPool): Unique strings, ids are the keys of postings
+        row_count (int): Number of indexed rows
+        postings (dict): Rows by string id (Postings), by text field
+        recent_rows (int): Number of rows added after build()
+    """
+
+    def __init__(self, strings=None):
+        """Inits an empty TextIndex.
+
+        Args:
+            strings (StringPool, optional): String pool of the indexed trace.
+                Defaults to a new pool, rows are then added by their texts.
+        """
+        self.strings = strings if strings is not None else StringPool()
+        self.row_count = 0
+        self.postings = {key: Postings() for key in TEXT_FIELDS}
+        self.recent_rows = 0
+
+    def add_rows(self, trace, start, end, first_row=0, skip=()):
+        """Adds disasm and opcodes of rows from the columns of a ColumnarTrace
+
+        Args:
+            trace (ColumnarTrace): Trace or a block of rows
+            start (int): Index of the first row in trace
+            end (int): Index after the last row in trace
+            first_row (int, optional): Index of trace row 0 in the indexed
+                trace. Defaults to 0.
+            skip (dict, optional): Changed fields by row index in the indexed
+                trace, changed texts are added with add_text()
+        """
+        string_ids = None
+        if trace.strings is not self.strings:
+            string_ids = [self.strings.get_id(text) for text in trace.strings.strings]
+        row_ids = range(first_row + start, first_row + end)
+        for key in TEXT_FIELDS:
+            column = trace.get_text_ids(key)[start:end]
+            if string_ids is not None:
+                column = map(string_ids.__getitem__, column)
+            pairs = zip(row_ids, column)
+            if skip:
+                pairs = [(row, i) for row, i in pairs if key not in skip.get(row, ())]
+            recent = self.postings[key].recent
+            for row, string_id in pairs:
+                rows = recent.get(string_id)
+                if rows is None:
+                    recent[string_id] = [row]
+                else:
+                    rows.append(row)
+
+    def add_text(self, row, key, text):
+        """Adds disasm or opcodes of a row given as text
+
+        Args:
+            row (int): Row index
+            key (str): "disasm" or "opcodes"
+            text (str): Text of the row
+        """
+        self.postings[key].add(self.strings.get_id(text), row)
+
+    def build(self):
+        """Moves rows added after the last build to sorted postings"""
+        for postings in self.postings.values():
+            postings.build()
+        self.recent_rows = 0
+
+    def get_postings(self, key, condition):
+        """Returns rows of the strings which match a condition
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted sequences of row indexes, rows of different
+                sequences do not overlap
+        """
+        postings = self.postings[key]
+        mask = self.strings.match(condition)
+        parts = []
+        for string_id in compress(range(len(mask)), mask):
+            parts += postings.get(string_id)
+        return parts
+
+    def get_rows(self, key, condition):
+        """Returns rows whose disasm or opcodes match a condition
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted row indexes
+        """
+        parts = self.get_postings(key, condition)
+        if len(parts) == 1:
+            return list(parts[0])
+        return sorted(chain.from_iterable(parts))
+
+
+def format_search_text(disasm, opcodes, comment="", mems=()):
+    """Returns the text of a row which regex filters search
+
+    Fields are separated by tabs. Registers are not included, memory
+    accesses are given as access type, address and value in hex.
+
+    Args:
+        disasm (str): Disasm of row
+        opcodes (str): Opcodes of row in hex
+        comment (str, optional): Comment of row
+        mems (list, optional): Memory accesses, dicts with access, addr and
+            value keys
+    Returns:
+        str: Text of row, without newlines
+    """
+    words = [disasm, opcodes, comment]
+    for mem in mems:
+        for key in ("access", "addr", "value"):
+            value = mem.get(key)
+            words.append(hex(value) if isinstance(value, int) else str(value))
+    return "\t".join(words).replace("\n", " ")
+
+
+def get_search_texts(trace):
+    """Returns search texts of all rows of a ColumnarTrace
+
+    Rows without comment and memory accesses share the text of their
+    disasm and opcodes.
+
+    Args:
+        trace (ColumnarTrace): Trace or a block of rows
+    Returns:
+        list: Texts by row, see format_search_text()
+    """
+    strings = trace.strings.strings
+    ids = list(zip(trace.disasm_ids, trace.opcode_ids))
+    texts = {
+        pair: format_search_text(strings[pair[0]], strings[pair[1]])
+        for pair in set(ids)
+    }
+    texts = list(map(texts.__getitem__, ids))
+    offsets = trace.mem_offsets
+    rows = set(compress(range(len(ids)), map(ne, offsets[1:], offsets)))
+    rows.update(row for row, _ in trace.comments.items())
+    rows.update(trace.mem_overrides)
+    for row in rows:
+        disasm_id, opcode_id = ids[row]
+        texts[row] = format_search_text(
+            strings[disasm_id],
+            strings[opcode_id],
+            trace.comments.get(row),
+            trace.get_mems(row),
+        )
+    return texts
+
+
+class SearchText:
+    """Search texts of all rows in one string
+
+    Texts of rows are separated by newlines, so a regex runs over all rows
+    in one pass and match offsets are mapped back to rows with bisect.
+
+    Attributes:
+        text (str): Texts of rows, each followed by a newline
+        offsets (array): Start offsets of rows in text, plus end offset
+    """
+
+    def __init__(self, texts):
+        """Inits SearchText.
+
+        Args:
+            texts (list): Texts of rows, see format_search_text()
+        """
+        self.text = "".join(text + "\n" for text in texts)
+        self.offsets = array("Q", [0])
+        self.offsets.extend(accumulate(len(text) + 1 for text in texts))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def find_rows(self, pattern):
+        """Returns rows whose text matches a regex
+
+        The regex is compiled with re.MULTILINE, so ^ and $ match at the
+        start and end of a row. A match which continues to the next row is
+        checked again in its own row only.
+
+        Args:
+            pattern (re.Pattern): Compiled regex
+        Returns:
+            list: Sorted row indexes
+        """
+        search = re.compile(pattern.pattern, pattern.flags | re.MULTILINE).search
+        text = self.text
+        offsets = self.offsets
+        rows = []
+        pos = 0
+        while pos < len(text):
+            match = search(text, pos)
+            if match is None or match.start() >= len(text):
+                break
+            row = bisect_right(offsets, match.start()) - 1
+            end = offsets[row + 1] - 1
+            if match.end() <= end or search(text, offsets[row], end) is not None:
+                rows.append(row)
+            pos = end + 1
+        return rows
+
+
+class ColumnarTrace(Sequence):
+    """ColumnarTrace class.
+
+    Stores a trace in columns instead of a list of dicts. Register values of
+    all rows are kept in one flat array of fixed-width integers (row * reg_count).
+    Disasm and opcode texts are stored once in a StringPool and rows keep only
+    their ids. Comments are kept in a sparse CommentStore. Memory accesses are
+    stored in compressed sparse row layout: flat access type, address and value
+    columns with per-row offsets. Rows are returned as TraceRow views.
+
+    Attributes:
+        reg_count (int): Number of registers per row
+        ips (array): Instruction pointers
+        regs (array): Register values, reg_count values per row
+        strings (StringPool): Unique disasm and opcode (hex) texts
+        disasm_ids (array): Ids of disasm texts in strings
+        opcode_ids (array): Ids of opcode hex texts in strings
+        comments (CommentStore): Comments of rows which have one
+        opcode_lookup (dict): Ids of opcode hex texts by opcode bytes
+        mem_offsets (array): Start offsets of rows in memory access columns,
+            plus end offset
+        mem_flags (bytearray): Access types, 1 for write and 0 for read
+        mem_addrs (array): Memory addresses
+        mem_values (array): Memory values
+        mem_overrides (dict): Memory accesses which do not fit to the columns
+            (unknown keys or values over 64 bits) or are changed after
+            appending, by row index
+        missing_regs (dict): Indexes of registers without a value (None) by
+            row index, they are stored as 0 in regs
+        threads (array): Thread ids (NO_THREAD if not known), None if no row
+            has a thread id
+        thread_rows (dict): Row indexes (array) by thread id, None if the
+            index has to be rebuilt
+        extra (dict): Other fields by row index
+        mem_addr_index (MemAddressIndex): Rows by memory address, None until
+            get_mem_addr_index() is called or after memory accesses are changed
+        mem_value_index (MemValueIndex): Rows by memory value, None until
+            get_mem_value_index() is called or after memory accesses are changed
+        reg_value_index (RegValueIndex): Rows by register value, None until
+            get_reg_value_index() is called or after registers are changed
+        text_index (TextIndex): Rows by disasm and opcodes, None until
+            get_text_index() is called or after disasm is changed
+        search_text (SearchText): Texts of rows for regex filters, None until
+            get_search_text() is called or after a row is changed
+    """
+
+    FIELDS = ("id", "ip", "disasm", "comment", "regs", "opcodes", "mem")
+
+    def __init__(self, reg_count):
+        """Inits ColumnarTrace.
+
+        Args:
+            reg_count (int): Number of registers per row
+        """
+        self.reg_count = reg_count
+        self.ips = array("Q")
+        self.regs = array("Q")
+        self.strings = StringPool()
+        self.disasm_ids = array("I")
+        self.opcode_ids = array("I")
+        self.comments = CommentStore()
+        self.opcode_lookup = {}
+        self.mem_offsets = array("Q", [0])
+        self.mem_flags = bytearray()
+        self.mem_addrs = array("Q")
+        self.mem_values = array("Q")
+        self.mem_overrides = {}
+        self.missing_regs = {}
+        self.threads = None
+        self.thread_rows = {}
+        self.extra = {}
+        self.mem_addr_index = None
+        self.mem_value_index = None
+        self.reg_value_index = None
+        self.text_index = None
+        self.search_text = None
+
+    def __len__(self):
+        return len(self.ips)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TraceRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trace index out of range")
+        return TraceRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TraceRow(self, i)
+
+    def append(self, row):
+        """Appends a row to trace
+
+        Args:
+            row (dict): Trace row with ip, disasm, regs, opcodes and mem keys.
+                Comment and other keys are optional. Regchanges is ignored,
+                it is computed from register values when needed.
+        """
+        self.append_row(
+            row.get("ip"),
+            row["regs"],
+            bytes.fromhex(row["opcodes"]),
+            row["disasm"],
+            row.get("comment", ""),
+            row["mem"],
+            row.get("thread"),
+        )
+        for key, value in row.items():
+            if key not in self.FIELDS and key not in ("regchanges", "thread"):
+                self.set_field(len(self.ips) - 1, key, value)
+
+    def append_row(self, ip, regs, opcodes, disasm, comment="", mem=None, thread=None):
+        """Appends a row to trace without creating a dict
+
+        Args:
+            ip (int): Instruction pointer
+            regs (list): Register values
+            opcodes (bytes): Opcodes
+            disasm (str): Disasm text
+            comment (str): Comment
+            mem (list): Memory accesses, dicts with access, addr and value keys
+            thread (int): Thread id, None if not known
+        """
+        if len(regs) != self.reg_count:
+            raise ValueError(f"Expected {self.reg_count} registers, got {len(regs)}")
+        if None in regs:
+            self.missing_regs[len(self.ips)] = get_missing_regs(regs)
+            regs = [value or 0 for value in regs]
+        self.regs.extend(regs)
+        self.ips.append(ip or 0)
+        strings = self.strings
+        disasm_id = strings.ids.get(disasm)
+        if disasm_id is None:
+            disasm_id = strings.get_id(disasm)
+        self.disasm_ids.append(disasm_id)
+        opcode_id = self.opcode_lookup.get(opcodes)
+        if opcode_id is None:
+            opcode_id = strings.get_id(bytes(opcodes).hex())
+            self.opcode_lookup[bytes(opcodes)] = opcode_id
+        self.opcode_ids.append(opcode_id)
+        if comment:
+            self.comments.set(len(self.ips) - 1, comment)
+        if mem:
+            self.append_mems(mem)
+        self.mem_offsets.append(len(self.mem_addrs))
+        if thread is not None or self.threads is not None:
+            self.append_thread(thread)
+
+    def extend(self, rows):
+        """Appends rows to trace
+
+        Columns of another ColumnarTrace are appended without creating rows.
+
+        Args:
+            rows: ColumnarTrace or iterable of row dicts
+        """
+        if not isinstance(rows, ColumnarTrace):
+            for row in rows:
+                self.append(row)
+            return
+        if rows.reg_count != self.reg_count:
+            raise ValueError(f"Expected {self.reg_count} registers per row")
+        first_row = len(self.ips)
+        self.ips.extend(rows.ips)
+        self.regs.extend(rows.regs)
+        if rows.strings is self.strings:
+            self.disasm_ids.extend(rows.disasm_ids)
+            self.opcode_ids.extend(rows.opcode_ids)
+        else:
+            ids = [self.strings.get_id(text) for text in rows.strings.strings]
+            self.disasm_ids.extend(ids[i] for i in rows.disasm_ids)
+            self.opcode_ids.extend(ids[i] for i in rows.opcode_ids)
+        self.comments.update(rows.comments, first_row)
+        mem_offset = len(self.mem_addrs)
+        self.mem_flags += rows.mem_flags
+        self.mem_addrs.extend(rows.mem_addrs)
+        self.mem_values.extend(rows.mem_values)
+        self.mem_offsets.extend(offset + mem_offset for offset in rows.mem_offsets[1:])
+        for index, mem in rows.mem_overrides.items():
+            self.mem_overrides[first_row + index] = mem
+        for index, missing in rows.missing_regs.items():
+            self.missing_regs[first_row + index] = missing
+        if rows.threads is not None or self.threads is not None:
+            self.extend_threads(rows, first_row)
+        for index, fields in rows.extra.items():
+            self.extra[first_row + index] = dict(fields)
+
+    def get_rows(self, start, end):
+        """Returns a copy of rows as a new ColumnarTrace
+
+        Args:
+            start (int): Index of the first row
+            end (int): Index after the last row
+        Returns:
+            ColumnarTrace: Copied rows, the string pool is shared
+        """
+        end = min(end, len(self))
+        rows = ColumnarTrace(self.reg_count)
+        rows.ips = self.ips[start:end]
+        rows.regs = self.regs[start * self.reg_count : end * self.reg_count]
+        rows.strings = self.strings
+        rows.opcode_lookup = self.opcode_lookup
+        rows.disasm_ids = self.disasm_ids[start:end]
+        rows.opcode_ids = self.opcode_ids[start:end]
+        rows.comments = self.comments.get_range(start, end)
+        first_mem = self.mem_offsets[start]
+        last_mem = self.mem_offsets[end]
+        rows.mem_flags = self.mem_flags[first_mem:last_mem]
+        rows.mem_addrs = self.mem_addrs[first_mem:last_mem]
+        rows.mem_values = self.mem_values[first_mem:last_mem]
+        rows.mem_offsets = array(
+            "Q", (offset - first_mem for offset in self.mem_offsets[start : end + 1])
+        )
+        for index, mem in self.mem_overrides.items():
+            if start <= index < end:
+                rows.mem_overrides[index - start] = mem
+        for index, missing in self.missing_regs.items():
+            if start <= index < end:
+                rows.missing_regs[index - start] = missing
+        if self.threads is not None:
+            rows.threads = self.threads[start:end]
+            rows.thread_rows = None
+        for index, fields in self.extra.items():
+            if start <= index < end:
+                rows.extra[index - start] = dict(fields)
+        return rows
+
+    def append_thread(self, thread):
+        """Adds thread id of the last row to thread column and index
+
+        Args:
+            thread (int): Thread id, None if not known
+        """
+        index = len(self.ips) - 1
+        if self.threads is None:
+            self.threads = array("I", [NO_THREAD]) * index
+        if thread is None:
+            thread = NO_THREAD
+        self.threads.append(thread)
+        if thread != NO_THREAD and self.thread_rows is not None:
+            rows = self.thread_rows.get(thread)
+            if rows is None:
+                rows = self.thread_rows[thread] = array("I")
+            rows.append(index)
+
+    def extend_threads(self, rows, first_row):
+        """Appends thread ids of rows to thread column and index
+
+        Args:
+            rows (ColumnarTrace): Rows appended by extend()
+            first_row (int): Index of the first appended row
+        """
+        if self.threads is None:
+            self.threads = array("I", [NO_THREAD]) * first_row
+        if rows.threads is None:
+            self.threads.extend(array("I", [NO_THREAD]) * len(rows))
+            return
+        self.threads.extend(rows.threads)
+        if self.thread_rows is None or rows.thread_rows is None:
+            self.thread_rows = None
+            return
+        for thread, thread_rows in rows.thread_rows.items():
+            index = self.thread_rows.get(thread)
+            if index is None:
+                index = self.thread_rows[thread] = array("I")
+            index.extend(row + first_row for row in thread_rows)
+
+    def get_thread_index(self):
+        """Returns row indexes by thread id, builds the index if needed
+
+        Returns:
+            dict: Row indexes (array) by thread id
+        """
+        if self.thread_rows is None:
+            self.thread_rows = index_threads(self.threads or ())
+        return self.thread_rows
+
+    def get_thread_rows(self, thread):
+        """Returns indexes of rows executed by a thread
+
+        Args:
+            thread (int): Thread id
+        Returns:
+            array: Row indexes
+        """
+        return self.get_thread_index().get(thread, array("I"))
+
+    def get_comments(self):
+        """Returns comments of rows which have one
+
+        Returns:
+            CommentStore: Comments by row
+        """
+        return self.comments
+
+    def get_text_index(self):
+        """Returns index of rows by disasm and opcodes
+
+        The index is built on the first call. Rows appended later are added
+        on the next call, changing disasm of a row rebuilds it.
+
+        Returns:
+            TextIndex: Rows by disasm and opcode strings
+        """
+        index = self.text_index
+        if index is None:
+            index = TextIndex(self.strings)
+        row_count = len(self)
+        if index.row_count < row_count:
+            index.add_rows(self, index.row_count, row_count)
+            index.recent_rows += row_count - index.row_count
+            index.row_count = row_count
+            # appended rows are merged when there are many of them
+            if index.recent_rows * INDEX_MERGE_RATIO >= row_count:
+                index.build()
+        self.text_index = index
+        return index
+
+    def get_text_postings(self, key, condition):
+        """Returns rows of the disasm or opcode strings matching a condition
+
+        The condition is evaluated once for every unique string.
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted sequences of row indexes, one or more per string
+        """
+        return self.get_text_index().get_postings(key, condition)
+
+    def get_text_rows(self, key, condition):
+        """Returns rows whose disasm or opcodes match a condition
+
+        The condition is evaluated once for every unique string.
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_text_index().get_rows(key, condition)
+
+    def get_search_text(self):
+        """Returns search text of all rows for regex filters
+
+        The text is built on the first call and rebuilt after rows are
+        appended or comments, disasm or memory accesses are changed.
+
+        Returns:
+            SearchText: Texts of all rows
+        """
+        if self.search_text is None or len(self.search_text) != len(self):
+            self.search_text = SearchText(get_search_texts(self))
+        return self.search_text
+
+    def get_text_ids(self, key):
+        """Returns string id column of disasm or opcodes
+
+        Args:
+            key (str): "disasm" or "opcodes"
+        Returns:
+            array: String ids of rows
+        """
+        if key == "disasm":
+            return self.disasm_ids
+        if key == "opcodes":
+            return self.opcode_ids
+        raise KeyError(f"Field {key} is not a text field")
+
+    def append_mems(self, mem):
+        """Appends memory accesses of the last row to memory access columns
+
+        Accesses which do not fit to the columns are kept in mem_overrides.
+
+        Args:
+            mem (list): Memory accesses, dicts with access, addr and value keys
+        """
+        start = len(self.mem_addrs)
+        try:
+            for access in mem:
+                if len(access) != 3:
+                    raise KeyError("unknown keys")
+                self.mem_flags.append(MEM_ACCESS_FLAGS[access["access"]])
+                self.mem_addrs.append(access["addr"])
+                self.mem_values.append(access["value"])
+        except (KeyError, TypeError, OverflowError):
+            del self.mem_flags[start:]
+            del self.mem_addrs[start:]
+            del self.mem_values[start:]
+            self.mem_overrides[len(self.ips) - 1] = list(mem)
+
+    def get_mems(self, index):
+        """Returns memory accesses of a row
+
+        Args:
+            index (int): Row index
+        Returns:
+            list: Memory accesses as dicts with access, addr and value keys
+        """
+        if self.mem_overrides and index in self.mem_overrides:
+            return self.mem_overrides[index]
+        start = self.mem_offsets[index]
+        end = self.mem_offsets[index + 1]
+        if start == end:
+            return []
+        return [
+            {
+                "access": MEM_ACCESS_TYPES[self.mem_flags[i]],
+                "addr": self.mem_addrs[i],
+                "value": self.mem_values[i],
+            }
+            for i in range(start, end)
+        ]
+
+    def get_mem_addr_index(self):
+        """Returns index of rows by memory address
+
+        The index is built on the first call. Rows appended later are added
+        on the next call, changing memory accesses of a row rebuilds it.
+
+        Returns:
+            MemAddressIndex: Rows by memory address
+        """
+        self.mem_addr_index = self.update_mem_index(
+            self.mem_addr_index or MemAddressIndex()
+        )
+        return self.mem_addr_index
+
+    def get_mem_value_index(self):
+        """Returns index of rows by memory value, see get_mem_addr_index()
+
+        Returns:
+            MemValueIndex: Rows by memory value
+        """
+        self.mem_value_index = self.update_mem_index(
+            self.mem_value_index or MemValueIndex()
+        )
+        return self.mem_value_index
+
+    def update_mem_index(self, index):
+        """Adds rows appended after the last update to a memory index
+
+        Args:
+            index (MemAddressIndex): Memory address or value index
+        Returns:
+            MemAddressIndex: The updated index
+        """
+        row_count = len(self)
+        if index.row_count < row_count:
+            index.add_rows(self, index.row_count, row_count)
+            for row, mems in self.mem_overrides.items():
+                if row >= index.row_count:
+                    index.add_mems(row, mems)
+            index.recent_rows += row_count - index.row_count
+            index.row_count = row_count
+            # appended rows are merged when there are many of them
+            if index.recent_rows * INDEX_MERGE_RATIO >= row_count:
+                index.build()
+        return index
+
+    def get_mem_addr_rows(self, first_addr, last_addr=None, access=None):
+        """Returns rows which access an address or an address range
+
+        Args:
+            first_addr (int): Address, or first address of range
+            last_addr (int, optional): Last address of range, included
+            access (str, optional): "READ" or "WRITE", None matches both
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_mem_addr_index().get_rows(first_addr, last_addr, access)
+
+    def get_mem_value_rows(self, value, access=None):
+        """Returns rows which read or write a memory value
+
+        Args:
+            value (int): Memory value
+            access (str, optional): "READ" or "WRITE", None matches both
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_mem_value_index().get_rows(value, None, access)
+
+    def get_reg_value_index(self):
+        """Returns index of rows by register value
+
+        The index is built on the first call. Rows appended later are added
+        on the next call, changing register values of a row rebuilds it.
+
+        Returns:
+            RegValueIndex: Rows by register value
+        """
+        index = self.reg_value_index
+        if index is None:
+            index = RegValueIndex(self.reg_count)
+        row_count = len(self)
+        if index.row_count < row_count:
+            index.add_rows(self, index.row_count, row_count)
+            # appended rows are merged when there are many of them
+            if index.recent_rows * INDEX_MERGE_RATIO >= row_count:
+                index.build()
+        self.reg_value_index = index
+        return index
+
+    def get_reg_value_ranges(self, value, reg_index=None):
+        """Returns row ranges where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted (first row, end row) tuples
+        """
+        return self.get_reg_value_index().get_ranges(value, reg_index)
+
+    def get_reg_value_rows(self, value, reg_index=None):
+        """Returns rows where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_reg_value_index().get_rows(value, reg_index)
+
+    def get_regs(self, index):
+        """Returns register values of a row
+
+        Args:
+            index (int): Row index
+        Returns:
+            list: Register values
+        """
+        start = index * self.reg_count
+        values = self.regs[start : start + self.reg_count].tolist()
+        if self.missing_regs and index in self.missing_regs:
+            for reg_index in self.missing_regs[index]:
+                values[reg_index] = None
+        return values
+
+    def get_reg_value(self, index, reg_index):
+        """Returns a value of one register
+
+        Args:
+            index (int): Row index
+            reg_index (int): Register index
+        Returns:
+            int: Register value, None if not known
+        """
+        if self.missing_regs and reg_index in self.missing_regs.get(index, ()):
+            return None
+        return self.regs[index * self.reg_count + reg_index]
+
+    def get_keys(self, index):
+        """Returns field names of a row
+
+        Args:
+            index (int): Row index
+        Returns:
+            list: Field names
+        """
+        keys = list(self.FIELDS)
+        if self.threads is not None and self.threads[index] != NO_THREAD:
+            keys.append("thread")
+        if index in self.extra:
+            keys.extend(self.extra[index])
+        return keys
+
+    def get_field(self, index, key):
+        """Returns a field value of a row
+
+        Args:
+            index (int): Row index
+            key (str): Field name
+        Raises:
+            KeyError: If row has no such field
+        Returns:
+            Field value
+        """
+        if key == "id":
+            return index
+        if key == "ip":
+            return self.ips[index]
+        if key == "disasm":
+            return self.strings.strings[self.disasm_ids[index]]
+        if key == "comment":
+            return self.comments.get(index)
+        if key == "regs":
+            return self.get_regs(index)
+        if key == "opcodes":
+            return self.strings.strings[self.opcode_ids[index]]
+        if key == "mem":
+            return self.get_mems(index)
+        if key == "thread" and self.threads is not None:
+            thread = self.threads[index]
+            if thread != NO_THREAD:
+                return thread
+        return self.extra.get(index, {})[key]
+
+    def set_field(self, index, key, value):
+        """Sets a field value of a row
+
+        Args:
+            index (int): Row index
+            key (str): Field name
+            value: New value
+        Raises:
+            KeyError: If field can not be changed
+        """
+        if key == "comment":
+            self.comments.set(index, value)
+            self.search_text = None
+        elif key == "disasm":
+            self.disasm_ids[index] = self.strings.get_id(value)
+            self.text_index = None
+            self.search_text = None
+        elif key == "mem":
+            self.mem_overrides[index] = list(value or [])
+            self.mem_addr_index = None
+            self.mem_value_index = None
+            self.search_text = None
+        elif key == "regs":
+            if len(value) != self.reg_count:
+                raise ValueError(f"Expected {self.reg_count} registers")
+            self.missing_regs.pop(index, None)
+            if None in value:
+                self.missing_regs[index] = get_missing_regs(value)
+                value = [reg_value or 0 for reg_value in value]
+            start = index * self.reg_count
+            self.regs[start : start + self.reg_count] = array("Q", value)
+            self.reg_value_index = None
+        elif key == "ip":
+            self.ips[index] = value
+        elif key == "thread":
+            if self.threads is None:
+                self.threads = array("I", [NO_THREAD]) * len(self)
+            self.threads[index] = value
+            self.thread_rows = None
+        elif key in self.FIELDS:
+            raise KeyError(f"Field {key} is read-only")
+        else:
+            self.extra.setdefault(index, {})[key] = value
+
+    def del_field(self, index, key):
+        """Deletes a field of a row
+
+        Only comment and extra fields can be deleted.
+
+        Args:
+            index (int): Row index
+            key (str): Field name
+        """
+        if key == "comment":
+            self.comments.set(index, "")
+            self.search_text = None
+        elif key == "thread" and self.threads is not None:
+            if self.threads[index] == NO_THREAD:
+                raise KeyError(key)
+            self.threads[index] = NO_THREAD
+            self.thread_rows = None
+        elif key in self.FIELDS:
+            raise KeyError(f"Field {key} can not be deleted")
+        else:
+            fields = self.extra.get(index, {})
+            del fields[key]
+            if not fields:
+                self.extra.pop(index, None)
@@ -0,0 +1,393 @@
+import os
+
+from core import compressed, prefs
+from core.annotations import AnnotationJournal
+from core.bookmark import Bookmark
+from core.disasm import DisasmRequest, get_disasm_cache, save_disasm_cache
+from core.trace_data import NO_THREAD, ColumnarTrace, StringPool, TraceData
+from core.trace_files import (
+    READ_BUFFER_SIZE,
+    TVT_BLOCK_INDEX,
+    BlockTvTrace,
+    TvtDecoder,
+    X64dbgDecoder,
+    add_x64dbg_rows,
+    decode_tv_bookmarks,
+    decompress_to_temp_file,
+    encode_tv_block,
+    encode_tv_bookmarks,
+    encode_tv_rows,
+    get_struct,
+    read_tv_header,
+    read_x64dbg_header,
+    write_tv_block_index,
+    write_tv_header,
+)
+
+# number of rows decoded and written at a time
+EXPORT_CHUNK_ROWS = 65536
+
+
+def export_rows(filename, output_filename, first_row, last_row, version=None):
+    """Saves a range of rows of a trace file to a new tvt file
+
+    Only the rows in the range are decoded. Rows before the range are
+    skipped (tvt v1 and x64dbg) or not read at all (tvt v2). Rows are
+    decoded and written in chunks, so memory use does not depend on the
+    size of the trace or the range. Bookmarks overlapping the range are
+    kept and their rows are moved to match the new trace. Comments and
+    bookmarks saved to the annotation journal of the file are exported too.
+
+    Args:
+        filename (str): Tvt or x64dbg trace file, may be compressed
+        output_filename (str): Name of the new tvt file
+        first_row (int): First row to export
+        last_row (int): Last row to export, rows after the end of trace
+            are ignored
+        version (int, optional): Format version of the new file, 1 or 2.
+            Defaults to prefs.TVT_SAVE_VERSION.
+    Returns:
+        int: Number of exported rows
+    Raises:
+        ValueError: If the row range is wrong or file format is not supported
+    """
+    if first_row < 0 or last_row < first_row:
+        raise ValueError(f"Wrong row range: {first_row}-{last_row}")
+    if version is None:
+        version = prefs.TVT_SAVE_VERSION
+    if version not in (1, 2):
+        raise ValueError(f"Unsupported tvt version: {version}")
+
+    magic = compressed.read_magic(filename)
+    trace_data = TraceData()
+    with compressed.open_file(filename) as f:
+        if magic == b"TVTR":
+            file_info, header = read_tv_header(f, trace_data)
+            file_version = str(file_info.get("version", "1.0"))
+            if file_version.startswith("2."):
+                chunks = iter_tv_block_rows(
+                    filename, f, file_info, header, trace_data, first_row, last_row
+                )
+            elif file_version.startswith("1."):
+                chunks = iter_tv_rows(f, trace_data, first_row, last_row)
+            else:
+                raise ValueError(f"Error, unsupported tvt version: {file_version}")
+        elif magic == b"TRAC":
+            capstone_mode = read_x64dbg_header(f, trace_data)
+            chunks = iter_x64dbg_rows(f, trace_data, capstone_mode, first_row, last_row)
+        else:
+            raise ValueError("Error, only tvt and x64dbg traces can be exported.")
+
+        # comments and bookmarks saved after the trace file was written
+        journal = AnnotationJournal(filename)
+        journal.read()
+
+        # write to a temporary file first, like save_as_tv_trace()
+        temp_filename = output_filename + ".tmp"
+        try:
+            with open(temp_filename, "wb") as out:
+                writer = TvtWriter(out, trace_data, version)
+                for rows in add_journal_comments(chunks, journal.comments, first_row):
+                    writer.write(rows)
+                # bookmarks are known after the source has been read
+                bookmarks = trace_data.bookmarks
+                if journal.bookmarks is not None:
+                    bookmarks = [Bookmark(*values) for values in journal.bookmarks]
+                writer.close(rebase_bookmarks(bookmarks, first_row, last_row))
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        finally:
+            chunks.close()
+    os.replace(temp_filename, output_filename)
+    return writer.row_count
+
+
+def add_journal_comments(chunks, comments, first_row):
+    """Sets journaled comments to rows of chunks
+
+    Args:
+        chunks (iterator): Chunks of consecutive rows, from first_row
+        comments (dict): Journaled comments by row of the source trace
+        first_row (int): Row of the source trace of the first chunk row
+    Yields:
+        ColumnarTrace: Rows of the chunk
+    """
+    rows_with_comments = sorted(row for row in comments if row >= first_row)
+    i = 0
+    start = first_row
+    for rows in chunks:
+        end = start + len(rows)
+        while i < len(rows_with_comments) and rows_with_comments[i] < end:
+            row = rows_with_comments[i]
+            rows[row - start]["comment"] = comments[row]
+            i += 1
+        start = end
+        yield rows
+
+
+def rebase_bookmarks(bookmarks, first_row, last_row):
+    """Returns bookmarks overlapping a row range, moved to start from 0
+
+    Args:
+        bookmarks (list): Bookmarks
+        first_row (int): First row of range
+        last_row (int): Last row of range
+    Returns:
+        list: New bookmarks, clipped to the range
+    """
+    rebased = []
+    for bookmark in bookmarks:
+        if bookmark.endrow < first_row or bookmark.startrow > last_row:
+            continue
+        rebased.append(
+            Bookmark(
+                bookmark.addr,
+                bookmark.disasm,
+                max(bookmark.startrow, first_row) - first_row,
+                min(bookmark.endrow, last_row) - first_row,
+                bookmark.comment,
+            )
+        )
+    return rebased
+
+
+def iter_tv_rows(f, trace_data, first_row, last_row):
+    """Reads a row range of a tvt v1 trace in chunks
+
+    Rows before the range are skipped, only their register values and
+    thread ids are tracked. Bookmarks are read to trace_data after the
+    last chunk.
+
+    Args:
+        f: File object, positioned after the header
+        trace_data (TraceData): Trace data with trace info
+        first_row (int): First row of range
+        last_row (int): Last row of range
+    Yields:
+        ColumnarTrace: Rows of the range
+    """
+    reg_count = len(trace_data.regs)
+    decoder = TvtDecoder(
+        None, trace_data.regs, trace_data.ip_reg, trace_data.pointer_size
+    )
+    buffer = b""
+    pos = 0
+
+    def read_more():
+        nonlocal buffer, pos
+        chunk = f.read(READ_BUFFER_SIZE)
+        if not chunk:
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    while decoder.row_id < first_row and not decoder.done:
+        pos = decoder.skip(buffer, pos, first_row - decoder.row_id)
+        if decoder.row_id < first_row and not decoder.done and not read_more():
+            break
+
+    while decoder.row_id <= last_row and not decoder.done:
+        row_count = min(EXPORT_CHUNK_ROWS, last_row + 1 - decoder.row_id)
+        decoder.trace = ColumnarTrace(reg_count)
+        pos = decoder.decode(buffer, pos, row_count)
+        if len(decoder.trace):
+            yield decoder.trace
+        if len(decoder.trace) < row_count and not decoder.done and not read_more():
+            break
+
+    # bookmarks are after the last row
+    while not decoder.done:
+        pos = decoder.skip(buffer, pos)
+        if not decoder.done and not read_more():
+            break
+    for bookmark in decode_tv_bookmarks(buffer[pos:] + f.read()):
+        trace_data.add_bookmark(bookmark)
+
+
+def iter_tv_block_rows(filename, f, file_info, header, trace_data, first_row, last_row):
+    """Reads a row range of a tvt v2 trace in chunks
+
+    Only the blocks overlapping the range are decompressed and decoded.
+
+    Args:
+        filename (str): Trace file name
+        f: File object, positioned after the header
+        file_info (dict): File info from the header
+        header (bytes): Data already read from f
+        trace_data (TraceData): Trace data with trace info, bookmarks are
+            added to it
+        first_row (int): First row of range
+        last_row (int): Last row of range
+    Yields:
+        ColumnarTrace: Rows of the range
+    """
+    block_filename = filename
+    if isinstance(f, compressed.DecompressingReader):
+        # blocks are read from the index, decompress to a temp file
+        block_filename = decompress_to_temp_file(f, header)
+    try:
+        trace = BlockTvTrace(
+            block_filename,
+            trace_data.regs,
+            trace_data.ip_reg,
+            trace_data.pointer_size,
+            file_info.get("compression", "none"),
+            file_info["block_rows"],
+        )
+        try:
+            for bookmark in decode_tv_bookmarks(trace.get_trailing_data()):
+                trace_data.add_bookmark(bookmark)
+            block_rows = trace.block_rows
+            last_row = min(last_row, len(trace) - 1)
+            for block in range(first_row // block_rows, last_row // block_rows + 1):
+                start = block * block_rows
+                rows = trace.decode_block(block)
+                yield rows.get_rows(
+                    max(first_row - start, 0), min(last_row + 1 - start, len(rows))
+                )
+        finally:
+            trace.close()
+    finally:
+        if block_filename != filename:
+            os.remove(block_filename)
+
+
+def iter_x64dbg_rows(f, trace_data, capstone_mode, first_row, last_row):
+    """Reads and disassembles a row range of an x64dbg trace in chunks
+
+    Records before the range are decoded to track register values and
+    thread ids, but they are not disassembled.
+
+    Args:
+        f: File object, positioned after the header
+        trace_data (TraceData): Trace data with trace info
+        capstone_mode (int): Capstone mode of the arch
+        first_row (int): First row of range
+        last_row (int): Last row of range
+    Yields:
+        ColumnarTrace: Rows of the range
+    """
+    reg_count = len(trace_data.regs)
+    decoder = X64dbgDecoder(trace_data.regs, trace_data.ip_reg, trace_data.pointer_size)
+    cache = get_disasm_cache(capstone_mode)
+    strings = StringPool()
+    buffer = b""
+    pos = 0
+    try:
+        while not decoder.done and decoder.row_id <= last_row:
+            chunk = f.read(READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            buffer = buffer[pos:] + chunk
+            first_id = decoder.row_id
+            pos = decoder.decode(buffer)
+
+            records = decoder.records
+            selected = records[max(first_row - first_id, 0) : last_row + 1 - first_id]
+            records.clear()
+            for start in range(0, len(selected), EXPORT_CHUNK_ROWS):
+                batch = selected[start : start + EXPORT_CHUNK_ROWS]
+                disasm_list = DisasmRequest(
+                    cache,
+                    [record[2] for record in batch],
+                    [record[0] for record in batch],
+                ).result()
+                rows = ColumnarTrace(reg_count)
+                add_x64dbg_rows(rows, batch, disasm_list, strings)
+                yield rows
+    finally:
+        save_disasm_cache(cache)
+
+
+class TvtWriter:
+    """Writes a tvt file one chunk of rows at a time
+
+    Output is the same as save_as_tv_trace() gives for the same rows.
+
+    Attributes:
+        f: Output file
+        version (int): Format version, 1 or 2
+        row_count (int): Number of rows written
+        reg_values (list): Register values of the last written row
+        thread (int): Thread id of the last written row, None if not known
+        pending (ColumnarTrace): Rows waiting for a full v2 block
+        index (bytearray): Block index of v2 file
+    """
+
+    def __init__(self, f, trace_data, version):
+        """Inits TvtWriter and writes the header
+
+        Args:
+            f: Output file
+            trace_data (TraceData): Trace data with trace info
+            version (int): Format version, 1 or 2
+        """
+        self.f = f
+        self.version = version
+        self.reg_count = len(trace_data.regs)
+        self.pointer_size = write_tv_header(f, trace_data, version)
+        self.block_rows = prefs.TVT_BLOCK_ROWS
+        self.row_count = 0
+        self.reg_values = None
+        self.thread = None
+        self.pending = ColumnarTrace(self.reg_count)
+        self.index = bytearray()
+
+    def write(self, rows):
+        """Writes rows, v2 rows are written when a block is full
+
+        Args:
+            rows (ColumnarTrace): Rows
+        """
+        if self.version == 1:
+            self.f.write(
+                encode_tv_rows(rows, self.reg_values, self.pointer_size, self.thread)
+            )
+            self.set_last_row(rows, len(rows))
+            return
+        self.pending.extend(rows)
+        while len(self.pending) >= self.block_rows:
+            self.write_block(self.block_rows)
+
+    def write_block(self, row_count):
+        """Writes first row_count pending rows as a v2 block"""
+        rows = self.pending.get_rows(0, row_count)
+        self.pending = self.pending.get_rows(row_count, len(self.pending))
+        if self.reg_values is None:
+            keyframe = [0] * self.reg_count
+        else:
+            keyframe = [value or 0 for value in self.reg_values]
+        data = encode_tv_block(rows, keyframe, prefs.TVT_COMPRESSION)
+        self.index += TVT_BLOCK_INDEX.pack(
+            self.row_count, self.f.tell(), len(data), row_count
+        )
+        self.index += get_struct(self.reg_count, self.pointer_size).pack(*keyframe)
+        self.f.write(data)
+        self.set_last_row(rows, row_count)
+
+    def set_last_row(self, rows, row_count):
+        """Keeps register values and thread id of the last written row"""
+        if not row_count:
+            return
+        self.row_count += row_count
+        self.reg_values = list(rows.get_regs(row_count - 1))
+        thread = NO_THREAD if rows.threads is None else rows.threads[row_count - 1]
+        self.thread = None if thread == NO_THREAD else thread
+
+    def close(self, bookmarks):
+        """Writes pending rows and bookmarks, the file is not closed
+
+        Args:
+            bookmarks (list): Bookmarks
+        """
+        if self.version == 1:
+            self.f.write(encode_tv_bookmarks(bookmarks))
+            return
+        if len(self.pending):
+            self.write_block(len(self.pending))
+        write_tv_block_index(
+            self.f, bytes(self.index), bookmarks, self.reg_count, self.pointer_size
+        )
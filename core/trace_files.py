@@ -1,230 +1,1560 @@
+import codecs
 import json
+import lzma
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import tempfile
 import traceback
-from capstone import Cs, CS_ARCH_X86, CS_MODE_32, CS_MODE_64
-
-from core.trace_data import TraceData
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from functools import lru_cache
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
+from capstone import CS_MODE_32, CS_MODE_64
+
+from core.trace_data import (
+    NO_THREAD,
+    TEXT_FIELDS,
+    TraceData,
+    ColumnarTrace,
+    TraceRow,
+    StringPool,
+    CommentStore,
+    MemAddressIndex,
+    MemValueIndex,
+    RegValueIndex,
+    SearchText,
+    TextIndex,
+    format_search_text,
+    get_search_texts,
+    index_threads,
+)
 from core.bookmark import Bookmark
-from core import prefs
-
-
-def open_trace(filename):
+from core.disasm import DisasmRequest, get_disasm_cache, save_disasm_cache
+from core import compressed, prefs, trace_cache
+from core.annotations import AnnotationJournal, remove_journal
+
+READ_BUFFER_SIZE = 16 * 1024 * 1024
+# rows decoded between progress callbacks when loading tvt v1 traces
+PROGRESS_ROWS = 16384
+STRUCT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+BOOKMARK_ROWS = struct.Struct("<II")
+# tvt v2: first row, file offset, size and row count of a block
+TVT_BLOCK_INDEX = struct.Struct("<QQII")
+# tvt v2: file offset of block index, block count and magic
+TVT_TRAILER = struct.Struct("<QI4s")
+TVT_TRAILER_MAGIC = b"TVTI"
+TVT_THREAD_FLAG = 1
+THREAD_ID = struct.Struct("<I")
+COMPRESSORS = {
+    "none": bytes,
+    "zlib": zlib.compress,
+    "lzma": lzma.compress,
+}
+DECOMPRESSORS = {
+    "none": bytes,
+    "zlib": zlib.decompress,
+    "lzma": lzma.decompress,
+}
+# JSON Lines traces: header line, one line per row and a bookmarks line
+JSONL_FORMAT = "jsonl"
+JSONL_VERSION = 1
+# JSON Lines traces are recognized by a header line in this many first bytes
+JSONL_HEADER_MAX_SIZE = 64 * 1024
+# JSON Lines traces are read in chunks of whole lines of about this size
+JSONL_CHUNK_SIZE = 8 * 1024 * 1024
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class LoadCancelled(Exception):
+    """Raised by a progress callback to cancel loading a trace"""
+
+
+def open_trace(filename, progress=None, follow=False):
     """Opens trace file and reads trace data and bookmarks
 
+    Comments and bookmarks saved to the annotation journal of the file
+    are applied to the trace. Files compressed with gzip, xz or bz2 are
+    decompressed while they are loaded.
+
     Args:
         filename: name of trace file
+        progress (callable, optional): Called as progress(trace_data, done,
+            total) every time a chunk of rows is decoded. done and total are
+            in bytes of the trace file. All rows in trace_data.trace are
+            complete during the call, but bookmarks are not loaded yet.
+            The callback can raise LoadCancelled to stop loading.
+        follow (bool, optional): Keep the state of the decoder in
+            trace_data.follower, so rows appended to the file later can be
+            added to the trace. Only x64dbg and uncompressed tvt v1 traces
+            can be followed.
+    Raises:
+        LoadCancelled: If loading was cancelled by progress callback
+        ValueError: If the trace can not be followed
     """
     try:
-        with open(filename, "rb") as f:
-            magic = f.read(4)
-    except IOError:
+        magic = compressed.read_magic(filename, JSONL_HEADER_MAX_SIZE)
+    except (IOError, EOFError):
         print("Error, could not open file.")
     else:
-        if magic == b"TRAC":
-            return open_x64dbg_trace(filename)
-        elif magic == b"TVTR":
-            return open_tv_trace(filename)
-        return open_json_trace(filename)
+        if follow and magic[:4] not in (b"TRAC", b"TVTR"):
+            raise ValueError("Error, only tvt and x64dbg traces can be followed.")
+        if magic[:4] == b"TRAC":
+            if follow:
+                # the cache has only the rows written so far
+                trace_data = open_x64dbg_trace(filename, progress, follow)
+            else:
+                trace_data = open_cached_x64dbg_trace(filename, progress)
+        elif magic[:4] == b"TVTR":
+            trace_data = open_tv_trace(filename, progress=progress, follow=follow)
+        elif is_jsonl_header(magic):
+            trace_data = open_jsonl_trace(filename, progress)
+        else:
+            trace_data = open_json_trace(filename, progress)
+        if trace_data is not None:
+            trace_data.journal = AnnotationJournal(filename)
+            trace_data.journal.load(trace_data)
+        return trace_data
     return None
 
 
-def open_tv_trace(filename):
+def save_annotations(trace_data):
+    """Saves changed comments and bookmarks to the annotation journal
+
+    The trace file itself is not rewritten.
+
+    Args:
+        trace_data: TraceData object
+    Returns:
+        bool: True if saved
+    """
+    if trace_data.journal is None:
+        if not trace_data.filename:
+            return False
+        trace_data.journal = AnnotationJournal(trace_data.filename)
+    return trace_data.journal.save(trace_data)
+
+
+def new_trace(reg_count, columnar=None):
+    """Returns an empty trace for loaders
+
+    Args:
+        reg_count: number of registers
+        columnar (bool, optional): Store rows in columns. Defaults to
+            prefs.COLUMNAR_TRACE, worker processes get it as an argument.
+    Returns:
+        ColumnarTrace, or list if columnar storage is disabled
+    """
+    if columnar is None:
+        columnar = prefs.COLUMNAR_TRACE
+    if columnar:
+        return ColumnarTrace(reg_count)
+    return []
+
+
+def open_tv_trace(filename, lazy=None, progress=None, follow=False):
     """Opens tvt trace file and reads trace data and bookmarks
 
     Args:
         filename: name of trace file
+        lazy (bool, optional): Memory-map the file and decode rows on demand.
+            Defaults to None, which uses prefs.MMAP_MIN_FILE_SIZE to decide.
+        progress (callable, optional): Progress callback, see open_trace()
+        follow (bool, optional): Set trace_data.follower, see open_trace()
     """
-    with open(filename, "rb") as f:
+    with compressed.open_file(filename) as f:
         trace_data = TraceData()
         trace_data.filename = filename
+        is_compressed = isinstance(f, compressed.DecompressingReader)
+        file_info, header = read_tv_header(f, trace_data)
+        reg_indexes = trace_data.regs
+        ip_reg = trace_data.ip_reg
+        pointer_size = trace_data.pointer_size
+
+        version = str(file_info.get("version", "1.0"))
+        if follow and (is_compressed or not version.startswith("1.")):
+            raise ValueError("Error, only uncompressed tvt v1 traces can be followed.")
+
+        if is_compressed or follow:
+            # compressed files can not be memory-mapped, followed rows are
+            # appended to a ColumnarTrace
+            lazy = False
+        elif lazy is None:
+            min_size = prefs.MMAP_MIN_FILE_SIZE
+            lazy = min_size is not None and os.path.getsize(filename) >= min_size
+
+        if version.startswith("2."):
+            block_filename = filename
+            if is_compressed:
+                # v2 needs random access to blocks, decompress to a temp file
+                block_filename = decompress_to_temp_file(f, header)
+            try:
+                trace = BlockTvTrace(
+                    block_filename,
+                    reg_indexes,
+                    ip_reg,
+                    pointer_size,
+                    file_info.get("compression", "none"),
+                    file_info["block_rows"],
+                )
+                for bookmark in decode_tv_bookmarks(trace.get_trailing_data()):
+                    trace_data.add_bookmark(bookmark)
+                if lazy:
+                    trace_data.trace = trace
+                else:
+                    try:
+                        trace_data.trace = new_trace(len(reg_indexes))
+                        trace.decode_all(trace_data, progress)
+                    finally:
+                        trace.close()
+            finally:
+                if block_filename != filename:
+                    os.remove(block_filename)
+            return trace_data
+        elif not version.startswith("1."):
+            raise ValueError(f"Error, unsupported tvt version: {version}")
+
+        if lazy:
+            trace = MappedTvTrace(filename, f.tell(), reg_indexes, ip_reg, pointer_size)
+            trace_data.trace = trace
+            for bookmark in decode_tv_bookmarks(trace.get_trailing_data()):
+                trace_data.add_bookmark(bookmark)
+            return trace_data
+
+        decoder = TvtDecoder(
+            new_trace(len(reg_indexes)), reg_indexes, ip_reg, pointer_size
+        )
+        trace_data.trace = decoder.trace
+        file_size = compressed.get_file_size(f)
+        buffer = b""
+        pos = 0
+        # decode in smaller steps if progress is reported
+        max_rows = PROGRESS_ROWS if progress is not None else None
+        while not decoder.done:
+            chunk = f.read(READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            while True:
+                first_row = decoder.row_id
+                pos = decoder.decode(buffer, pos, max_rows)
+                if progress is not None:
+                    position = compressed.get_read_position(f, len(buffer) - pos)
+                    progress(trace_data, position, file_size)
+                if decoder.done or decoder.row_id - first_row != max_rows:
+                    break
+
+        if follow:
+            # rows written to the file later are decoded from the first
+            # incomplete row
+            offset = f.tell() - (len(buffer) - pos)
+            trace_data.follower = TraceFollower(filename, offset, decoder)
+        buffer = buffer[pos:] + f.read()
+        for bookmark in decode_tv_bookmarks(buffer):
+            trace_data.add_bookmark(bookmark)
+
+        return trace_data
 
-        # check first 4 bytes
-        magic = f.read(4)
-        if magic != b"TVTR":
-            raise ValueError("Error, wrong file format.")
 
-        json_length_bytes = f.read(4)
-        json_length = int.from_bytes(json_length_bytes, "little")
+def read_tv_header(f, trace_data):
+    """Reads header of a tvt trace and sets trace info to trace data
 
-        # read JSON blob
-        json_blob = f.read(json_length)
-        json_str = str(json_blob, "utf-8")
-        file_info = json.loads(json_str)
+    Args:
+        f: File object positioned at the start of file
+        trace_data (TraceData): Trace data, arch, ip_reg, regs and
+            pointer_size are set
+    Returns:
+        tuple: File info (dict) and header data (bytes)
+    Raises:
+        ValueError: If file is not a tvt trace
+    """
+    # check first 4 bytes
+    magic = f.read(4)
+    if magic != b"TVTR":
+        raise ValueError("Error, wrong file format.")
+
+    json_length_bytes = f.read(4)
+    json_length = int.from_bytes(json_length_bytes, "little")
+
+    # read JSON blob
+    json_blob = f.read(json_length)
+    json_str = str(json_blob, "utf-8")
+    file_info = json.loads(json_str)
 
-        arch = file_info.get("arch", "")
+    arch = file_info.get("arch", "")
 
+    reg_indexes = {}
+    if arch == "x64":
+        for i, reg in enumerate(prefs.X64_REGS):
+            reg_indexes[reg] = i
+        pointer_size = 8  # qword
+        ip_reg = "rip"
+    elif arch == "x86":
+        for i, reg in enumerate(prefs.X32_REGS):
+            reg_indexes[reg] = i
+        pointer_size = 4  # dword
+        ip_reg = "eip"
+    else:
+        print(f"Unknown CPU arch: {arch} Let's try to load it anyway.")
+        ip_reg = file_info.get("ip_reg", "")
+        pointer_size = file_info.get("pointer_size", 4)
+
+    if "regs" in file_info:
         reg_indexes = {}
-        if arch == "x64":
-            regs = prefs.X64_REGS
-            for i, reg in enumerate(regs):
-                reg_indexes[reg] = i
-            pointer_size = 8  # qword
-            ip_reg = "rip"
-        elif arch == "x86":
-            regs = prefs.X32_REGS
-            for i, reg in enumerate(regs):
-                reg_indexes[reg] = i
-            pointer_size = 4  # dword
-            ip_reg = "eip"
-        else:
-            print(f"Unknown CPU arch: {arch} Let's try to load it anyway.")
-            ip_reg = file_info.get("ip_reg", "")
-            pointer_size = file_info.get("pointer_size", 4)
-
-        if "regs" in file_info:
-            reg_indexes = {}
-            for i, reg in enumerate(file_info["regs"]):
-                reg_indexes[reg] = i
-
-        trace_data.arch = arch
-        trace_data.ip_reg = ip_reg
-        trace_data.regs = reg_indexes
-        trace_data.pointer_size = pointer_size
-
-        reg_values = [None] * len(reg_indexes)
-        trace = []
-        row_id = 0
-        while f.peek(1)[:1] == b"\x00":
-            f.read(1)
-            disasm = ""
-            disasm_length = int.from_bytes(f.read(1), "little")
-            if disasm_length > 0:
-                disasm = f.read(disasm_length).decode()
-
-            comment = ""
-            comment_length = int.from_bytes(f.read(1), "little")
-            if comment_length > 0:
-                comment = f.read(comment_length).decode()
-
-            register_changes = int.from_bytes(f.read(1), "little")
-            memory_accesses = int.from_bytes(f.read(1), "little")
-            flags_and_opcode_size = int.from_bytes(f.read(1), "little")  # Bitfield
-            thread_id_bit = (flags_and_opcode_size >> 7) & 1  # msb
-            opcode_size = flags_and_opcode_size & 15  # 4 lsb
-
-            if thread_id_bit > 0:
-                thread_id = int.from_bytes(f.read(4), "little")
-
-            opcodes = f.read(opcode_size)
-
-            register_change_position = []
-            for _ in range(register_changes):
-                register_change_position.append(int.from_bytes(f.read(1), "little"))
-
-            register_change_new_data = []
-            for _ in range(register_changes):
-                register_change_new_data.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+        for i, reg in enumerate(file_info["regs"]):
+            reg_indexes[reg] = i
+
+    trace_data.arch = arch
+    trace_data.ip_reg = ip_reg
+    trace_data.regs = reg_indexes
+    trace_data.pointer_size = pointer_size
+    return file_info, magic + json_length_bytes + json_blob
+
+
+def decompress_to_temp_file(f, header):
+    """Writes a decompressed trace to a temporary file
+
+    Args:
+        f (DecompressingReader): Compressed trace, positioned after header
+        header (bytes): Data already read from f
+    Returns:
+        str: Name of the temporary file, removed by the caller
+    """
+    fd, temp_filename = tempfile.mkstemp(suffix=".tvt")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(header)
+            shutil.copyfileobj(f, out, READ_BUFFER_SIZE)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    return temp_filename
+
+
+class TvtDecoder:
+    """Decodes rows of a tvt trace from a buffer
+
+    Rows are decoded with precompiled struct formats and appended to a trace.
+    Register state is kept between calls, so a file can be decoded in chunks.
+
+    Attributes:
+        trace (list): Trace where decoded rows are appended (ColumnarTrace or list)
+        reg_values (list): Register values of the last decoded row
+        row_id (int): Id of the next row
+        done (bool): True when all rows have been decoded
+        strings (StringPool): Pool for texts of rows stored as dicts
+        thread (int): Thread id of the last decoded row, None if not known.
+            Thread id is stored only in rows where it changes.
+    """
+
+    def __init__(
+        self,
+        trace,
+        reg_indexes,
+        ip_reg,
+        pointer_size,
+        reg_values=None,
+        row_id=0,
+        thread=None,
+    ):
+        """Inits TvtDecoder
+
+        Args:
+            trace: ColumnarTrace or list to append rows to
+            reg_indexes (dict): Register names and indexes
+            ip_reg (str): Name of instruction pointer register
+            pointer_size (int): Size of register values and memory addresses
+            reg_values (list, optional): Register values before the first row
+            row_id (int, optional): Id of the first row. Defaults to 0.
+            thread (int, optional): Thread id before the first row
+        """
+        self.trace = trace
+        self.ip_reg = ip_reg
+        self.ip_index = reg_indexes.get(ip_reg)
+        self.pointer_size = pointer_size
+        if reg_values is None:
+            reg_values = [None] * len(reg_indexes)
+        self.reg_values = list(reg_values)
+        self.row_id = row_id
+        self.done = False
+        self.strings = StringPool()
+        self.thread = thread
+
+    def decode(self, buffer, pos=0, max_rows=None):
+        """Decodes all complete rows from buffer
+
+        Args:
+            buffer (bytes): Trace data
+            pos (int): Position of the first row in buffer
+            max_rows (int, optional): Maximum number of rows to decode
+        Returns:
+            int: Position after the last decoded row
+        """
+        trace = self.trace
+        reg_values = self.reg_values
+        reg_count = len(reg_values)
+        ip_reg = self.ip_reg
+        ip_index = self.ip_index
+        pointer_size = self.pointer_size
+        columnar = isinstance(trace, ColumnarTrace)
+        intern = self.strings.intern
+        thread = self.thread
+        row_id = self.row_id
+        last_row_id = row_id + max_rows if max_rows is not None else None
+        end = len(buffer)
+
+        while pos < end and row_id != last_row_id:
+            if buffer[pos] != 0:
+                self.done = True
+                break
+            try:
+                p = pos + 2
+                disasm_end = p + buffer[p - 1]
+                comment_end = disasm_end + 1 + buffer[disasm_end]
+                p = comment_end
+                register_changes = buffer[p]
+                memory_accesses = buffer[p + 1]
+                flags_and_opcode_size = buffer[p + 2]  # Bitfield
+                p += 3
+                thread_pos = None
+                if flags_and_opcode_size & 0x80:  # thread id bit
+                    thread_pos = p
+                    p += 4
+                opcodes = buffer[p : p + (flags_and_opcode_size & 15)]
+                p += flags_and_opcode_size & 15
+                positions = buffer[p : p + register_changes]
+                p += register_changes
+                new_data = get_struct(register_changes, pointer_size).unpack_from(
+                    buffer, p
                 )
+                p += register_changes * pointer_size
+                memory_access_flags = buffer[p : p + memory_accesses]
+                p += memory_accesses
+                memory_access_data = get_struct(
+                    2 * memory_accesses, pointer_size
+                ).unpack_from(buffer, p)
+                p += 2 * memory_accesses * pointer_size
+            except (IndexError, struct.error):
+                break  # incomplete row
+            if p > end:
+                break
+
+            if thread_pos is not None:
+                thread = THREAD_ID.unpack_from(buffer, thread_pos)[0]
+            disasm = str(buffer[pos + 2 : disasm_end], "utf-8")
+            comment = str(buffer[disasm_end + 1 : comment_end], "utf-8")
+
+            for i, reg_index in enumerate(accumulate(positions)):
+                if reg_index + i < reg_count:
+                    reg_values[reg_index + i] = new_data[i]
 
-            memory_access_flags = []
-            for _ in range(memory_accesses):
-                memory_access_flags.append(int.from_bytes(f.read(1), "little"))
+            mems = []
+            for i, flag in enumerate(memory_access_flags):
+                mems.append(
+                    {
+                        "access": "WRITE" if flag & 1 else "READ",
+                        "addr": memory_access_data[i],
+                        "value": memory_access_data[memory_accesses + i],
+                    }
+                )
 
-            memory_access_addresses = []
-            for _ in range(memory_accesses):
-                memory_access_addresses.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+            ip = reg_values[ip_index] if ip_reg else None
+            if columnar:
+                trace.append_row(ip, reg_values, opcodes, disasm, comment, mems, thread)
+            else:
+                trace_row = {}
+                trace_row["id"] = row_id
+                if ip_reg:
+                    trace_row["ip"] = ip
+                trace_row["disasm"] = intern(disasm)
+                trace_row["comment"] = intern(comment)
+                trace_row["regs"] = reg_values.copy()
+                trace_row["opcodes"] = intern(opcodes.hex())
+                trace_row["mem"] = mems
+                if thread is not None:
+                    trace_row["thread"] = thread
+                trace.append(trace_row)
+            row_id += 1
+            pos = p
+        self.thread = thread
+        self.row_id = row_id
+        return pos
+
+    def skip(self, buffer, pos=0, max_rows=None):
+        """Skips complete rows of buffer, only register values are updated
+
+        Args:
+            buffer (bytes): Trace data
+            pos (int): Position of the first row in buffer
+            max_rows (int, optional): Maximum number of rows to skip
+        Returns:
+            int: Position after the last skipped row
+        """
+        reg_values = self.reg_values
+        reg_count = len(reg_values)
+        pointer_size = self.pointer_size
+        thread = self.thread
+        row_id = self.row_id
+        last_row_id = row_id + max_rows if max_rows is not None else None
+        end = len(buffer)
+
+        while pos < end and row_id != last_row_id:
+            if buffer[pos] != 0:
+                self.done = True
+                break
+            try:
+                p = pos + 2 + buffer[pos + 1]
+                p += 1 + buffer[p]
+                register_changes = buffer[p]
+                memory_accesses = buffer[p + 1]
+                flags_and_opcode_size = buffer[p + 2]
+                p += 3
+                thread_pos = None
+                if flags_and_opcode_size & 0x80:
+                    thread_pos = p
+                    p += 4
+                p += flags_and_opcode_size & 15
+                positions = buffer[p : p + register_changes]
+                p += register_changes
+                new_data = get_struct(register_changes, pointer_size).unpack_from(
+                    buffer, p
                 )
+                p += register_changes * pointer_size
+                p += memory_accesses * (1 + 2 * pointer_size)
+            except (IndexError, struct.error):
+                break
+            if p > end:
+                break
+
+            if thread_pos is not None:
+                thread = THREAD_ID.unpack_from(buffer, thread_pos)[0]
+            for i, reg_index in enumerate(accumulate(positions)):
+                if reg_index + i < reg_count:
+                    reg_values[reg_index + i] = new_data[i]
+            row_id += 1
+            pos = p
+        self.thread = thread
+        self.row_id = row_id
+        return pos
 
-            memory_access_data = []
-            for i in range(memory_accesses):
-                memory_access_data.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+
+def decode_tv_bookmarks(buffer):
+    """Decodes bookmarks from the end of tvt trace
+
+    Args:
+        buffer (bytes): Data after the last trace row
+    Returns:
+        list: Bookmarks
+    """
+    bookmarks = []
+    pos = 0
+    while buffer[pos : pos + 1] == b"\x01":
+        bookmark = Bookmark()
+        bookmark.startrow, bookmark.endrow = BOOKMARK_ROWS.unpack_from(buffer, pos + 1)
+        pos += 9
+        for field in ("disasm", "comment", "addr"):
+            length = buffer[pos]
+            setattr(bookmark, field, str(buffer[pos + 1 : pos + 1 + length], "utf-8"))
+            pos += 1 + length
+        bookmarks.append(bookmark)
+    return bookmarks
+
+
+@lru_cache(maxsize=None)
+def get_struct(count, size):
+    """Returns a precompiled struct for a number of little-endian integers
+
+    Args:
+        count (int): Number of integers
+        size (int): Size of an integer in bytes (1, 2, 4 or 8)
+    Returns:
+        struct.Struct
+    """
+    return struct.Struct("<" + STRUCT_FORMATS[size] * count)
+
+
+class MappedTvTrace(Sequence):
+    """Memory-mapped tvt trace which decodes rows on demand
+
+    The file is scanned once to find the byte offset and register values at
+    the start of every block of rows. Rows are decoded a block at a time when
+    they are accessed and only the most recently used blocks are kept in memory.
+    Rows are returned as TraceRow views, like in ColumnarTrace.
+
+    Attributes:
+        filename (str): Name of the mapped file
+        reg_count (int): Number of registers per row
+        block_rows (int): Number of rows in a block
+        block_offsets (list): File offsets of blocks
+        keyframes (list): Register values before the first row of each block
+        thread_keyframes (list): Thread ids before the first row of each block
+        overrides (dict): Fields changed after loading, by row index
+        comments (CommentStore): Comments of all rows, None until
+            get_comments() is called
+        thread_rows (dict): Row indexes (array) by thread id, None until
+            get_thread_index() is called
+        mem_addr_index (MemAddressIndex): Rows by memory address, None until
+            get_mem_addr_index() is called
+        mem_value_index (MemValueIndex): Rows by memory value, None until
+            get_mem_value_index() is called
+        reg_value_index (RegValueIndex): Rows by register value, None until
+            get_reg_value_index() is called
+        text_index (TextIndex): Rows by disasm and opcodes, None until
+            get_text_index() is called
+        search_text (SearchText): Texts of rows for regex filters, None
+            until get_search_text() is called
+    """
+
+    def __init__(
+        self,
+        filename,
+        data_offset,
+        reg_indexes,
+        ip_reg,
+        pointer_size,
+        block_rows=None,
+    ):
+        """Inits MappedTvTrace and scans the rows
+
+        Args:
+            filename (str): Trace file name
+            data_offset (int): File offset of the first row
+            reg_indexes (dict): Register names and indexes
+            ip_reg (str): Name of instruction pointer register
+            pointer_size (int): Size of register values and memory addresses
+            block_rows (int, optional): Number of rows in a block.
+                Defaults to prefs.MMAP_BLOCK_ROWS.
+        """
+        self.filename = filename
+        self.reg_count = len(reg_indexes)
+        self.reg_indexes = reg_indexes
+        self.ip_reg = ip_reg
+        self.pointer_size = pointer_size
+        self.block_rows = block_rows or prefs.MMAP_BLOCK_ROWS
+        self.block_offsets = []
+        self.keyframes = []
+        self.thread_keyframes = []
+        self.overrides = {}
+        self.comments = None
+        self.thread_rows = None
+        self.mem_addr_index = None
+        self.mem_value_index = None
+        self.reg_value_index = None
+        self.text_index = None
+        self.search_text = None
+        self.row_count = 0
+        self.data_end = data_offset
+        self.blocks = OrderedDict()
+        with open(filename, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.scan(data_offset)
+
+    def scan(self, pos):
+        """Builds the block index
+
+        Args:
+            pos (int): File offset of the first row
+        """
+        decoder = self.new_decoder(None)
+        while not decoder.done:
+            offset = pos
+            keyframe = list(decoder.reg_values)
+            thread = decoder.thread
+            pos = decoder.skip(self.buffer, pos, self.block_rows)
+            if decoder.row_id == len(self.block_offsets) * self.block_rows:
+                break  # no rows left
+            self.block_offsets.append(offset)
+            self.keyframes.append(keyframe)
+            self.thread_keyframes.append(thread)
+            if decoder.row_id % self.block_rows:
+                break  # last block
+        self.row_count = decoder.row_id
+        self.data_end = pos
+
+    def new_decoder(self, trace, block=0):
+        """Returns a TvtDecoder which starts from a block"""
+        reg_values = self.keyframes[block] if self.keyframes else None
+        thread = self.thread_keyframes[block] if self.thread_keyframes else None
+        return TvtDecoder(
+            trace,
+            self.reg_indexes,
+            self.ip_reg,
+            self.pointer_size,
+            reg_values,
+            block * self.block_rows,
+            thread,
+        )
+
+    def get_trailing_data(self):
+        """Returns data after the last row (bookmarks)"""
+        return self.buffer[self.data_end :]
+
+    def get_block(self, block):
+        """Returns decoded rows of a block, recently used blocks are cached
+
+        Args:
+            block (int): Block index
+        Returns:
+            ColumnarTrace: Rows of the block
+        """
+        rows = self.blocks.get(block)
+        if rows is not None:
+            self.blocks.move_to_end(block)
+            return rows
+        rows = self.decode_block(block)
+        self.blocks[block] = rows
+        if len(self.blocks) > prefs.MMAP_CACHED_BLOCKS:
+            self.blocks.popitem(last=False)
+        return rows
+
+    def decode_block(self, block):
+        """Decodes rows of a block
+
+        Args:
+            block (int): Block index
+        Returns:
+            ColumnarTrace: Rows of the block
+        """
+        rows = ColumnarTrace(self.reg_count)
+        decoder = self.new_decoder(rows, block)
+        decoder.decode(self.buffer, self.block_offsets[block], self.block_rows)
+        return rows
+
+    def get_comments(self):
+        """Returns comments of all rows
+
+        Comments are collected from all blocks on the first call and then
+        kept up to date by set_field().
+
+        Returns:
+            CommentStore: Comments by row
+        """
+        if self.comments is None:
+            comments = CommentStore()
+            for block in range(len(self.block_offsets)):
+                rows = self.blocks.get(block) or self.decode_block(block)
+                comments.update(rows.comments, block * self.block_rows)
+            for index, fields in self.overrides.items():
+                if "comment" in fields:
+                    comments.set(index, fields["comment"])
+            self.comments = comments
+        return self.comments
+
+    def get_thread_index(self):
+        """Returns row indexes by thread id
+
+        The index is built from all blocks on the first call and rebuilt
+        after a thread id is changed with set_field().
+
+        Returns:
+            dict: Row indexes (array) by thread id
+        """
+        if self.thread_rows is None:
+            threads = array("I")
+            for block in range(len(self.block_offsets)):
+                rows = self.blocks.get(block) or self.decode_block(block)
+                if rows.threads is None:
+                    threads.extend(array("I", [NO_THREAD]) * len(rows))
+                else:
+                    threads.extend(rows.threads)
+            for index, fields in self.overrides.items():
+                if "thread" in fields:
+                    threads[index] = fields["thread"]
+            self.thread_rows = index_threads(threads)
+        return self.thread_rows
+
+    def get_thread_rows(self, thread):
+        """Returns indexes of rows executed by a thread
+
+        Args:
+            thread (int): Thread id
+        Returns:
+            array: Row indexes
+        """
+        return self.get_thread_index().get(thread, array("I"))
+
+    def get_mem_addr_index(self):
+        """Returns rows by memory address
+
+        The index is built from all blocks on the first call and rebuilt
+        after memory accesses are changed with set_field().
+
+        Returns:
+            MemAddressIndex: Memory address index
+        """
+        if self.mem_addr_index is None:
+            self.mem_addr_index = self.build_mem_index(MemAddressIndex())
+        return self.mem_addr_index
+
+    def get_mem_value_index(self):
+        """Returns rows by memory value, see get_mem_addr_index()
+
+        Returns:
+            MemValueIndex: Memory value index
+        """
+        if self.mem_value_index is None:
+            self.mem_value_index = self.build_mem_index(MemValueIndex())
+        return self.mem_value_index
+
+    def build_mem_index(self, index):
+        """Adds memory accesses of all rows to an empty memory index
+
+        Args:
+            index (MemAddressIndex): Memory address or value index
+        Returns:
+            MemAddressIndex: The built index
+        """
+        changed = {i for i, fields in self.overrides.items() if "mem" in fields}
+        for block in range(len(self.block_offsets)):
+            rows = self.blocks.get(block) or self.decode_block(block)
+            index.add_rows(rows, 0, len(rows), block * self.block_rows, changed)
+        for i in sorted(changed):
+            index.add_mems(i, self.overrides[i]["mem"])
+        index.row_count = len(self)
+        index.build()
+        return index
+
+    def get_mem_addr_rows(self, first_addr, last_addr=None, access=None):
+        """Returns indexes of rows which access an address or address range
+
+        Args:
+            first_addr (int): Address, or first address of range
+            last_addr (int, optional): Last address of range, included
+            access (str, optional): "READ" or "WRITE", None matches both
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_mem_addr_index().get_rows(first_addr, last_addr, access)
+
+    def get_mem_value_rows(self, value, access=None):
+        """Returns indexes of rows which read or write a memory value
+
+        Args:
+            value (int): Memory value
+            access (str, optional): "READ" or "WRITE", None matches both
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_mem_value_index().get_rows(value, None, access)
+
+    def get_reg_value_index(self):
+        """Returns rows by register value
+
+        The index is built from all blocks on the first call.
+
+        Returns:
+            RegValueIndex: Register value index
+        """
+        if self.reg_value_index is None:
+            index = RegValueIndex(self.reg_count)
+            for block in range(len(self.block_offsets)):
+                rows = self.blocks.get(block) or self.decode_block(block)
+                index.add_rows(rows, 0, len(rows), block * self.block_rows)
+            index.build()
+            self.reg_value_index = index
+        return self.reg_value_index
+
+    def get_reg_value_ranges(self, value, reg_index=None):
+        """Returns row ranges where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted (first row, end row) tuples
+        """
+        return self.get_reg_value_index().get_ranges(value, reg_index)
+
+    def get_reg_value_rows(self, value, reg_index=None):
+        """Returns indexes of rows where registers have a value
+
+        Args:
+            value (int): Register value
+            reg_index (int, optional): Register index, None for any register
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_reg_value_index().get_rows(value, reg_index)
+
+    def get_text_index(self):
+        """Returns rows by disasm and opcodes
+
+        The index is built from all blocks on the first call and rebuilt
+        after disasm is changed with set_field().
+
+        Returns:
+            TextIndex: Disasm and opcode index
+        """
+        if self.text_index is None:
+            index = TextIndex()
+            for block in range(len(self.block_offsets)):
+                rows = self.blocks.get(block) or self.decode_block(block)
+                start = block * self.block_rows
+                index.add_rows(rows, 0, len(rows), start, self.overrides)
+            for i, fields in sorted(self.overrides.items()):
+                for key in TEXT_FIELDS:
+                    if key in fields:
+                        index.add_text(i, key, fields[key])
+            index.row_count = len(self)
+            index.build()
+            self.text_index = index
+        return self.text_index
+
+    def get_text_postings(self, key, condition):
+        """Returns rows of the disasm or opcode strings matching a condition
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted sequences of row indexes, one or more per string
+        """
+        return self.get_text_index().get_postings(key, condition)
+
+    def get_text_rows(self, key, condition):
+        """Returns indexes of rows whose disasm or opcodes match a condition
+
+        Args:
+            key (str): "disasm" or "opcodes"
+            condition (callable): Returns True for matching texts
+        Returns:
+            list: Sorted row indexes
+        """
+        return self.get_text_index().get_rows(key, condition)
+
+    def get_search_text(self):
+        """Returns search text of all rows for regex filters
+
+        The text is built from all blocks on the first call and rebuilt
+        after comments, disasm or memory accesses are changed.
+
+        Returns:
+            SearchText: Texts of all rows
+        """
+        if self.search_text is None:
+            texts = []
+            for block in range(len(self.block_offsets)):
+                texts += get_search_texts(
+                    self.blocks.get(block) or self.decode_block(block)
                 )
+            for i in self.overrides:
+                row = self[i]
+                texts[i] = format_search_text(
+                    row["disasm"], row["opcodes"], row.get("comment", ""), row["mem"]
+                )
+            self.search_text = SearchText(texts)
+        return self.search_text
+
+    def close(self):
+        """Closes the memory map"""
+        self.blocks.clear()
+        self.buffer.close()
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TraceRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trace index out of range")
+        return TraceRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TraceRow(self, i)
+
+    def get_regs(self, index):
+        """Returns register values of a row"""
+        return self.get_field(index, "regs")
+
+    def get_reg_value(self, index, reg_index):
+        """Returns a value of one register"""
+        block, row = divmod(index, self.block_rows)
+        return self.get_block(block).get_reg_value(row, reg_index)
+
+    def get_keys(self, index):
+        """Returns field names of a row"""
+        block, row = divmod(index, self.block_rows)
+        keys = self.get_block(block).get_keys(row)
+        for key in self.overrides.get(index, ()):
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def get_field(self, index, key):
+        """Returns a field value of a row
+
+        Raises:
+            KeyError: If row has no such field
+        """
+        if key == "id":
+            return index
+        fields = self.overrides.get(index)
+        if fields and key in fields:
+            return fields[key]
+        block, row = divmod(index, self.block_rows)
+        return self.get_block(block).get_field(row, key)
+
+    def set_field(self, index, key, value):
+        """Sets a field value of a row, changes are kept in memory"""
+        if key in ("id", "regs", "opcodes", "ip"):
+            raise KeyError(f"Field {key} is read-only")
+        self.overrides.setdefault(index, {})[key] = value
+        if key in ("comment", "disasm", "mem"):
+            self.search_text = None
+        if key == "comment" and self.comments is not None:
+            self.comments.set(index, value)
+        elif key == "thread":
+            self.thread_rows = None
+        elif key == "mem":
+            self.mem_addr_index = None
+            self.mem_value_index = None
+        elif key == "disasm":
+            self.text_index = None
+
+    def del_field(self, index, key):
+        """Deletes a field of a row"""
+        if key in ColumnarTrace.FIELDS:
+            self.set_field(index, key, "" if key == "comment" else [])
+        else:
+            fields = self.overrides.get(index, {})
+            del fields[key]
+            if key == "thread":
+                self.thread_rows = None
+            elif key == "mem":
+                self.mem_addr_index = None
+                self.mem_value_index = None
+
+
+class BlockTvTrace(MappedTvTrace):
+    """Tvt v2 trace which decompresses and decodes blocks on demand
+
+    Rows of a v2 file are stored in independently compressed blocks. The
+    block index at the end of the file gives the first row, file offset and
+    register keyframe of every block, so any block can be decoded without
+    reading the blocks before it.
+
+    Attributes:
+        compression (str): Compression of blocks ("none", "zlib" or "lzma")
+        block_sizes (list): Compressed sizes of blocks
+    """
 
-            reg_id = 0
-            regchanges = ""
-            for i, change in enumerate(register_change_position):
-                reg_id += change
-                if reg_id + i < len(reg_indexes):
-                    reg_values[reg_id + i] = register_change_new_data[i]
-                if reg_id + i < len(reg_indexes) and row_id > 0:
-                    reg_name = regs[reg_id + i]
-                    if reg_name is not ip_reg:
-                        old_value = trace[-1]["regs"][reg_id + i]
-                        new_value = register_change_new_data[i]
-                        if old_value != new_value:
-                            if prefs.TRACE_SHOW_OLD_REG_VALUE:
-                                regchanges += (
-                                    f"{reg_name}: {hex(old_value)} -> {hex(new_value)} "
-                                )
-                            else:
-                                regchanges += f"{reg_name}: {hex(new_value)} "
-                            if 0x7F > new_value > 0x1F:
-                                regchanges += f"'{chr(new_value)}' "
+    def __init__(
+        self,
+        filename,
+        reg_indexes,
+        ip_reg,
+        pointer_size,
+        compression,
+        block_rows,
+    ):
+        """Inits BlockTvTrace and reads the block index
+
+        Args:
+            filename (str): Trace file name
+            reg_indexes (dict): Register names and indexes
+            ip_reg (str): Name of instruction pointer register
+            pointer_size (int): Size of register values and memory addresses
+            compression (str): Compression of blocks
+            block_rows (int): Number of rows in a block
+        """
+        if compression not in DECOMPRESSORS:
+            raise ValueError(f"Error, unknown compression: {compression}")
+        self.compression = compression
+        self.block_sizes = []
+        self.trailing_data_end = 0
+        super().__init__(filename, 0, reg_indexes, ip_reg, pointer_size, block_rows)
+
+    def scan(self, pos):
+        """Reads the block index from the end of file
+
+        Args:
+            pos (int): Not used, blocks are found from the index
+        """
+        buffer = self.buffer
+        self.trailing_data_end = len(buffer) - TVT_TRAILER.size
+        index_offset, block_count, magic = TVT_TRAILER.unpack_from(
+            buffer, self.trailing_data_end
+        )
+        if magic != TVT_TRAILER_MAGIC:
+            raise ValueError("Error, block index not found.")
+        keyframe_struct = get_struct(self.reg_count, self.pointer_size)
+        pos = index_offset
+        for _ in range(block_count):
+            first_row, offset, size, row_count = TVT_BLOCK_INDEX.unpack_from(
+                buffer, pos
+            )
+            pos += TVT_BLOCK_INDEX.size
+            self.block_offsets.append(offset)
+            self.block_sizes.append(size)
+            self.keyframes.append(list(keyframe_struct.unpack_from(buffer, pos)))
+            pos += keyframe_struct.size
+            self.row_count = first_row + row_count
+        self.data_end = pos
+
+    def get_trailing_data(self):
+        """Returns data after the block index (bookmarks)"""
+        return self.buffer[self.data_end : self.trailing_data_end]
+
+    def get_block_args(self, block, columnar=True):
+        """Returns arguments of decode_tv_block() for a block"""
+        offset = self.block_offsets[block]
+        return (
+            self.buffer[offset : offset + self.block_sizes[block]],
+            self.compression,
+            self.keyframes[block],
+            block * self.block_rows,
+            self.reg_indexes,
+            self.ip_reg,
+            columnar,
+        )
+
+    def decode_block(self, block):
+        """Decompresses and decodes rows of a block
+
+        Args:
+            block (int): Block index
+        Returns:
+            ColumnarTrace: Rows of the block
+        """
+        return decode_tv_block(*self.get_block_args(block))
+
+    def decode_all(self, trace_data, progress=None):
+        """Decodes all blocks, in worker processes if there are many
+
+        Args:
+            trace_data (TraceData): Trace data, rows are added to its trace
+            progress (callable, optional): Progress callback, see open_trace()
+        """
+        trace = trace_data.trace
+        block_count = len(self.block_offsets)
+        tasks = (
+            self.get_block_args(block, prefs.COLUMNAR_TRACE)
+            for block in range(block_count)
+        )
+        results = run_in_workers(decode_tv_block, tasks, block_count)
+        for block, rows in enumerate(results):
+            trace.extend(rows)
+            if progress is not None:
+                done = self.block_offsets[block] + self.block_sizes[block]
+                progress(trace_data, done, len(self.buffer))
+
+
+class TvtBlockDecoder(TvtDecoder):
+    """Decodes rows of a decompressed tvt v2 block
+
+    Register values are XOR deltas to the previous row, stored as varints
+    after a bitmask of changed registers.
+    """
+
+    def __init__(self, trace, reg_indexes, ip_reg, reg_values, row_id):
+        """Inits TvtBlockDecoder
+
+        Args:
+            trace: ColumnarTrace or list to append rows to
+            reg_indexes (dict): Register names and indexes
+            ip_reg (str): Name of instruction pointer register
+            reg_values (list): Register values before the first row
+            row_id (int): Id of the first row
+        """
+        super().__init__(trace, reg_indexes, ip_reg, None, reg_values, row_id)
+
+    def decode(self, buffer, pos=0, max_rows=None):
+        """Decodes rows from buffer
+
+        Args:
+            buffer (bytes): Decompressed block
+            pos (int): Position of the first row in buffer
+            max_rows (int, optional): Maximum number of rows to decode
+        Returns:
+            int: Position after the last decoded row
+        """
+        trace = self.trace
+        reg_values = self.reg_values
+        ip_reg = self.ip_reg
+        ip_index = self.ip_index
+        columnar = isinstance(trace, ColumnarTrace)
+        intern = self.strings.intern
+        thread = self.thread
+        row_id = self.row_id
+        last_row_id = row_id + max_rows if max_rows is not None else None
+        end = len(buffer)
+
+        while pos < end and row_id != last_row_id:
+            length, pos = read_varint(buffer, pos)
+            disasm = str(buffer[pos : pos + length], "utf-8")
+            pos += length
+            length, pos = read_varint(buffer, pos)
+            comment = str(buffer[pos : pos + length], "utf-8")
+            pos += length
+            flags = buffer[pos]
+            length, pos = read_varint(buffer, pos + 1)
+            opcodes = buffer[pos : pos + length]
+            pos += length
+            if flags & TVT_THREAD_FLAG:
+                thread, pos = read_varint(buffer, pos)
+
+            changed, pos = read_varint(buffer, pos)
+            while changed:
+                bit = changed & -changed
+                changed ^= bit
+                reg_index = bit.bit_length() - 1
+                delta, pos = read_varint(buffer, pos)
+                reg_values[reg_index] ^= delta
 
             mems = []
-            mem = {}
-            for i in range(memory_accesses):
-                flag = memory_access_flags[i]
-                value = memory_access_data[i]
-                mem["access"] = "READ"
-                if flag & 1 == 1:
-                    mem["access"] = "WRITE"
+            memory_accesses, pos = read_varint(buffer, pos)
+            for _ in range(memory_accesses):
+                flag = buffer[pos]
+                addr, pos = read_varint(buffer, pos + 1)
+                value, pos = read_varint(buffer, pos)
+                mems.append(
+                    {
+                        "access": "WRITE" if flag & 1 else "READ",
+                        "addr": addr,
+                        "value": value,
+                    }
+                )
 
-                mem["addr"] = memory_access_addresses[i]
-                mem["value"] = value
-                mems.append(mem.copy())
+            ip = reg_values[ip_index] if ip_reg else None
+            if columnar:
+                trace.append_row(ip, reg_values, opcodes, disasm, comment, mems, thread)
+            else:
+                trace_row = {}
+                trace_row["id"] = row_id
+                if ip_reg:
+                    trace_row["ip"] = ip
+                trace_row["disasm"] = intern(disasm)
+                trace_row["comment"] = intern(comment)
+                trace_row["regs"] = reg_values.copy()
+                trace_row["opcodes"] = intern(opcodes.hex())
+                trace_row["mem"] = mems
+                if thread is not None:
+                    trace_row["thread"] = thread
+                trace.append(trace_row)
+            row_id += 1
+        self.thread = thread
+        self.row_id = row_id
+        self.done = pos >= end
+        return pos
 
-            if regchanges:
-                trace[-1]["regchanges"] = regchanges
 
-            trace_row = {}
-            trace_row["id"] = row_id
-            if ip_reg:
-                trace_row["ip"] = reg_values[reg_indexes[ip_reg]]
-            trace_row["disasm"] = disasm
-            trace_row["comment"] = comment
-            trace_row["regs"] = reg_values.copy()
-            trace_row["opcodes"] = opcodes.hex()
-            trace_row["mem"] = mems.copy()
-            trace.append(trace_row)
-            row_id += 1
+def decode_tv_block(
+    data, compression, keyframe, row_id, reg_indexes, ip_reg, columnar=True
+):
+    """Decompresses and decodes a tvt v2 block
 
-        trace_data.trace = trace
+    Runs in worker processes when a trace is loaded in parallel.
 
-        while f.peek(1)[:1] == b"\x01":
-            f.read(1)
-            bookmark = Bookmark()
-            bookmark.startrow = int.from_bytes(f.read(4), "little")
-            bookmark.endrow = int.from_bytes(f.read(4), "little")
-            disasm_length = int.from_bytes(f.read(1), "little")
-            bookmark.disasm = f.read(disasm_length).decode()
-            comment_length = int.from_bytes(f.read(1), "little")
-            bookmark.comment = f.read(comment_length).decode()
-            addr_length = int.from_bytes(f.read(1), "little")
-            bookmark.addr = f.read(addr_length).decode()
-            trace_data.add_bookmark(bookmark)
+    Args:
+        data (bytes): Compressed block
+        compression (str): Compression of the block
+        keyframe (list): Register values before the first row
+        row_id (int): Id of the first row
+        reg_indexes (dict): Register names and indexes
+        ip_reg (str): Name of instruction pointer register
+        columnar (bool, optional): Decode to ColumnarTrace instead of list
+    Returns:
+        Decoded rows, ColumnarTrace or list
+    """
+    decoder = TvtBlockDecoder(
+        new_trace(len(reg_indexes), columnar),
+        reg_indexes,
+        ip_reg,
+        keyframe,
+        row_id,
+    )
+    decoder.decode(DECOMPRESSORS[compression](data))
+    return decoder.trace
 
-        return trace_data
 
+def encode_tv_block(rows, reg_values, compression):
+    """Encodes and compresses rows to a tvt v2 block
+
+    Runs in worker processes when a trace is saved in parallel. Thread id
+    is stored in the first row of the block and in rows where it changes.
+
+    Args:
+        rows: Trace rows (ColumnarTrace or list of dicts)
+        reg_values (list): Register values before the first row
+        compression (str): Compression of the block
+    Returns:
+        bytes: Compressed block
+    """
+    out = bytearray()
+    reg_values = [value or 0 for value in reg_values]
+    last_thread = None
+    for disasm, comment, regs, opcodes, mems, thread in iter_row_fields(rows):
+        for text in (disasm, comment):
+            text = text.encode()
+            write_varint(out, len(text))
+            out += text
+        thread_changed = thread is not None and thread != last_thread
+        out.append(TVT_THREAD_FLAG if thread_changed else 0)
+        write_varint(out, len(opcodes))
+        out += opcodes
+        if thread_changed:
+            write_varint(out, thread)
+            last_thread = thread
+
+        if None in regs:
+            regs = [value or 0 for value in regs]
+        changed = 0
+        deltas = []
+        for reg_index, value, old_value in zip(range(len(regs)), regs, reg_values):
+            if value != old_value:
+                changed |= 1 << reg_index
+                deltas.append(value ^ old_value)
+        write_varint(out, changed)
+        for delta in deltas:
+            write_varint(out, delta)
+        reg_values = regs
+
+        write_varint(out, len(mems))
+        for mem_access in mems:
+            out.append(1 if mem_access["access"].lower() == "write" else 0)
+            write_varint(out, mem_access["addr"])
+            write_varint(out, mem_access["value"])
+    return COMPRESSORS[compression](out)
+
+
+def write_tv_blocks(f, trace, reg_count, pointer_size, compression, block_rows):
+    """Writes rows of a tvt v2 file in compressed blocks
+
+    Blocks are encoded in worker processes if there are many.
+
+    Args:
+        f: File object, positioned after the header
+        trace: Trace rows
+        reg_count (int): Number of registers
+        pointer_size (int): Size of register values
+        compression (str): Compression of blocks
+        block_rows (int): Number of rows in a block
+    Returns:
+        bytes: Block index
+    """
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression: {compression}")
+    keyframe_struct = get_struct(reg_count, pointer_size)
+    first_rows = range(0, len(trace), block_rows)
+    tasks = (
+        (
+            get_trace_chunk(trace, first_row, block_rows),
+            get_keyframe(trace, first_row),
+            compression,
+        )
+        for first_row in first_rows
+    )
+    index = bytearray()
+    for first_row, data in zip(
+        first_rows, run_in_workers(encode_tv_block, tasks, len(first_rows))
+    ):
+        row_count = min(block_rows, len(trace) - first_row)
+        index += TVT_BLOCK_INDEX.pack(first_row, f.tell(), len(data), row_count)
+        index += keyframe_struct.pack(*get_keyframe(trace, first_row))
+        f.write(data)
+    return bytes(index)
+
+
+def get_keyframe(trace, row_id):
+    """Returns register values before a row, zeros before the first row"""
+    if row_id == 0:
+        return [0] * len(trace[0]["regs"])
+    return [value or 0 for value in trace[row_id - 1]["regs"]]
+
+
+def get_trace_chunk(trace, start, row_count):
+    """Returns a picklable copy of trace rows for worker processes
+
+    Args:
+        trace: ColumnarTrace, list or MappedTvTrace
+        start (int): Index of the first row
+        row_count (int): Number of rows
+    Returns:
+        ColumnarTrace or list of dicts
+    """
+    if isinstance(trace, ColumnarTrace):
+        return trace.get_rows(start, start + row_count)
+    if isinstance(trace, list):
+        return trace[start : start + row_count]
+    return [row.copy() for row in trace[start : start + row_count]]
+
+
+def iter_row_fields(rows):
+    """Yields fields of rows for encoders
+
+    Args:
+        rows: ColumnarTrace or list of dicts
+    Yields:
+        tuple: disasm, comment, regs, opcodes (bytes), mem and thread id
+            (None if not set)
+    """
+    if not isinstance(rows, ColumnarTrace):
+        for row in rows:
+            yield (
+                row["disasm"],
+                row.get("comment", ""),
+                row["regs"],
+                bytes.fromhex(row["opcodes"]),
+                row["mem"],
+                row.get("thread"),
+            )
+        return
+    reg_count = rows.reg_count
+    regs = rows.regs
+    strings = rows.strings.strings
+    opcodes = {}  # opcode bytes by string id
+    threads = rows.threads
+    comments = rows.comments
+    for i, (disasm_id, opcode_id) in enumerate(zip(rows.disasm_ids, rows.opcode_ids)):
+        if opcode_id not in opcodes:
+            opcodes[opcode_id] = bytes.fromhex(strings[opcode_id])
+        thread = threads[i] if threads is not None else NO_THREAD
+        if thread == NO_THREAD:
+            thread = None
+        yield (
+            strings[disasm_id],
+            comments.get(i),
+            regs[i * reg_count : (i + 1) * reg_count],
+            opcodes[opcode_id],
+            rows.get_mems(i),
+            thread,
+        )
+
+
+def run_in_workers(func, tasks, task_count):
+    """Runs a function for every task, in worker processes if there are many
+
+    Only a few tasks per worker are submitted ahead, so tasks can be
+    created lazily without keeping all of them in memory.
+
+    Args:
+        func: Picklable function
+        tasks: Iterable of argument tuples
+        task_count (int): Number of tasks
+    Yields:
+        Results of func in the order of tasks
+    """
+    workers = min(get_worker_count(), task_count)
+    if workers <= 1:
+        for args in tasks:
+            yield func(*args)
+        return
+    pool = create_process_pool(workers)
+    try:
+        pending = deque()
+        for args in tasks:
+            pending.append(pool.submit(func, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def read_varint(buffer, pos):
+    """Reads an unsigned LEB128 varint
+
+    Args:
+        buffer (bytes): Data
+        pos (int): Position of varint
+    Returns:
+        tuple: Value and position after the varint
+    """
+    byte = buffer[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = byte & 0x7F
+    shift = 7
+    while True:
+        pos += 1
+        byte = buffer[pos]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+def write_varint(out, value):
+    """Appends an unsigned LEB128 varint to bytearray
+
+    Args:
+        out (bytearray): Output buffer
+        value (int): Non-negative integer
+    """
+    if value < 0:
+        raise ValueError(f"Can not encode a negative value {value}")
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
 
-def open_json_trace(filename):
+
+def open_json_trace(filename, progress=None):
     """Opens JSON trace file and reads trace data and bookmarks
 
+    The file is parsed incrementally with JsonTraceParser, rows are added to
+    trace one at a time.
+
     Args:
         filename: name of trace file
+        progress (callable, optional): Progress callback, see open_trace()
     """
     try:
-        f = open(filename)
+        f = compressed.open_file(filename)
     except IOError:
         print("Error, could not open file.")
     else:
         with f:
             try:
                 trace_data = TraceData()
-                data = json.load(f)
-                trace_data.bookmarks = []
                 trace_data.filename = filename
-                trace_data.trace = data["trace"]
-                trace_data.arch = data.get("arch", "")
-                trace_data.ip_reg = data.get("ip_reg", "")
-                trace_data.pointer_size = data.get("pointer_size", 4)
-                trace_data.regs = data.get("regs", {})
-                if "bookmarks" in data:
-                    for bookmark in data["bookmarks"]:
-                        trace_data.add_bookmark(Bookmark(**bookmark))
+                file_size = compressed.get_file_size(f)
+                parser = JsonTraceParser(f)
+                info = {}
+                trace = None
+                for key in parser.iter_keys():
+                    if key == "trace":
+                        # trace info may also come after the rows
+                        trace = new_json_trace(trace_data, info)
+                        for row in parser.iter_array():
+                            trace.append(row)
+                            if progress is not None and len(trace) % PROGRESS_ROWS == 0:
+                                position = compressed.get_read_position(
+                                    f, parser.get_unread_size()
+                                )
+                                progress(trace_data, position, file_size)
+                    elif key == "bookmarks":
+                        for bookmark in parser.decode_value():
+                            trace_data.add_bookmark(Bookmark(**bookmark))
+                    else:
+                        info[key] = parser.decode_value()
+                if trace is None:
+                    raise KeyError("trace")
+                regs = trace_data.regs
+                set_json_info(trace_data, info)
+                if trace_data.regs != regs:
+                    # rows were read before the registers, store them again
+                    rows = trace
+                    trace = new_json_trace(trace_data, info)
+                    for row in rows:
+                        trace.append(row)
+                if isinstance(trace, list):
+                    intern_texts(trace)
                 return trace_data
+            except LoadCancelled:
+                raise
             except KeyError:
                 print("Error while reading trace file.")
             except Exception as exc:
@@ -233,304 +1563,1126 @@ def open_json_trace(filename):
     return None
 
 
-def save_as_json(trace_data, filename):
-    """Saves trace data to file in JSON format
+def new_json_trace(trace_data, info):
+    """Sets trace info from JSON header to trace data and creates its trace
 
     Args:
-        trace_data: TraceData object
-        filename: name of trace file
+        trace_data (TraceData): Trace data
+        info (dict): Trace info, arch, regs, ip_reg and pointer_size keys
+    Returns:
+        Empty trace, ColumnarTrace or list
+    """
+    set_json_info(trace_data, info)
+    trace_data.trace = new_trace(len(trace_data.regs)) if trace_data.regs else []
+    return trace_data.trace
+
+
+def set_json_info(trace_data, info):
+    """Sets trace info from JSON header to trace data
+
+    Args:
+        trace_data (TraceData): Trace data
+        info (dict): Trace info, arch, regs, ip_reg and pointer_size keys
     """
-    data = {
+    trace_data.arch = info.get("arch", "")
+    trace_data.ip_reg = info.get("ip_reg", "")
+    trace_data.pointer_size = info.get("pointer_size", 4)
+    trace_data.regs = info.get("regs", {})
+
+
+def get_json_info(trace_data):
+    """Returns trace info of trace data for JSON files"""
+    return {
         "arch": trace_data.arch,
         "regs": trace_data.regs,
         "ip_reg": trace_data.ip_reg,
         "pointer_size": trace_data.pointer_size,
-        "trace": trace_data.trace,
-        "bookmarks": [vars(h) for h in trace_data.bookmarks],
     }
+
+
+class JsonTraceParser:
+    """Parses a JSON trace incrementally from a file
+
+    Values of the top level object are decoded one at a time, and items of
+    an array (trace rows) one item at a time, so only a small part of the
+    file is in memory.
+
+    Attributes:
+        f: File object
+        text (str): Decoded text, parsing continues from pos
+        eof (bool): True when the whole file has been read
+    """
+
+    def __init__(self, f):
+        """Inits JsonTraceParser
+
+        Args:
+            f: File object opened in binary mode
+        """
+        self.f = f
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        """Reads the next chunk of file to text
+
+        Raises:
+            ValueError: If the whole file has already been read
+        """
+        if self.eof:
+            raise ValueError("Unexpected end of JSON trace")
+        chunk = self.f.read(READ_BUFFER_SIZE)
+        self.eof = not chunk
+        self.text = self.text[self.pos :] + self.utf8_decoder.decode(chunk, self.eof)
+        self.pos = 0
+
+    def get_unread_size(self):
+        """Returns number of characters read from file but not parsed"""
+        return len(self.text) - self.pos
+
+    def peek(self):
+        """Returns the next character after whitespace, "" at end of file"""
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or self.eof:
+                return self.text[self.pos : self.pos + 1]
+            self.read_more()
+
+    def expect(self, chars):
+        """Consumes the next character, which must be one of chars
+
+        Returns:
+            str: Consumed character
+        Raises:
+            ValueError: If the next character is not one of chars
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        """Decodes the next JSON value
+
+        Returns:
+            Decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number at the end of text may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            self.read_more()
+
+    def iter_keys(self):
+        """Yields keys of the top level object
+
+        The value of every key must be read with decode_value() or
+        iter_array() before the next key is yielded.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def iter_array(self):
+        """Yields decoded items of an array"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self.expect(",]") == "]":
+                return
+
+
+def is_jsonl_header(data):
+    """Returns True if data starts with a header line of JSON Lines trace
+
+    Args:
+        data (bytes): First bytes of a file
+    """
+    line, newline, _rest = data.partition(b"\n")
+    if not newline:
+        return False
+    try:
+        header = json.loads(line)
+    except ValueError:
+        return False
+    return isinstance(header, dict) and header.get("format") == JSONL_FORMAT
+
+
+def open_jsonl_trace(filename, progress=None):
+    """Opens JSON Lines trace file and reads trace data and bookmarks
+
+    Uncompressed files are split to chunks of whole lines which are decoded
+    in worker processes if there are many. Compressed files are read
+    sequentially.
+
+    Args:
+        filename: name of trace file
+        progress (callable, optional): Progress callback, see open_trace()
+    """
+    try:
+        f = compressed.open_file(filename)
+    except IOError:
+        print("Error, could not open file.")
+        return None
+    with f:
+        trace_data = TraceData()
+        trace_data.filename = filename
+        buffer = f.read(READ_BUFFER_SIZE)
+        header_end = buffer.find(b"\n") + 1 or len(buffer)
+        header = json.loads(buffer[:header_end])
+        if header.get("version", 1) > JSONL_VERSION:
+            raise ValueError(f"Error, unsupported JSON Lines version: {header}")
+        trace = new_json_trace(trace_data, header)
+        reg_count = len(trace_data.regs)
+        file_size = compressed.get_file_size(f)
+
+        if isinstance(f, compressed.DecompressingReader):
+            chunks = iter_jsonl_chunks(f, buffer[header_end:])
+            results = (
+                (decode_jsonl_lines(data, reg_count, prefs.COLUMNAR_TRACE), position)
+                for data, position in chunks
+            )
+        else:
+            ranges = get_jsonl_ranges(f, header_end, file_size)
+            tasks = (
+                (filename, start, end, reg_count, prefs.COLUMNAR_TRACE)
+                for start, end in ranges
+            )
+            results = zip(
+                run_in_workers(read_jsonl_chunk, tasks, len(ranges)),
+                (end for _start, end in ranges),
+            )
+        bookmarks = []
+        for (rows, chunk_bookmarks), position in results:
+            trace.extend(rows)
+            bookmarks += chunk_bookmarks
+            if progress is not None:
+                progress(trace_data, position, file_size)
+        for bookmark in bookmarks:
+            trace_data.add_bookmark(Bookmark(**bookmark))
+        return trace_data
+
+
+def get_jsonl_ranges(f, start, file_size):
+    """Splits a JSON Lines file to chunks of whole lines
+
+    Args:
+        f: File object opened in binary mode
+        start (int): File offset of the first row
+        file_size (int): Size of file
+    Returns:
+        list: Start and end offsets of chunks
+    """
+    ranges = []
+    while start < file_size:
+        end = start + JSONL_CHUNK_SIZE
+        if end < file_size:
+            f.seek(end)
+            end += len(f.readline())
+        end = min(end, file_size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def iter_jsonl_chunks(f, buffer):
+    """Yields chunks of whole lines from a file which can not be seeked
+
+    Args:
+        f: File object
+        buffer (bytes): Data already read from f
+    Yields:
+        tuple: Lines (bytes) and read position for progress callbacks
+    """
+    while True:
+        chunk = f.read(READ_BUFFER_SIZE)
+        buffer += chunk
+        end = buffer.rfind(b"\n") + 1 if chunk else len(buffer)
+        if end:
+            yield buffer[:end], compressed.get_read_position(f, len(buffer) - end)
+        buffer = buffer[end:]
+        if not chunk:
+            return
+
+
+def read_jsonl_chunk(filename, start, end, reg_count, columnar):
+    """Reads and decodes a chunk of a JSON Lines file
+
+    Runs in worker processes when a trace is loaded in parallel.
+
+    Args:
+        filename (str): Trace file name
+        start (int): File offset of the chunk
+        end (int): File offset after the chunk
+        reg_count (int): Number of registers
+        columnar (bool): Decode rows to ColumnarTrace instead of list
+    Returns:
+        tuple: Trace rows (ColumnarTrace or list) and bookmarks (dicts)
+    """
+    with open(filename, "rb") as f:
+        f.seek(start)
+        return decode_jsonl_lines(f.read(end - start), reg_count, columnar)
+
+
+def decode_jsonl_lines(data, reg_count, columnar):
+    """Decodes rows and bookmarks from lines of a JSON Lines trace
+
+    Args:
+        data (bytes): Whole lines
+        reg_count (int): Number of registers, 0 if rows are kept as dicts
+        columnar (bool): Decode rows to ColumnarTrace instead of list
+    Returns:
+        tuple: Trace rows (ColumnarTrace or list) and bookmarks (dicts)
+    """
+    rows = new_trace(reg_count, columnar) if reg_count else []
+    bookmarks = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "bookmarks" in record and "regs" not in record:
+            bookmarks += record["bookmarks"]
+        else:
+            rows.append(record)
+    if isinstance(rows, list):
+        intern_texts(rows)
+    return rows, bookmarks
+
+
+def intern_texts(trace):
+    """Replaces equal disasm, opcode and comment texts of rows with one copy
+
+    Args:
+        trace (list): Trace rows as dicts
+    """
+    intern = StringPool().intern
+    for row in trace:
+        for key in ("disasm", "opcodes", "comment"):
+            if key in row:
+                row[key] = intern(row[key])
+
+
+def save_as_json(trace_data, filename):
+    """Saves trace data to file in JSON format
+
+    Rows are encoded in chunks, so the whole JSON text is never in memory.
+
+    Args:
+        trace_data: TraceData object
+        filename: name of trace file
+    """
+    info = get_json_info(trace_data)
+    with open(filename, "w") as f:
+        f.write("{")
+        for key, value in info.items():
+            f.write(f"{json.dumps(key)}: {json.dumps(value)}, ")
+        f.write('"trace": [')
+        write_json_rows(f, trace_data.trace, ", ")
+        bookmarks = [vars(h) for h in trace_data.bookmarks]
+        f.write(f'], "bookmarks": {json.dumps(bookmarks)}}}')
+    remove_journal(filename)
+
+
+def save_as_jsonl(trace_data, filename):
+    """Saves trace data to file in JSON Lines format
+
+    The first line is a header with trace info, then every row is on its
+    own line and the last line has the bookmarks.
+
+    Args:
+        trace_data: TraceData object
+        filename: name of trace file
+    """
+    header = {"format": JSONL_FORMAT, "version": JSONL_VERSION}
+    header.update(get_json_info(trace_data))
     with open(filename, "w") as f:
-        json.dump(data, f)
+        f.write(json.dumps(header) + "\n")
+        if write_json_rows(f, trace_data.trace, "\n"):
+            f.write("\n")
+        bookmarks = [vars(h) for h in trace_data.bookmarks]
+        f.write(json.dumps({"bookmarks": bookmarks}) + "\n")
+    remove_journal(filename)
+
+
+def write_json_rows(f, trace, separator):
+    """Writes rows as JSON objects
+
+    Rows are encoded in chunks of prefs.TVT_BLOCK_ROWS, in worker
+    processes if there are many chunks.
+
+    Args:
+        f: File object opened in text mode
+        trace: Trace rows
+        separator (str): Text between rows
+    Returns:
+        bool: True if any rows were written
+    """
+    chunk_rows = prefs.TVT_BLOCK_ROWS
+    first_rows = range(0, len(trace), chunk_rows)
+    tasks = (
+        (get_trace_chunk(trace, first_row, chunk_rows), first_row, separator)
+        for first_row in first_rows
+    )
+    for i, text in enumerate(run_in_workers(encode_json_rows, tasks, len(first_rows))):
+        if i:
+            f.write(separator)
+        f.write(text)
+    return len(first_rows) > 0
+
+
+def encode_json_rows(rows, first_row, separator):
+    """Encodes rows as JSON objects
 
+    Runs in worker processes when a trace is saved in parallel.
 
-def save_as_tv_trace(trace_data, filename):
+    Args:
+        rows: Trace rows (ColumnarTrace or list of dicts)
+        first_row (int): Id of the first row
+        separator (str): Text between rows
+    Returns:
+        str: Encoded rows
+    """
+    columnar = isinstance(rows, ColumnarTrace)
+    texts = []
+    for row in rows:
+        if columnar:
+            row = row.copy()
+            row["id"] += first_row
+        texts.append(json.dumps(row, default=_to_json_type))
+    return separator.join(texts)
+
+
+def _to_json_type(obj):
+    """Converts ColumnarTrace and TraceRow objects for json.dump"""
+    if isinstance(obj, ColumnarTrace):
+        return list(obj)
+    if isinstance(obj, TraceRow):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def save_as_tv_trace(trace_data, filename, version=None):
     """Saves trace data in a default Trace Viewer format
 
+    Version 1 stores rows in one uncompressed stream. Version 2 stores rows
+    in compressed blocks and a block index, which allows random access and
+    decoding blocks in parallel.
+
     Args:
         trace_data: TraceData object
         filename: name of trace file
+        version (int, optional): Format version, 1 or 2.
+            Defaults to prefs.TVT_SAVE_VERSION.
+    Returns:
+        bool: True if saved
     """
+    if version is None:
+        version = prefs.TVT_SAVE_VERSION
+    if version not in (1, 2):
+        raise ValueError(f"Unsupported tvt version: {version}")
+    trace = trace_data.trace
+    if isinstance(trace, MappedTvTrace) and is_same_file(trace.filename, filename):
+        # rows are read from the mapped file, which can't be replaced on Windows
+        print("Error, can not save over the memory-mapped trace file.")
+        return False
+    # write to a temporary file first, so a failed save keeps the old file
+    temp_filename = filename + ".tmp"
     try:
-        f = open(filename, "wb")
-    except IOError:
+        with open(temp_filename, "wb") as f:
+            pointer_size = write_tv_header(f, trace_data, version)
+            if version == 2:
+                index = write_tv_blocks(
+                    f,
+                    trace,
+                    len(trace_data.regs),
+                    pointer_size,
+                    prefs.TVT_COMPRESSION,
+                    prefs.TVT_BLOCK_ROWS,
+                )
+                write_tv_block_index(
+                    f, index, trace_data.bookmarks, len(trace_data.regs), pointer_size
+                )
+            else:
+                write_tv_rows(f, trace, pointer_size)
+                f.write(encode_tv_bookmarks(trace_data.bookmarks))
+        os.replace(temp_filename, filename)
+    except Exception:
         print("Error, could not write to file.")
+        print(traceback.format_exc())
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return False
+    # comments and bookmarks are now in the trace file
+    remove_journal(filename)
+    return True
+
+
+def is_same_file(filename, other_filename):
+    """Returns True if both names refer to the same existing file"""
+    try:
+        return os.path.samefile(filename, other_filename)
+    except OSError:
+        return False
+
+
+def write_tv_header(f, trace_data, version):
+    """Writes header of a tvt file
+
+    Args:
+        f: File object
+        trace_data (TraceData): Trace data
+        version (int): Format version, 1 or 2
+    Returns:
+        int: Size of register values and memory addresses
+    """
+    f.write(b"TVTR")
+    file_info = {"arch": trace_data.arch, "version": f"{version}.0"}
+    if trace_data.pointer_size:
+        pointer_size = trace_data.pointer_size
+    elif trace_data.arch == "x64":
+        pointer_size = 8
     else:
-        with f:
-            trace = trace_data.trace
-            f.write(b"TVTR")
-            file_info = {"arch": trace_data.arch, "version": "1.0"}
-            if trace_data.pointer_size:
-                pointer_size = trace_data.pointer_size
-            elif trace_data.arch == "x64":
-                pointer_size = 8
-            else:
-                pointer_size = 4
-
-            file_info["pointer_size"] = pointer_size
-            file_info["regs"] = list(trace_data.regs.keys())
-            file_info["ip_reg"] = trace_data.ip_reg
-
-            json_blob = json.dumps(file_info)
-            json_blob_length = len(json_blob)
-            f.write((json_blob_length).to_bytes(4, byteorder="little"))
-            f.write(json_blob.encode())
-
-            for i, t in enumerate(trace):
-                f.write(b"\x00")
-
-                disasm = t["disasm"][:255]  # limit length to 0xff
-                f.write((len(disasm)).to_bytes(1, byteorder="little"))
-                f.write(disasm.encode())
-
-                comment = t["comment"][:255]
-                f.write((len(comment)).to_bytes(1, byteorder="little"))
-                f.write(comment.encode())
-
-                reg_change_newdata = []
-                reg_change_positions = []
-                pos = 0
-                for reg_index, reg_value in enumerate(t["regs"]):
-                    if i == 0 or reg_value != trace[i - 1]["regs"][reg_index]:
-                        reg_change_newdata.append(reg_value)  # value changed
-                        reg_change_positions.append(pos)
-                        pos = -1
-                    pos += 1
-
-                reg_changes = len(reg_change_positions) & 0xFF
-                f.write((reg_changes).to_bytes(1, byteorder="little"))
-
-                memory_accesses = len(t["mem"]) & 0xFF
-                f.write((memory_accesses).to_bytes(1, byteorder="little"))
-
-                flag = 0
-                opcodes = bytes.fromhex(t["opcodes"])
-                opcode_size = len(opcodes)
-                if "thread" in t:
-                    flag = flag | (1 << 7)
-                flags_and_opcode_size = flag | opcode_size
-
-                f.write((flags_and_opcode_size).to_bytes(1, byteorder="little"))
-                if "thread" in t:
-                    f.write((t["thread"]).to_bytes(4, byteorder="little"))
-                f.write(opcodes)
-
-                for pos in reg_change_positions:
-                    f.write((pos).to_bytes(1, byteorder="little"))
-
-                for newdata in reg_change_newdata:
-                    f.write((newdata).to_bytes(pointer_size, byteorder="little"))
-
-                mem_access_flags = []
-                mem_access_addresses = []
-                mem_access_data = []
-                for mem_access in t["mem"]:
-                    flag = 0
-                    if mem_access["access"].lower() == "write":
-                        flag = 1
-                    mem_access_flags.append(flag)
-                    mem_access_data.append(mem_access["value"])
-                    mem_access_addresses.append(mem_access["addr"])
-
-                for flag in mem_access_flags:
-                    f.write((flag).to_bytes(1, byteorder="little"))
-                for addr in mem_access_addresses:
-                    f.write((addr).to_bytes(pointer_size, byteorder="little"))
-                for data in mem_access_data:
-                    f.write((data).to_bytes(pointer_size, byteorder="little"))
-
-            for bookmark in trace_data.bookmarks:
-                f.write(b"\x01")
-                f.write((bookmark.startrow).to_bytes(4, byteorder="little"))
-                f.write((bookmark.endrow).to_bytes(4, byteorder="little"))
-                disasm = bookmark.disasm[:255]
-                disasm_length = len(disasm)
-                f.write((disasm_length).to_bytes(1, byteorder="little"))
-                f.write(disasm.encode())
-                comment = bookmark.comment[:255]
-                comment_length = len(comment)
-                f.write((comment_length).to_bytes(1, byteorder="little"))
-                f.write(comment.encode())
-                addr = bookmark.addr[:255]
-                addr_length = len(addr)
-                f.write((addr_length).to_bytes(1, byteorder="little"))
-                f.write(addr.encode())
-
-
-def open_x64dbg_trace(filename):
+        pointer_size = 4
+
+    file_info["pointer_size"] = pointer_size
+    file_info["regs"] = list(trace_data.regs.keys())
+    file_info["ip_reg"] = trace_data.ip_reg
+    if version == 2:
+        file_info["compression"] = prefs.TVT_COMPRESSION
+        file_info["block_rows"] = prefs.TVT_BLOCK_ROWS
+
+    json_blob = json.dumps(file_info)
+    json_blob_length = len(json_blob)
+    f.write((json_blob_length).to_bytes(4, byteorder="little"))
+    f.write(json_blob.encode())
+    return pointer_size
+
+
+def write_tv_block_index(f, index, bookmarks, reg_count, pointer_size):
+    """Writes block index, bookmarks and trailer of a tvt v2 file
+
+    Args:
+        f: File object, positioned after the last block
+        index (bytes): Block index from write_tv_blocks()
+        bookmarks (list): Bookmarks
+        reg_count (int): Number of registers
+        pointer_size (int): Size of register values
+    """
+    index_offset = f.tell()
+    f.write(index)
+    f.write(encode_tv_bookmarks(bookmarks))
+    block_count = len(index) // (TVT_BLOCK_INDEX.size + reg_count * pointer_size)
+    f.write(TVT_TRAILER.pack(index_offset, block_count, TVT_TRAILER_MAGIC))
+
+
+def write_tv_rows(f, trace, pointer_size):
+    """Writes rows of a tvt v1 file
+
+    Rows are encoded in chunks of prefs.TVT_BLOCK_ROWS, in worker
+    processes if there are many chunks.
+
+    Args:
+        f: File object, positioned after the header
+        trace: Trace rows
+        pointer_size (int): Size of register values and memory addresses
+    """
+    chunk_rows = prefs.TVT_BLOCK_ROWS
+    first_rows = range(0, len(trace), chunk_rows)
+    tasks = (
+        (
+            get_trace_chunk(trace, first_row, chunk_rows),
+            list(trace[first_row - 1]["regs"]) if first_row else None,
+            pointer_size,
+            trace[first_row - 1].get("thread") if first_row else None,
+        )
+        for first_row in first_rows
+    )
+    for data in run_in_workers(encode_tv_rows, tasks, len(first_rows)):
+        f.write(data)
+
+
+def encode_tv_rows(rows, reg_values, pointer_size, last_thread=None):
+    """Encodes rows of a tvt v1 file
+
+    Runs in worker processes when a trace is saved in parallel. Like in
+    x64dbg traces, thread id is stored only in rows where it changes.
+
+    Args:
+        rows: Trace rows (ColumnarTrace or list of dicts)
+        reg_values (list): Register values before the first row, None if
+            rows start from the beginning of trace
+        pointer_size (int): Size of register values and memory addresses
+        last_thread (int, optional): Thread id before the first row
+    Returns:
+        bytearray: Encoded rows
+    """
+    out = bytearray()
+    for disasm, comment, regs, opcodes, mems, thread in iter_row_fields(rows):
+        out.append(0)
+        for text in (disasm, comment):
+            text = text[:255]  # limit length to 0xff
+            out.append(len(text))
+            out += text.encode()
+
+        if reg_values is None:
+            changed = range(len(regs))
+        else:
+            changed = [
+                reg_index
+                for reg_index, value, old_value in zip(
+                    range(len(regs)), regs, reg_values
+                )
+                if value != old_value
+            ]
+        reg_values = regs
+
+        out.append(len(changed) & 0xFF)
+        out.append(len(mems) & 0xFF)
+        flags_and_opcode_size = len(opcodes)
+        thread_changed = thread is not None and thread != last_thread
+        if thread_changed:
+            flags_and_opcode_size |= 1 << 7
+        out.append(flags_and_opcode_size)
+        if thread_changed:
+            out += THREAD_ID.pack(thread)
+            last_thread = thread
+        out += opcodes
+
+        last_index = -1
+        for reg_index in changed:
+            out.append(reg_index - last_index - 1)
+            last_index = reg_index
+        out += get_struct(len(changed), pointer_size).pack(
+            *[regs[reg_index] for reg_index in changed]
+        )
+
+        for mem_access in mems:
+            out.append(1 if mem_access["access"].lower() == "write" else 0)
+        out += get_struct(2 * len(mems), pointer_size).pack(
+            *[mem_access["addr"] for mem_access in mems],
+            *[mem_access["value"] for mem_access in mems],
+        )
+    return out
+
+
+def encode_tv_bookmarks(bookmarks):
+    """Encodes bookmarks for the end of tvt trace
+
+    Args:
+        bookmarks (list): Bookmarks
+    Returns:
+        bytes: Encoded bookmarks
+    """
+    out = bytearray()
+    for bookmark in bookmarks:
+        out += b"\x01"
+        out += BOOKMARK_ROWS.pack(bookmark.startrow, bookmark.endrow)
+        for text in (bookmark.disasm, bookmark.comment, bookmark.addr):
+            text = text[:255]
+            out += (len(text)).to_bytes(1, byteorder="little")
+            out += text.encode()
+    return bytes(out)
+
+
+def open_cached_x64dbg_trace(filename, progress=None):
+    """Opens x64dbg trace file using converted traces in cache dir
+
+    On a cache miss the trace is converted and saved to cache dir in tvt
+    format, on a hit the tvt file is loaded instead of the x64dbg file.
+
+    Args:
+        filename: name of trace file
+        progress (callable, optional): Progress callback, see open_trace()
+    Returns:
+        TraceData object
+    """
+    cache_filename = trace_cache.get_cache_filename(filename)
+    if cache_filename is None:
+        return open_x64dbg_trace(filename, progress)
+
+    if trace_cache.use_cache_file(cache_filename):
+        try:
+            trace_data = open_tv_trace(cache_filename, progress=progress)
+        except LoadCancelled:
+            raise
+        except Exception:
+            print(f"Error, could not load cached trace {cache_filename}")
+            print(traceback.format_exc())
+        else:
+            # edits are saved to the opened file, not to cache
+            trace_data.filename = filename
+            return trace_data
+
+    trace_data = open_x64dbg_trace(filename, progress)
+    if trace_cache.prepare_cache_dir():
+        try:
+            saved = save_as_tv_trace(trace_data, cache_filename)
+        except Exception:
+            # the trace is loaded, only the cache file is lost
+            print(f"Error, could not save trace to cache {cache_filename}")
+            print(traceback.format_exc())
+            if os.path.exists(cache_filename + ".tmp"):
+                os.remove(cache_filename + ".tmp")
+            saved = False
+        if saved:
+            trace_cache.evict_cache_files()
+    return trace_data
+
+
+def open_x64dbg_trace(filename, progress=None, follow=False):
     """Opens x64dbg trace file
 
     Args:
         filename: name of trace file
+        progress (callable, optional): Progress callback, see open_trace()
+        follow (bool, optional): Set trace_data.follower, see open_trace()
     Returns:
         TraceData object
     """
-    with open(filename, "rb") as f:
+    with compressed.open_file(filename) as f:
         trace_data = TraceData()
         trace_data.filename = filename
+        capstone_mode = read_x64dbg_header(f, trace_data)
+        reg_indexes = trace_data.regs
 
-        # check first 4 bytes
-        magic = f.read(4)
-        if magic != b"TRAC":
-            raise ValueError("Error, wrong file format.")
-
-        json_length_bytes = f.read(4)
-        json_length = int.from_bytes(json_length_bytes, "little")
+        decoder = X64dbgDecoder(reg_indexes, trace_data.ip_reg, trace_data.pointer_size)
+        strings = StringPool()
+        trace = new_trace(len(reg_indexes))
+        trace_data.trace = trace
+        file_size = compressed.get_file_size(f)
+        cache = get_disasm_cache(capstone_mode)
+        cache.hits = cache.misses = 0
+        batch_rows = prefs.DISASM_BATCH_ROWS
+        workers = get_worker_count()
+        pool = None
+        pending = deque()
+        buffer = b""
+        pos = 0
+        try:
+            while not decoder.done:
+                chunk = f.read(READ_BUFFER_SIZE)
+                if not chunk:
+                    decoder.done = True
+                buffer = buffer[pos:] + chunk
+                pos = decoder.decode(buffer)
+
+                records = decoder.records
+                while len(records) >= batch_rows or (decoder.done and records):
+                    if pool is None and workers > 1:
+                        if not decoder.done or len(records) > batch_rows:
+                            # more than one batch, disassemble in worker processes
+                            pool = create_process_pool(workers)
+                    batch = records[:batch_rows]
+                    del records[:batch_rows]
+                    request = DisasmRequest(
+                        cache,
+                        [record[2] for record in batch],
+                        [record[0] for record in batch],
+                        pool,
+                    )
+                    pending.append((batch, request))
+                    # keep workers busy but don't let decoded records pile up
+                    while pending and (
+                        pool is None
+                        or pending[0][1].done()
+                        or len(pending) > 2 * workers
+                    ):
+                        batch, request = pending.popleft()
+                        add_x64dbg_rows(trace, batch, request.result(), strings)
+                        if progress is not None:
+                            position = compressed.get_read_position(f)
+                            progress(trace_data, position, file_size)
+            while pending:
+                batch, request = pending.popleft()
+                add_x64dbg_rows(trace, batch, request.result(), strings)
+                if progress is not None:
+                    progress(trace_data, compressed.get_read_position(f), file_size)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if prefs.DEBUG:
+            print(
+                f"Disasm cache hit rate: {cache.get_hit_rate():.1%} "
+                f"({cache.hits} hits, {cache.misses} misses)"
+            )
+        save_disasm_cache(cache)
+        if follow:
+            # end of file was reached, but more records may be written
+            decoder.done = False
+            offset = f.tell() - (len(buffer) - pos)
+            trace_data.follower = TraceFollower(filename, offset, decoder, trace, cache)
+        return trace_data
 
-        # read JSON blob
-        json_blob = f.read(json_length)
-        json_str = str(json_blob, "utf-8")
-        arch = json.loads(json_str)["arch"]
 
-        reg_indexes = {}
-        if arch == "x64":
-            regs = prefs.X64_REGS
-            ip_reg = "rip"
-            capstone_mode = CS_MODE_64
-            pointer_size = 8  # qword
-        else:
-            regs = prefs.X32_REGS
-            ip_reg = "eip"
-            capstone_mode = CS_MODE_32
-            pointer_size = 4  # dword
+def read_x64dbg_header(f, trace_data):
+    """Reads header of an x64dbg trace and sets trace info to trace data
 
-        for i, reg in enumerate(regs):
-            reg_indexes[reg] = i
+    Args:
+        f: File object positioned at the start of file
+        trace_data (TraceData): Trace data, arch, ip_reg, regs and
+            pointer_size are set
+    Returns:
+        int: Capstone mode of the arch
+    Raises:
+        ValueError: If file is not an x64dbg trace
+    """
+    # check first 4 bytes
+    magic = f.read(4)
+    if magic != b"TRAC":
+        raise ValueError("Error, wrong file format.")
+
+    json_length_bytes = f.read(4)
+    json_length = int.from_bytes(json_length_bytes, "little")
+
+    # read JSON blob
+    json_blob = f.read(json_length)
+    json_str = str(json_blob, "utf-8")
+    arch = json.loads(json_str)["arch"]
+
+    reg_indexes = {}
+    if arch == "x64":
+        regs = prefs.X64_REGS
+        ip_reg = "rip"
+        capstone_mode = CS_MODE_64
+        pointer_size = 8  # qword
+    else:
+        regs = prefs.X32_REGS
+        ip_reg = "eip"
+        capstone_mode = CS_MODE_32
+        pointer_size = 4  # dword
+
+    for i, reg in enumerate(regs):
+        reg_indexes[reg] = i
+
+    trace_data.arch = arch
+    trace_data.ip_reg = ip_reg
+    trace_data.regs = reg_indexes
+    trace_data.pointer_size = pointer_size
+    return capstone_mode
+
+
+class X64dbgDecoder:
+    """Decodes records of an x64dbg trace from a buffer
+
+    Records are not disassembled, they are collected to records list as
+    (ip, regs, opcodes, mems, thread) tuples. Mems is a list of (flag,
+    address, value) tuples.
+
+    Attributes:
+        records (list): Decoded records
+        reg_values (list): Register values of the last decoded record
+        thread (int): Thread id of the last decoded record, None if not known.
+            x64dbg stores thread id only in records where it changes.
+        row_id (int): Id of the next record
+        done (bool): True when all records have been decoded
+    """
 
-        trace_data.arch = arch
-        trace_data.ip_reg = ip_reg
-        trace_data.regs = reg_indexes
-        trace_data.pointer_size = pointer_size
-
-        md = Cs(CS_ARCH_X86, capstone_mode)
-        reg_values = [None] * len(reg_indexes)
-        trace = []
-        row_id = 0
-        while f.read(1) == b"\x00":
-            register_changes = int.from_bytes(f.read(1), "little")
-            memory_accesses = int.from_bytes(f.read(1), "little")
-            flags_and_opcode_size = int.from_bytes(f.read(1), "little")  # Bitfield
-            thread_id_bit = (flags_and_opcode_size >> 7) & 1  # msb
-            opcode_size = flags_and_opcode_size & 15  # 4 lsbs
-
-            if thread_id_bit > 0:
-                thread_id = int.from_bytes(f.read(4), "little")
-
-            opcodes = f.read(opcode_size)
-
-            register_change_position = []
-            for _ in range(register_changes):
-                register_change_position.append(int.from_bytes(f.read(1), "little"))
-
-            register_change_new_data = []
-            for _ in range(register_changes):
-                register_change_new_data.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+    def __init__(self, reg_indexes, ip_reg, pointer_size):
+        """Inits X64dbgDecoder
+
+        Args:
+            reg_indexes (dict): Register names and indexes
+            ip_reg (str): Name of instruction pointer register
+            pointer_size (int): Size of register values and memory addresses
+        """
+        self.records = []
+        self.ip_index = reg_indexes[ip_reg]
+        self.pointer_size = pointer_size
+        self.reg_values = [None] * len(reg_indexes)
+        self.thread = None
+        self.row_id = 0
+        self.done = False
+
+    def decode(self, buffer, pos=0):
+        """Decodes all complete records from buffer
+
+        Args:
+            buffer (bytes): Trace data
+            pos (int): Position of the first record in buffer
+        Returns:
+            int: Position after the last decoded record
+        """
+        records = self.records
+        reg_values = self.reg_values
+        reg_count = len(reg_values)
+        pointer_size = self.pointer_size
+        thread = self.thread
+        row_id = self.row_id
+        end = len(buffer)
+
+        while pos < end:
+            if buffer[pos] != 0:
+                self.done = True
+                break
+            try:
+                register_changes = buffer[pos + 1]
+                memory_accesses = buffer[pos + 2]
+                flags_and_opcode_size = buffer[pos + 3]  # Bitfield
+                p = pos + 4
+                thread_pos = None
+                if flags_and_opcode_size & 0x80:  # thread id bit
+                    thread_pos = p
+                    p += 4
+                opcodes = buffer[p : p + (flags_and_opcode_size & 15)]
+                p += flags_and_opcode_size & 15
+                positions = buffer[p : p + register_changes]
+                p += register_changes
+                new_data = get_struct(register_changes, pointer_size).unpack_from(
+                    buffer, p
                 )
-
-            memory_access_flags = []
-            for _ in range(memory_accesses):
-                memory_access_flags.append(int.from_bytes(f.read(1), "little"))
-
-            memory_access_addresses = []
-            for _ in range(memory_accesses):
-                memory_access_addresses.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+                p += register_changes * pointer_size
+                memory_access_flags = buffer[p : p + memory_accesses]
+                p += memory_accesses
+                memory_access_data = get_struct(
+                    2 * memory_accesses, pointer_size
+                ).unpack_from(buffer, p)
+                p += 2 * memory_accesses * pointer_size
+                # new data is saved only if the memory content changed
+                new_value_count = sum(
+                    1 for flag in memory_access_flags if flag & 1 == 0
                 )
-
-            memory_access_old_data = []
-            for _ in range(memory_accesses):
-                memory_access_old_data.append(
-                    int.from_bytes(f.read(pointer_size), "little")
+                new_values = get_struct(new_value_count, pointer_size).unpack_from(
+                    buffer, p
                 )
-
-            memory_access_new_data = []
-            for i in range(memory_accesses):
-                if memory_access_flags[i] & 1 == 0:
-                    memory_access_new_data.append(
-                        int.from_bytes(f.read(pointer_size), "little")
-                    )
-
-            reg_id = 0
-            regchanges = ""
-            for i, change in enumerate(register_change_position):
-                reg_id += change
-                if reg_id + i < len(reg_indexes):
-                    reg_values[reg_id + i] = register_change_new_data[i]
-                if reg_id + i < len(reg_indexes) and row_id > 0:
-                    reg_name = regs[reg_id + i]
-                    if reg_name is not ip_reg:
-                        old_value = trace[-1]["regs"][reg_id + i]
-                        new_value = register_change_new_data[i]
-                        if old_value != new_value:
-                            if prefs.TRACE_SHOW_OLD_REG_VALUE:
-                                regchanges += (
-                                    f"{reg_name}: {hex(old_value)} -> {hex(new_value)} "
-                                )
-                            else:
-                                regchanges += f"{reg_name}: {hex(new_value)} "
-                            if 0x7F > new_value > 0x1F:
-                                regchanges += f"'{chr(new_value)}' "
-
-            # disassemble
-            ip = reg_values[reg_indexes[ip_reg]]
-            for _address, _size, mnemonic, op_str in md.disasm_lite(opcodes, ip):
-                disasm = mnemonic
-                if op_str:
-                    disasm += " " + op_str
+                p += len(new_values) * pointer_size
+            except (IndexError, struct.error):
+                break  # incomplete record
+            if p > end:
+                break
+
+            if thread_pos is not None:
+                thread = THREAD_ID.unpack_from(buffer, thread_pos)[0]
+            for i, reg_index in enumerate(accumulate(positions)):
+                if reg_index + i < reg_count:
+                    reg_values[reg_index + i] = new_data[i]
 
             mems = []
-            mem = {}
             new_data_counter = 0
-            for i in range(memory_accesses):
-                flag = memory_access_flags[i]
-                value = memory_access_old_data[i]
-                mem["access"] = "READ"
+            for i, flag in enumerate(memory_access_flags):
+                value = memory_access_data[memory_accesses + i]
                 if flag & 1 == 0:
-                    value = memory_access_new_data[new_data_counter]
-                    mem["access"] = "WRITE"
+                    value = new_values[new_data_counter]
                     new_data_counter += 1
-                else:
-                    pass
-                    # memory value didn't change
-                    # (it is read or overwritten with identical value)
-                    # this has to be fixed somehow in x64dbg
-
-                mem["addr"] = memory_access_addresses[i]
-
-                # fix value (x64dbg saves all values as qwords)
-                if "qword" in disasm:
-                    pass
-                elif "dword" in disasm:
-                    value &= 0xFFFFFFFF
-                elif "word" in disasm:
-                    value &= 0xFFFF
-                elif "byte" in disasm:
-                    value &= 0xFF
-                mem["value"] = value
-                mems.append(mem.copy())
-
-            if regchanges:
-                trace[-1]["regchanges"] = regchanges
+                # else: memory value didn't change
+                # (it is read or overwritten with identical value)
+                # this has to be fixed somehow in x64dbg
+                mems.append((flag, memory_access_data[i], value))
+
+            records.append(
+                (
+                    reg_values[self.ip_index],
+                    reg_values.copy(),
+                    bytes(opcodes),
+                    mems,
+                    thread,
+                )
+            )
+            row_id += 1
+            pos = p
+        self.thread = thread
+        self.row_id = row_id
+        return pos
+
+
+def add_x64dbg_rows(trace, records, disasm_list, strings):
+    """Appends decoded and disassembled x64dbg records to trace
 
+    Args:
+        trace: ColumnarTrace or list
+        records (list): Records from X64dbgDecoder
+        disasm_list (list): Disasm texts of records
+        strings (StringPool): Pool for texts of rows stored as dicts
+    """
+    columnar = isinstance(trace, ColumnarTrace)
+    for (ip, regs, opcodes, mem_accesses, thread), disasm in zip(records, disasm_list):
+        mems = []
+        for flag, addr, value in mem_accesses:
+            # fix value (x64dbg saves all values as qwords)
+            if "qword" in disasm:
+                pass
+            elif "dword" in disasm:
+                value &= 0xFFFFFFFF
+            elif "word" in disasm:
+                value &= 0xFFFF
+            elif "byte" in disasm:
+                value &= 0xFF
+            mems.append(
+                {
+                    "access": "WRITE" if flag & 1 == 0 else "READ",
+                    "addr": addr,
+                    "value": value,
+                }
+            )
+
+        if columnar:
+            trace.append_row(ip, regs, opcodes, disasm, "", mems, thread)
+        else:
             trace_row = {}
-            trace_row["id"] = row_id
+            trace_row["id"] = len(trace)
             trace_row["ip"] = ip
-            trace_row["disasm"] = disasm
-            trace_row["regs"] = reg_values.copy()
-            trace_row["opcodes"] = opcodes.hex()
-            trace_row["mem"] = mems.copy()
+            trace_row["disasm"] = strings.intern(disasm)
+            trace_row["regs"] = regs
+            trace_row["opcodes"] = strings.intern(opcodes.hex())
+            trace_row["mem"] = mems
+            if thread is not None:
+                trace_row["thread"] = thread
             # trace_row["comment"] = ""
             trace.append(trace_row)
-            row_id += 1
 
-        trace_data.trace = trace
-        return trace_data
+
+class TraceFollower:
+    """Decodes rows appended to a trace file after it was loaded
+
+    Used to follow a trace which is still being written, for example by
+    x64dbg while it is recording. The file offset of the first row which is
+    not decoded yet and the decoder with register values and thread id of
+    the last row are kept, so only the appended data is read.
+
+    Attributes:
+        filename (str): Trace file name
+        offset (int): File offset of the first row which is not decoded yet
+        decoder: TvtDecoder or X64dbgDecoder used to load the trace
+        trace (ColumnarTrace): Trace where rows are appended
+        cache (DisasmCache): Disasm cache, None for tvt traces
+        done (bool): True when the end of rows was found (complete bookmarks
+            of a tvt trace or a broken record), nothing more is read
+        bookmarks (list): Bookmarks written after the rows of a tvt trace,
+            set when they are complete
+    """
+
+    def __init__(self, filename, offset, decoder, trace=None, cache=None):
+        """Inits TraceFollower
+
+        Args:
+            filename (str): Trace file name
+            offset (int): File offset of the first row which is not decoded
+            decoder: TvtDecoder or X64dbgDecoder, TvtDecoder appends rows to
+                its own trace
+            trace (ColumnarTrace, optional): Trace of X64dbgDecoder records
+            cache (DisasmCache, optional): Disasm cache of X64dbgDecoder
+        """
+        self.filename = filename
+        self.offset = offset
+        self.decoder = decoder
+        self.trace = decoder.trace if trace is None else trace
+        self.cache = cache
+        self.strings = StringPool()
+        self.done = decoder.done
+        self.bookmarks = []
+
+    def poll(self):
+        """Appends complete rows written to the file since the last call
+
+        At most prefs.FOLLOW_MAX_READ_SIZE bytes are read per call, the rest
+        is read on the next calls. When the rows of a tvt trace end, the
+        bookmarks after them are read once they are completely written.
+
+        Returns:
+            int: Number of appended rows
+        """
+        if self.done:
+            return 0
+        try:
+            if os.path.getsize(self.filename) <= self.offset:
+                return 0
+            f = open(self.filename, "rb")
+        except OSError:
+            return 0  # file may be replaced while it is written
+        row_count = len(self.trace)
+        max_size = prefs.FOLLOW_MAX_READ_SIZE
+        with f:
+            f.seek(self.offset)
+            buffer = b""
+            pos = 0
+            read_size = 0
+            while not self.decoder.done and read_size < max_size:
+                chunk = f.read(min(READ_BUFFER_SIZE, max_size - read_size))
+                if not chunk:
+                    break
+                read_size += len(chunk)
+                buffer = buffer[pos:] + chunk
+                pos = self.decode(buffer)
+                self.offset += pos
+            if self.decoder.done:
+                if self.cache is None:
+                    f.seek(self.offset)
+                    self.read_bookmarks(f.read())
+                else:
+                    self.done = True
+        return len(self.trace) - row_count
+
+    def read_bookmarks(self, buffer):
+        """Sets bookmarks and done if the bookmarks after rows are complete
+
+        Args:
+            buffer (bytes): Data after the last row of a tvt trace
+        """
+        try:
+            bookmarks = decode_tv_bookmarks(buffer)
+        except (IndexError, struct.error, UnicodeDecodeError):
+            return  # last bookmark is still being written
+        if len(encode_tv_bookmarks(bookmarks)) == len(buffer):
+            self.bookmarks = bookmarks
+            self.done = True
+
+    def decode(self, buffer):
+        """Decodes complete rows of buffer and appends them to trace
+
+        Returns:
+            int: Position after the last decoded row
+        """
+        decoder = self.decoder
+        pos = decoder.decode(buffer)
+        if self.cache is None:
+            return pos
+        records = decoder.records
+        batch_rows = prefs.DISASM_BATCH_ROWS
+        for start in range(0, len(records), batch_rows):
+            batch = records[start : start + batch_rows]
+            request = DisasmRequest(
+                self.cache,
+                [record[2] for record in batch],
+                [record[0] for record in batch],
+            )
+            add_x64dbg_rows(self.trace, batch, request.result(), self.strings)
+        records.clear()
+        return pos
+
+
+def get_worker_count():
+    """Returns number of worker processes from prefs.WORKERS"""
+    if prefs.WORKERS > 0:
+        return prefs.WORKERS
+    return os.cpu_count() or 1
+
+
+def create_process_pool(workers):
+    """Returns a ProcessPoolExecutor
+
+    Args:
+        workers (int): Number of worker processes
+    """
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
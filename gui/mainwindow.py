@@ -4,7 +4,7 @@ import functools
 import traceback
 
 from PyQt5 import uic
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QCursor, QFont
 from PyQt5.QtWidgets import (
     QMainWindow,
@@ -20,10 +20,11 @@ from PyQt5.QtWidgets import (
 )
 from yapsy.PluginManager import PluginManager
 
-from core.trace_data import TraceData
+from core.trace_data import TraceData, TracePrefix
 from core import trace_files
 from core.filter_and_find import find
 from core.filter_and_find import filter_trace
+from core.filter_and_find import filter_new_rows
 from core.filter_and_find import TraceField
 from core.api import Api
 from core import prefs
@@ -33,6 +34,7 @@ from gui.widgets.pagination_widget import PaginationWidget
 from gui.widgets.find_widget import FindWidget
 from gui.widgets.filter_widget import FilterWidget
 from gui.input_dialog import InputDialog
+from gui.trace_loader import TraceLoader
 
 
 class MainWindow(QMainWindow):
@@ -41,6 +43,9 @@ class MainWindow(QMainWindow):
     Attributes:
         trace_data (TraceData): TraceData object
         filtered_trace (list): Filtered trace
+        trace_loader (TraceLoader): Loader of the trace, None if not loading
+        loaded_trace (TracePrefix): Loaded rows while trace is loading
+        follow_timer (QTimer): Checks the followed trace file for new rows
     """
 
     def __init__(self, parent=None):
@@ -50,11 +55,22 @@ class MainWindow(QMainWindow):
         self.trace_data = TraceData()
         self.filtered_trace = []
         self.filter_text = ""
+        self.trace_loader = None
+        self.loaded_trace = None
+        self.load_status = ""
+        self.filtered_while_loading = False
+        self.follow_timer = QTimer(self)
+        self.follow_timer.timeout.connect(self.on_follow_timer)
         self.init_plugins()
         self.init_ui()
         if len(sys.argv) > 1:
             self.open_trace(sys.argv[1])
 
+    def closeEvent(self, event):
+        """QMainWindow method reimplementation, stops loading a trace."""
+        self.cancel_loading(wait=True)
+        super().closeEvent(event)
+
     def dragEnterEvent(self, event):
         """QMainWindow method reimplementation for file drag."""
         event.setDropAction(Qt.MoveAction)
@@ -93,6 +109,7 @@ class MainWindow(QMainWindow):
         self.trace_table.bookmarkCreated.connect(self.add_bookmark)
         self.trace_table.commentEdited.connect(self.set_comment)
         self.trace_table.printer = self.print
+        self.trace_table.regchanges_getter = self.get_regchanges
         self.trace_table.set_row_height(prefs.TRACE_ROW_HEIGHT)
 
         trace_font = QFont(prefs.TRACE_FONT)
@@ -181,23 +198,37 @@ class MainWindow(QMainWindow):
         open_trace_action.triggered.connect(self.dialog_open_trace)
 
         self.save_trace_action = QAction("&Save trace", self)
+        self.save_trace_action.setShortcut("Ctrl+S")
         self.save_trace_action.setStatusTip("Save trace")
         self.save_trace_action.triggered.connect(self.save_trace)
         self.save_trace_action.setEnabled(False)
 
-        save_trace_as_action = QAction("&Save trace as..", self)
-        save_trace_as_action.setStatusTip("Save trace as..")
-        save_trace_as_action.triggered.connect(self.dialog_save_trace_as)
+        self.save_trace_as_action = QAction("&Save trace as..", self)
+        self.save_trace_as_action.setStatusTip("Save trace as..")
+        self.save_trace_as_action.triggered.connect(self.dialog_save_trace_as)
+        self.save_trace_as_action.setEnabled(False)
 
-        save_trace_as_json_action = QAction("&Save trace as JSON..", self)
-        save_trace_as_json_action.setStatusTip("Save trace as JSON..")
-        save_trace_as_json_action.triggered.connect(self.dialog_save_trace_as_json)
+        self.save_trace_as_json_action = QAction("&Save trace as JSON..", self)
+        self.save_trace_as_json_action.setStatusTip("Save trace as JSON..")
+        self.save_trace_as_json_action.triggered.connect(self.dialog_save_trace_as_json)
+        self.save_trace_as_json_action.setEnabled(False)
 
         file_menu = self.menu_bar.addMenu("&File")
         file_menu.addAction(open_trace_action)
         file_menu.addAction(self.save_trace_action)
-        file_menu.addAction(save_trace_as_action)
-        file_menu.addAction(save_trace_as_json_action)
+        file_menu.addAction(self.save_trace_as_action)
+        file_menu.addAction(self.save_trace_as_json_action)
+        self.cancel_loading_action = QAction("&Cancel loading", self)
+        self.cancel_loading_action.setStatusTip("Stop loading the trace")
+        self.cancel_loading_action.triggered.connect(lambda: self.cancel_loading())
+        self.cancel_loading_action.setEnabled(False)
+        file_menu.addAction(self.cancel_loading_action)
+        self.follow_action = QAction("&Follow trace file", self)
+        self.follow_action.setCheckable(True)
+        self.follow_action.setStatusTip("Show rows written to the trace file")
+        self.follow_action.toggled.connect(self.set_following)
+        self.follow_action.setEnabled(False)
+        file_menu.addAction(self.follow_action)
         file_menu.addAction(exit_action)
 
         self.plugins_topmenu = self.menu_bar.addMenu("&Plugins")
@@ -269,7 +300,10 @@ class MainWindow(QMainWindow):
             func = functools.partial(self.execute_plugin, plugin)
             action.triggered.connect(func)
             plugins_menu.addAction(action)
+        # plugins get the full trace, which is incomplete while loading
+        plugins_menu.setEnabled(self.trace_loader is None)
         self.plugins_topmenu.addMenu(plugins_menu)
+        self.run_plugin_menu = plugins_menu
 
     def create_trace_table_menu(self):
         """Creates right click menu for trace table"""
@@ -290,9 +324,22 @@ class MainWindow(QMainWindow):
             func = functools.partial(self.execute_plugin, plugin)
             action.triggered.connect(func)
             plugins_menu.addAction(action)
+        plugins_menu.setEnabled(self.trace_loader is None)
         self.trace_table_menu.addMenu(plugins_menu)
+        self.trace_table_plugins_menu = plugins_menu
         self.trace_table.menu = self.trace_table_menu
 
+    def set_plugins_enabled(self, enabled):
+        """Enables or disables running plugins from menus"""
+        self.run_plugin_menu.setEnabled(enabled)
+        self.trace_table_plugins_menu.setEnabled(enabled)
+
+    def set_save_enabled(self, enabled):
+        """Enables or disables saving the trace from menus"""
+        self.save_trace_action.setEnabled(enabled)
+        self.save_trace_as_action.setEnabled(enabled)
+        self.save_trace_as_json_action.setEnabled(enabled)
+
     def reload_plugins(self):
         """Reloads plugins"""
         self.init_plugins()
@@ -320,14 +367,24 @@ class MainWindow(QMainWindow):
         self.filter_text = filter_text
         if self.trace_data is None:
             return
+        self.filtered_while_loading = self.trace_loader is not None
+        timings = [] if prefs.DEBUG else None
         try:
             filtered_trace = filter_trace(
-                self.trace_data.trace, self.trace_data.get_regs(), filter_text,
+                self.get_loaded_trace(),
+                self.trace_data.get_regs(),
+                filter_text,
+                timings,
             )
         except Exception as exc:
             self.show_messagebox("Filter error", f"{exc}")
             # print(traceback.format_exc())
         else:
+            for clause, path, seconds, rows_in, rows_out in timings or []:
+                print_debug(
+                    f"Filter {clause}: {path}, {seconds:.3f} s, "
+                    f"{rows_in} -> {rows_out} rows"
+                )
             self.filtered_trace = filtered_trace
             self.show_filtered_trace()
             self.update_status_bar()
@@ -385,7 +442,7 @@ class MainWindow(QMainWindow):
         index = self.select_trace_combo_box.currentIndex()
         if self.trace_data is not None:
             if index == 0:
-                return self.trace_data.trace
+                return self.get_loaded_trace()
             else:
                 return self.filtered_trace
         return None
@@ -396,37 +453,55 @@ class MainWindow(QMainWindow):
 
     def dialog_open_trace(self):
         """Shows dialog to open trace file"""
-        all_traces = "All traces (*.tvt *.trace32 *.trace64)"
+        all_traces = "All traces (*.tvt *.trace32 *.trace64 *.jsonl *.gz *.xz *.bz2)"
         all_files = "All files (*.*)"
         filename = QFileDialog.getOpenFileName(
             self, "Open trace", "", all_traces + ";; " + all_files
         )[0]
         if filename:
             self.open_trace(filename)
-            if self.trace_data:
-                self.save_trace_action.setEnabled(True)
 
     def dialog_save_trace_as(self):
         """Shows a dialog to select a save file"""
-        filename = QFileDialog.getSaveFileName(
-            self, "Save trace as", "", "Trace Viewer traces (*.tvt);; All files (*.*)"
-        )[0]
+        version_2 = "Trace Viewer traces, version 2 (*.tvt)"
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Save trace as",
+            "",
+            "Trace Viewer traces (*.tvt);; " + version_2 + ";; All files (*.*)",
+        )
         print_debug("Save trace as: " + filename)
-        if filename and trace_files.save_as_tv_trace(self.trace_data, filename):
+        if not filename:
+            return
+        # version 2 only when selected, older viewers can't open it
+        version = 2 if selected_filter == version_2 else None
+        if trace_files.save_as_tv_trace(self.trace_data, filename, version):
             self.trace_data.filename = filename
-            self.save_trace_action.setEnabled(True)
+            self.trace_data.journal = None
+            self.trace_data.changed_comments.clear()
 
     def dialog_save_trace_as_json(self):
         """Shows a dialog to save trace to JSON file"""
-        filename = QFileDialog.getSaveFileName(
-            self, "Save as JSON", "", "JSON files (*.txt);; All files (*.*)"
-        )[0]
+        json_lines = "JSON Lines files (*.jsonl)"
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Save as JSON",
+            "",
+            "JSON files (*.txt);; " + json_lines + ";; All files (*.*)",
+        )
         print_debug("Save trace as: " + filename)
-        if filename:
+        if not filename:
+            return
+        if selected_filter == json_lines or filename.endswith(".jsonl"):
+            trace_files.save_as_jsonl(self.trace_data, filename)
+        else:
             trace_files.save_as_json(self.trace_data, filename)
 
     def execute_plugin(self, plugin):
         """Executes a plugin and updates tables"""
+        if self.trace_loader is not None:
+            print_debug("Plugins can be run when the trace has been loaded.")
+            return
         print_debug(f"Executing a plugin: {plugin.name}")
         try:
             plugin.plugin_object.execute(self.api)
@@ -472,27 +547,213 @@ class MainWindow(QMainWindow):
         else:
             print_debug("Unknown field edited on bookmark table...")
 
-    def open_trace(self, filename):
-        """Opens and reads a trace file"""
+    def open_trace(self, filename, follow=False):
+        """Starts loading a trace file in a worker thread
+
+        Rows are shown as soon as they are loaded.
+
+        Args:
+            filename (str): Trace file name
+            follow (bool): Keep following the file for new rows after loading
+        """
         print_debug(f"Opening trace file: {filename}")
+        self.cancel_loading(wait=True)
         self.close_trace()
-        self.trace_data = trace_files.open_trace(filename)
-        if self.trace_data is None:
-            print_debug(f"Error, couldn't open trace file: {filename}")
+        self.trace_loader = TraceLoader(filename, self, follow)
+        self.trace_loader.rowsLoaded.connect(self.on_trace_rows_loaded)
+        self.trace_loader.loadFinished.connect(self.on_trace_loaded)
+        self.cancel_loading_action.setEnabled(True)
+        self.set_plugins_enabled(False)
+        self.set_save_enabled(False)
+        self.trace_loader.start()
+
+    def cancel_loading(self, wait=False):
+        """Cancels loading a trace
+
+        Args:
+            wait (bool): Wait until the worker thread has stopped and forget
+                the loader, its pending signals are ignored
+        """
+        loader = self.trace_loader
+        if loader is None:
+            return
+        loader.cancel()
+        if wait:
+            loader.wait()
+            self.trace_loader = None
+            self.loaded_trace = None
+            self.load_status = ""
+            self.cancel_loading_action.setEnabled(False)
+            self.set_plugins_enabled(True)
+
+    def on_trace_rows_loaded(self, trace_data, row_count, done, total):
+        """Shows the rows loaded so far, called while a trace is loading"""
+        loader = self.trace_loader
+        if self.sender() is not loader:
+            return
+        first_rows = self.trace_data is None
+        self.trace_data = trace_data
+        self.loaded_trace = TracePrefix(trace_data.trace, row_count)
+        if self.select_trace_combo_box.currentIndex() == 0:
+            self.trace_table.set_data(self.loaded_trace)
+            if first_rows:
+                self.show_first_page()
+            elif self.is_trace_page_incomplete():
+                self.trace_table.populate()
+
+        elapsed = loader.get_elapsed_time()
+        rows_per_second = row_count / elapsed if elapsed > 0 else 0
+        percent = 100 * done // total if total else 0
+        self.load_status = (
+            f"Loading: {percent}% | {row_count} rows | {rows_per_second:.0f} rows/s"
+        )
+        self.update_status_bar()
+
+    def on_trace_loaded(self, trace_data):
+        """Shows the full trace, called when loading has finished"""
+        loader = self.trace_loader
+        if self.sender() is not loader:
+            return
+        self.trace_loader = None
+        self.loaded_trace = None
+        self.load_status = ""
+        self.cancel_loading_action.setEnabled(False)
+        self.set_plugins_enabled(True)
+        if trace_data is None:
+            if not loader.cancelled:
+                print_debug(f"Error, couldn't open trace file: {loader.filename}")
+            self.close_trace()
+            self.follow_action.setChecked(False)
+            self.status_bar.showMessage(
+                "Loading cancelled." if loader.cancelled else "Loading failed."
+            )
+            return
+
+        print_debug(
+            f"{len(trace_data.trace)} rows loaded in "
+            f"{loader.get_elapsed_time():.2f} s"
+        )
+        first_rows = self.trace_data is None
+        self.trace_data = trace_data
+        self.set_save_enabled(True)
+        self.follow_action.setEnabled(True)
+        if trace_data.follower is not None:
+            self.follow_timer.start(prefs.FOLLOW_INTERVAL)
         else:
-            if prefs.PAGINATION_ENABLED:
-                self.trace_pagination.set_current_page(1, True)
-            self.trace_table.get_syntax_highlighter().reset()
+            self.follow_action.setChecked(False)
+        if self.select_trace_combo_box.currentIndex() == 0:
             self.trace_table.set_data(self.trace_data.trace)
-            self.trace_table.populate()
-            self.trace_table.selectRow(0)
-            self.setWindowTitle(f"{filename.split('/')[-1]} - {prefs.PACKAGE_NAME}")
-
+            if first_rows:
+                self.show_first_page()
+            else:
+                self.trace_table.populate()
+        filename = loader.filename
+        self.setWindowTitle(f"{filename.split('/')[-1]} - {prefs.PACKAGE_NAME}")
         self.update_bookmark_table()
+        if self.filtered_while_loading:
+            # filter was run on a part of trace, run it again on the full trace
+            self.on_filter_btn_clicked(self.filter_text)
+        self.update_status_bar()
+
+    def show_first_page(self):
+        """Shows the first page of trace on trace table"""
+        if prefs.PAGINATION_ENABLED:
+            self.trace_pagination.set_current_page(1, True)
+        self.trace_table.get_syntax_highlighter().reset()
+        self.trace_table.populate()
+        self.trace_table.selectRow(0)
         self.trace_table.update_column_widths()
 
+    def is_trace_page_incomplete(self):
+        """Returns True if current page of trace table is not full"""
+        if not prefs.PAGINATION_ENABLED:
+            return False
+        return self.trace_table.rowCount() < self.trace_pagination.rows_per_page
+
+    def get_loaded_trace(self):
+        """Returns full trace, or the loaded rows if trace is still loading"""
+        if self.loaded_trace is not None:
+            return self.loaded_trace
+        return self.trace_data.trace
+
+    def get_regchanges(self, row_id):
+        """Returns register change text of a trace row"""
+        if self.trace_data is None:
+            return ""
+        return self.trace_data.get_regchanges(row_id)
+
+    def set_following(self, enabled):
+        """Starts or stops following the trace file for new rows
+
+        A trace which was not loaded for following is loaded again first,
+        because the end of its rows and register state are not known.
+        """
+        if not enabled:
+            self.follow_timer.stop()
+            return
+        if self.trace_data is None or not self.trace_data.filename:
+            self.follow_action.setChecked(False)
+            return
+        if self.trace_data.follower is None:
+            self.open_trace(self.trace_data.filename, follow=True)
+        else:
+            self.follow_timer.start(prefs.FOLLOW_INTERVAL)
+
+    def on_follow_timer(self):
+        """Adds rows written to the followed trace file"""
+        if self.trace_data is None or self.trace_loader is not None:
+            return
+        follower = self.trace_data.follower
+        first_row = len(self.trace_data.trace)
+        try:
+            row_count = follower.poll()
+        except Exception:
+            print("Error, could not read new rows:")
+            print(traceback.format_exc())
+            self.follow_action.setChecked(False)
+            return
+        if row_count:
+            self.on_trace_rows_appended(first_row)
+        if follower.done:
+            journal = self.trace_data.journal
+            if follower.bookmarks and (journal is None or journal.bookmarks is None):
+                # journaled bookmarks replace the bookmarks of the file
+                for bookmark in follower.bookmarks:
+                    self.trace_data.add_bookmark(bookmark)
+                self.update_bookmark_table()
+            print_debug("End of trace file, stopped following.")
+            self.follow_action.setChecked(False)
+
+    def on_trace_rows_appended(self, first_row):
+        """Shows rows appended to a followed trace
+
+        Only the new rows are filtered. The current page is populated again
+        only if it is not full, other pages are shown when they are opened.
+
+        Args:
+            first_row (int): Index of the first new row
+        """
+        if self.filter_text:
+            try:
+                new_rows = filter_new_rows(
+                    self.trace_data.trace,
+                    self.trace_data.get_regs(),
+                    self.filter_text,
+                    first_row,
+                )
+            except Exception as exc:
+                print(f"Filter error: {exc}")
+            else:
+                self.filtered_trace.extend(new_rows)
+        self.trace_table.update_pagination()
+        if not prefs.PAGINATION_ENABLED or self.is_trace_page_incomplete():
+            self.trace_table.populate()
+        self.update_status_bar()
+
     def close_trace(self):
         """Clears trace and updates UI"""
+        self.follow_timer.stop()
+        self.set_save_enabled(False)
         self.trace_data = None
         self.filtered_trace = []
         self.trace_table.set_data([])
@@ -505,11 +766,13 @@ class MainWindow(QMainWindow):
         self.update_status_bar()
 
     def save_trace(self):
-        """Saves a trace file"""
+        """Saves comments and bookmarks to the annotation journal of trace file"""
+        if self.trace_data is None or self.trace_loader is not None:
+            return
         filename = self.trace_data.filename
         print_debug("Save trace: " + filename)
         if filename:
-            trace_files.save_as_tv_trace(self.trace_data, filename)
+            trace_files.save_annotations(self.trace_data)
 
     def show_about_dialog(self):
         """Shows an about dialog"""
@@ -552,6 +815,9 @@ class MainWindow(QMainWindow):
         if bookmark:
             msg += f" | Bookmark: {bookmark.disasm}   ; {bookmark.comment}"
 
+        if self.load_status:
+            msg += f" | {self.load_status}"
+
         self.status_bar.showMessage(msg)
 
     def on_reg_checkbox_change(self, reg: str, is_checked: bool):
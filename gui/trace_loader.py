@@ -0,0 +1,68 @@
+import time
+import traceback
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from core import trace_files
+
+# minimum time between progress signals, in seconds
+PROGRESS_INTERVAL = 0.25
+
+
+class TraceLoader(QThread):
+    """Loads a trace file in a worker thread
+
+    Progress is reported with rowsLoaded signals while rows are decoded, so
+    the rows loaded so far can be shown before the whole trace is loaded.
+
+    Attributes:
+        filename (str): Trace file name
+        follow (bool): Load the trace so that it can be followed
+        start_time (float): Time when loading started
+        cancelled (bool): True if cancel() was called
+    """
+
+    # trace_data, number of loaded rows, bytes done, bytes total
+    rowsLoaded = pyqtSignal(object, int, int, int)
+    # trace_data, None if loading failed or was cancelled
+    loadFinished = pyqtSignal(object)
+
+    def __init__(self, filename, parent=None, follow=False):
+        super().__init__(parent)
+        self.filename = filename
+        self.follow = follow
+        self.start_time = 0.0
+        self.cancelled = False
+        self.last_progress_time = 0.0
+
+    def run(self):
+        """Loads the trace, runs in the worker thread"""
+        self.start_time = time.perf_counter()
+        trace_data = None
+        try:
+            trace_data = trace_files.open_trace(
+                self.filename, self.on_progress, self.follow
+            )
+        except trace_files.LoadCancelled:
+            print(f"Loading {self.filename} cancelled.")
+        except Exception:
+            print(f"Error, could not load {self.filename}")
+            print(traceback.format_exc())
+        self.loadFinished.emit(trace_data)
+
+    def cancel(self):
+        """Asks the worker thread to stop loading"""
+        self.cancelled = True
+
+    def get_elapsed_time(self):
+        """Returns seconds since loading started"""
+        return time.perf_counter() - self.start_time
+
+    def on_progress(self, trace_data, done, total):
+        """Progress callback of trace_files.open_trace()"""
+        if self.cancelled:
+            raise trace_files.LoadCancelled()
+        now = time.perf_counter()
+        if now - self.last_progress_time >= PROGRESS_INTERVAL or done >= total:
+            self.last_progress_time = now
+            self.rowsLoaded.emit(trace_data, len(trace_data.trace), done, total)
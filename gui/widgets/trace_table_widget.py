@@ -15,6 +15,7 @@ class TraceTableWidget(QTableWidget):
     def __init__(self, parent=None):
         super(TraceTableWidget, self).__init__(parent)
         self.printer = self.print_debug
+        self.regchanges_getter = None
         self.trace = []
         self.pagination = None
         self.menu = None
@@ -195,7 +196,10 @@ class TraceTableWidget(QTableWidget):
             disasm_item = QTableWidgetItem(trace[i]["disasm"])
             disasm_item.setFlags(disasm_item.flags() & ~Qt.ItemIsEditable)
 
-            regchanges_item = QTableWidgetItem(trace[i].get("regchanges", ""))
+            regchanges = ""
+            if self.regchanges_getter is not None:
+                regchanges = self.regchanges_getter(trace[i]["id"])
+            regchanges_item = QTableWidgetItem(regchanges)
             regchanges_item.setFlags(regchanges_item.flags() & ~Qt.ItemIsEditable)
             regchanges_item.setWhatsThis("regchanges")
 
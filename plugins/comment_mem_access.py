@@ -31,7 +31,7 @@ class PluginCommentMemAccesses(IPlugin):
 
                 # Add comment to full trace
                 row = t["id"]
-                trace_data.trace[row]['comment'] = comment
+                trace_data.set_comment(row, comment)
 
                 # Add comment to visible trace too because it could be filtered_trace
                 trace[i]['comment'] = comment
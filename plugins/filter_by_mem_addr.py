@@ -30,8 +30,25 @@ class PluginFilterByMemAddress(IPlugin):
         else:
             trace = api.get_filtered_trace()
 
-        result_trace = []
+        if hasattr(trace, "get_mem_addr_rows"):
+            # full trace has an index of rows by memory address
+            access = (None, "READ", "WRITE")[access_types]
+            rows = trace.get_mem_addr_rows(addr, addr + size, access)
+            result_trace = [trace[i].copy() for i in rows]
+        else:
+            result_trace = self.filter_rows(trace, addr, size, access_types)
+
+        if len(result_trace) > 0:
+            print(f"Length of filtered trace: {len(result_trace)}")
+            api.set_filtered_trace(result_trace)
+            api.show_filtered_trace()
+        else:
+            api.show_messagebox(
+                "Error", "Could not find any rows accessing given memory area"
+            )
 
+    def filter_rows(self, trace, addr: int, size: int, access_types: int):
+        result_trace = []
         for t in trace:
             for mem in t["mem"]:
                 if mem["access"].upper() == "READ" and access_types == 2:
@@ -41,15 +58,7 @@ class PluginFilterByMemAddress(IPlugin):
                 if addr <= mem["addr"] <= (addr + size):
                     result_trace.append(t.copy())
                     break  # avoid adding the same row more than once
-
-        if len(result_trace) > 0:
-            print(f"Length of filtered trace: {len(result_trace)}")
-            api.set_filtered_trace(result_trace)
-            api.show_filtered_trace()
-        else:
-            api.show_messagebox(
-                "Error", "Could not find any rows accessing given memory area"
-            )
+        return result_trace
 
     def str_to_int(self, s: str):
         result = 0
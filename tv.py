@@ -6,6 +6,7 @@ from core import prefs
 from gui.mainwindow import MainWindow
 
 if __name__ == "__main__":
+    prefs.WORKERS = prefs.GUI_WORKERS
     APP = QtWidgets.QApplication(sys.argv)
     if prefs.USE_DARK_THEME:
         APP.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
@@ -0,0 +1,123 @@
+"""Processes trace files without the GUI
+
+Loads trace files, filters them, runs plugins and saves the results.
+Files are processed in parallel worker processes. PyQt5 is not imported.
+
+Example:
+    python tv_batch.py -f "disasm=xor" -p "Print execution counts" \\
+        -o filtered traces/*.tvt
+"""
+
+import argparse
+import sys
+
+from core import prefs
+from core.batch import OUTPUT_FORMATS, PLUGIN_DIR, BatchOptions, process_files
+
+
+def parse_args(argv):
+    """Parses command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Load, filter and convert traces and run plugins on them."
+    )
+    parser.add_argument("files", nargs="+", help="trace files")
+    parser.add_argument(
+        "-f", "--filter", default="", help="filter, like in the filter box of GUI"
+    )
+    parser.add_argument(
+        "-p",
+        "--plugin",
+        action="append",
+        default=[],
+        help="name or module of a plugin to run, can be given many times",
+    )
+    parser.add_argument(
+        "--plugin-dir",
+        default=PLUGIN_DIR,
+        help="plugin directory (default: plugins directory of the viewer)",
+    )
+    parser.add_argument(
+        "--value",
+        action="append",
+        default=[],
+        metavar="LABEL=VALUE",
+        help="answer to an input dialog of a plugin, can be given many times",
+    )
+    parser.add_argument(
+        "--yes", action="store_true", help="answer yes to questions of plugins"
+    )
+    parser.add_argument(
+        "-o", "--output-dir", help="save processed traces to this directory"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(OUTPUT_FORMATS),
+        default="tvt",
+        help="format of saved traces (default: tvt)",
+    )
+    parser.add_argument(
+        "--rows",
+        metavar="FIRST-LAST",
+        help="export only these rows to tvt files without loading whole traces",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=prefs.WORKERS,
+        help="number of worker processes, 0 = number of CPUs (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    values = {}
+    for value in args.value:
+        label, sep, text = value.partition("=")
+        if not sep:
+            print(f"Error, expected LABEL=VALUE: {value}")
+            return 2
+        values[label] = text
+    rows = None
+    if args.rows:
+        try:
+            first_row, last_row = (int(row, 0) for row in args.rows.split("-"))
+        except ValueError:
+            print(f"Error, expected FIRST-LAST: {args.rows}")
+            return 2
+        if args.filter or args.plugin or args.format != "tvt":
+            print("Error, --rows can not be used with filters, plugins or --format")
+            return 2
+        if args.output_dir is None:
+            print("Error, --rows needs an output directory (-o)")
+            return 2
+        rows = (first_row, last_row)
+    options = BatchOptions(
+        filter_text=args.filter,
+        plugins=args.plugin,
+        plugin_dir=args.plugin_dir,
+        output_dir=args.output_dir,
+        output_format=args.format,
+        answer_yes=args.yes,
+        values=values,
+        rows=rows,
+    )
+    prefs.WORKERS = args.jobs
+    errors = 0
+    for result in process_files(args.files, options):
+        if result["error"] is not None:
+            errors += 1
+            print(f"{result['filename']}: error, {result['error']}")
+            continue
+        text = f"{result['filename']}: {result['rows']} rows"
+        if result["visible_rows"] != result["rows"]:
+            text += f", {result['visible_rows']} filtered"
+        if result["output"] is not None:
+            text += f", saved to {result['output']}"
+        print(text)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())